@@ -0,0 +1,61 @@
+"""
+Benchmark aggregation of member DataFrames into a multi-index DataFrame.
+
+Compares the single-pass concatenation used by :meth:`AggData.retrieve`
+against appending one member at a time, for increasing member counts.
+
+Usage::
+
+    python benchmarks/bench_aggregate.py [rows-per-member]
+
+"""
+import sys
+import timeit
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from datreant.data.agglimbs import dict2multiindex
+
+
+def make_agg(nmembers, nrows):
+    agg = OrderedDict()
+    for i in range(nmembers):
+        agg['/path/to/member{}'.format(i)] = pd.DataFrame(
+            np.random.rand(nrows, 3), columns=('A', 'B', 'C'))
+    return agg
+
+
+def append_each(agg):
+    agg_mi = None
+    for member in agg:
+        d = agg[member].copy()
+        label = len(d.index)*[member]
+        d.index = pd.MultiIndex.from_arrays([label, d.index])
+
+        if agg_mi is not None:
+            agg_mi = agg_mi.append(d)
+        else:
+            agg_mi = d
+
+    return agg_mi
+
+
+def main(nrows=10000):
+    print("{:>10} {:>14} {:>14}".format('members', 'concat (s)', 'append (s)'))
+    for nmembers in (10, 50, 100, 500, 1000):
+        agg = make_agg(nmembers, nrows)
+        t_concat = min(timeit.repeat(lambda: dict2multiindex(agg),
+                                     number=1, repeat=3))
+        if hasattr(pd.DataFrame, 'append') and nmembers <= 500:
+            t_append = min(timeit.repeat(lambda: append_each(agg),
+                                         number=1, repeat=1))
+            t_append = "{:14.4f}".format(t_append)
+        else:
+            t_append = "{:>14}".format('-')
+        print("{:>10} {:14.4f} {}".format(nmembers, t_concat, t_append))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
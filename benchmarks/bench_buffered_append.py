@@ -0,0 +1,74 @@
+"""
+Benchmark many small concurrent appends to a pandas dataset.
+
+Several worker processes each append small DataFrames to the same dataset,
+either directly, each taking the dataset's exclusive lock, or buffered,
+staging rows in per-process spool files that are compacted at the end.
+Reports appends per second, including compaction for buffered appends, and
+the size of the resulting file.
+
+Usage::
+
+    python benchmarks/bench_buffered_append.py [appends] [rows] [workers]
+
+"""
+import os
+import sys
+import shutil
+import tempfile
+import time
+import multiprocessing as mp
+
+import numpy as np
+import pandas as pd
+
+import datreant.core as dtr
+import datreant.data.attach
+from datreant.data import pddata
+
+
+def work(path, count, rows, buffered):
+    t = dtr.Treant(path)
+    df = pd.DataFrame(np.random.rand(rows, 4), columns=['A', 'B', 'C', 'D'])
+    for i in range(count):
+        t.data.append('appends', df, buffered=buffered, buffersize=None)
+
+
+def main(appends=2000, rows=10, workers=4):
+    appends, rows, workers = int(appends), int(rows), int(workers)
+    per_worker = appends // workers
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        print("{:>9} {:>12} {:>9}".format('mode', 'appends/s', 'size MB'))
+        for buffered in (False, True):
+            t = dtr.Treant(os.path.join(tmpdir, 'bench-{}'.format(buffered)))
+            t.data.add('appends', pd.DataFrame(
+                np.random.rand(rows, 4), columns=['A', 'B', 'C', 'D']),
+                profile='appendable')
+
+            start = time.time()
+            procs = [mp.Process(target=work, args=(t.abspath, per_worker,
+                                                   rows, buffered))
+                     for i in range(workers)]
+            for p in procs:
+                p.start()
+            for p in procs:
+                p.join()
+            if buffered:
+                t.data.compact('appends')
+            elapsed = time.time() - start
+
+            assert len(t.data['appends']) == rows * (per_worker * workers + 1)
+
+            size = os.path.getsize(
+                os.path.join(t.abspath, 'appends', pddata.pddatafile))
+            print("{:>9} {:12.1f} {:9.2f}".format(
+                'buffered' if buffered else 'direct',
+                per_worker * workers / elapsed, size / 1e6))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
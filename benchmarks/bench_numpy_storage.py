@@ -0,0 +1,66 @@
+"""
+Benchmark storage options for numpy arrays.
+
+Writes and reads a float array resembling a trajectory (a random walk) with
+several chunking and compression settings, reporting write and read
+throughput along with the size on disk.
+
+Usage::
+
+    python benchmarks/bench_numpy_storage.py [frames] [atoms]
+
+"""
+import os
+import sys
+import shutil
+import tempfile
+import timeit
+
+import numpy as np
+
+import datreant.core as dtr
+import datreant.data.attach
+from datreant.data import npdata
+
+
+SETTINGS = [
+    ('contiguous', dict()),
+    ('chunked', dict(chunks='auto')),
+    ('lzf', dict(compression='lzf')),
+    ('lzf+shuffle', dict(compression='lzf', shuffle=True)),
+    ('gzip-1+shuffle', dict(compression='gzip', compression_opts=1,
+                            shuffle=True)),
+    ('gzip-4+shuffle', dict(compression='gzip', compression_opts=4,
+                            shuffle=True)),
+    ('gzip-9+shuffle', dict(compression='gzip', compression_opts=9,
+                            shuffle=True)),
+]
+
+
+def main(frames=1000, atoms=3000):
+    data = np.cumsum(np.random.normal(scale=0.01, size=(frames, atoms, 3)),
+                     axis=0).astype(np.float32)
+    nbytes = float(data.nbytes)
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        t = dtr.Treant(os.path.join(tmpdir, 'bench'))
+        print("{:>16} {:>12} {:>12} {:>10} {:>8}".format(
+            'setting', 'write MB/s', 'read MB/s', 'size MB', 'ratio'))
+        for name, kwargs in SETTINGS:
+            t_write = min(timeit.repeat(
+                lambda: t.data.add('traj', data, **kwargs),
+                number=1, repeat=3))
+            t_read = min(timeit.repeat(
+                lambda: t.data.retrieve('traj'), number=1, repeat=3))
+            size = os.path.getsize(
+                os.path.join(t.abspath, 'traj', npdata.npdatafile))
+            print("{:>16} {:12.1f} {:12.1f} {:10.1f} {:8.2f}".format(
+                name, nbytes / t_write / 1e6, nbytes / t_read / 1e6,
+                size / 1e6, nbytes / size))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,84 @@
+"""
+Benchmark compression settings for pandas DataFrames.
+
+Writes and reads representative DataFrames, a smooth timeseries of floats
+and a frame of small integers and flags, with several compression libraries
+and levels, reporting write and read throughput along with the size on disk.
+
+Usage::
+
+    python benchmarks/bench_pandas_compression.py [rows] [profile]
+
+"""
+import os
+import sys
+import shutil
+import tempfile
+import timeit
+
+import numpy as np
+import pandas as pd
+
+import datreant.core as dtr
+import datreant.data.attach
+from datreant.data import pddata
+
+
+SETTINGS = [
+    ('none', dict(complevel=0)),
+    ('zlib-1', dict(complib='zlib', complevel=1)),
+    ('zlib-5', dict(complib='zlib', complevel=5)),
+    ('blosc-5', dict(complib='blosc', complevel=5)),
+    ('blosc:lz4-1', dict(complib='blosc:lz4', complevel=1)),
+    ('blosc:lz4-5', dict(complib='blosc:lz4', complevel=5)),
+    ('blosc:zstd-5', dict(complib='blosc:zstd', complevel=5)),
+    ('blosc:zstd-9', dict(complib='blosc:zstd', complevel=9)),
+]
+
+
+def make_frames(rows):
+    """Build the frames to benchmark with.
+
+    """
+    timeseries = pd.DataFrame(
+        np.cumsum(np.random.normal(scale=0.01, size=(rows, 6)), axis=0),
+        columns=['x', 'y', 'z', 'vx', 'vy', 'vz'],
+        index=pd.Index(np.arange(rows) * 0.002, name='time'))
+
+    counts = pd.DataFrame({
+        'frame': np.arange(rows),
+        'contacts': np.random.poisson(12, size=rows),
+        'bound': np.random.rand(rows) > 0.8,
+        'state': np.random.randint(0, 4, size=rows)})
+
+    return [('timeseries', timeseries), ('counts', counts)]
+
+
+def main(rows=1000000, profile='queryable'):
+    rows = int(rows)
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        t = dtr.Treant(os.path.join(tmpdir, 'bench'))
+        print("{:>11} {:>13} {:>11} {:>11} {:>9} {:>7}".format(
+            'frame', 'setting', 'write MB/s', 'read MB/s', 'size MB',
+            'ratio'))
+        for name, df in make_frames(rows):
+            nbytes = float(df.memory_usage(index=True).sum())
+            for setting, kwargs in SETTINGS:
+                t_write = min(timeit.repeat(
+                    lambda: t.data.add(name, df, profile=profile, **kwargs),
+                    number=1, repeat=3))
+                t_read = min(timeit.repeat(
+                    lambda: t.data.retrieve(name), number=1, repeat=3))
+                size = os.path.getsize(
+                    os.path.join(t.abspath, name, pddata.pddatafile))
+                print("{:>11} {:>13} {:11.1f} {:11.1f} {:9.1f} {:7.2f}".format(
+                    name, setting, nbytes / t_write / 1e6,
+                    nbytes / t_read / 1e6, size / 1e6, nbytes / size))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
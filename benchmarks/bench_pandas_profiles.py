@@ -0,0 +1,59 @@
+"""
+Benchmark storage profiles for pandas DataFrames.
+
+Writes and reads DataFrames of several sizes with each storage profile,
+reporting the time to write, to read in full, and to read the last tenth of
+the rows, along with the size on disk.
+
+Usage::
+
+    python benchmarks/bench_pandas_profiles.py [rows ...]
+
+"""
+import os
+import sys
+import shutil
+import tempfile
+import timeit
+
+import numpy as np
+import pandas as pd
+
+import datreant.core as dtr
+import datreant.data.attach
+from datreant.data import pddata
+
+
+PROFILES = ['fast-read', 'queryable', 'appendable']
+
+
+def main(*sizes):
+    sizes = sizes or (10000, 100000, 1000000)
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        t = dtr.Treant(os.path.join(tmpdir, 'bench'))
+        print("{:>9} {:>11} {:>9} {:>9} {:>9} {:>9}".format(
+            'rows', 'profile', 'write s', 'read s', 'tail s', 'size MB'))
+        for rows in sizes:
+            df = pd.DataFrame(np.random.rand(rows, 8),
+                              columns=list('ABCDEFGH'))
+            for profile in PROFILES:
+                t_write = min(timeit.repeat(
+                    lambda: t.data.add('df', df, profile=profile),
+                    number=1, repeat=3))
+                t_read = min(timeit.repeat(
+                    lambda: t.data.retrieve('df'), number=1, repeat=3))
+                t_tail = min(timeit.repeat(
+                    lambda: t.data.retrieve('df', start=rows - rows // 10),
+                    number=1, repeat=3))
+                size = os.path.getsize(
+                    os.path.join(t.abspath, 'df', pddata.pddatafile))
+                print("{:>9} {:>11} {:9.3f} {:9.3f} {:9.3f} {:9.1f}".format(
+                    rows, profile, t_write, t_read, t_tail, size / 1e6))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,69 @@
+"""
+Benchmark compression of pickled python objects.
+
+Writes and reads a redundant python object, resembling a collection of
+analysis results, with each available compression, reporting write and load
+times along with the size on disk.
+
+Usage::
+
+    python benchmarks/bench_pickle_compression.py [records]
+
+"""
+import os
+import sys
+import shutil
+import tempfile
+import timeit
+
+import numpy as np
+
+import datreant.core as dtr
+import datreant.data.attach
+from datreant.data import pydata
+
+
+def make_results(records):
+    """Build a list of result records with much repeated structure.
+
+    """
+    return [{'frame': i,
+             'selection': 'protein and name CA',
+             'converged': i % 7 != 0,
+             'rmsd': float(np.round(np.random.rand(), 3)),
+             'contacts': np.random.randint(0, 50, size=20).tolist()}
+            for i in range(records)]
+
+
+def main(records=200000):
+    data = make_results(records)
+
+    settings = [('none', dict(compression=None))]
+    for compression in pydata.available_compressions():
+        settings.append((compression, dict(compression=compression)))
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        t = dtr.Treant(os.path.join(tmpdir, 'bench'))
+        print("{:>10} {:>10} {:>10} {:>10} {:>8}".format(
+            'setting', 'write s', 'load s', 'size MB', 'ratio'))
+
+        base = None
+        for name, kwargs in settings:
+            t_write = min(timeit.repeat(
+                lambda: t.data.add('results', data, **kwargs),
+                number=1, repeat=3))
+            t_read = min(timeit.repeat(
+                lambda: t.data.retrieve('results'), number=1, repeat=3))
+            size = os.path.getsize(
+                os.path.join(t.abspath, 'results', pydata.pydatafile))
+            if base is None:
+                base = float(size)
+            print("{:>10} {:10.3f} {:10.3f} {:10.2f} {:8.2f}".format(
+                name, t_write, t_read, size / 1e6, base / size))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
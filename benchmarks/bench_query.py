@@ -0,0 +1,65 @@
+"""
+Benchmark reductions over a dataset stored in many members of a Bundle.
+
+Compares reducing with :meth:`AggData.query`, which pushes the selection to
+each member's store and returns only partial results, against retrieving
+the aggregated DataFrame with :meth:`AggData.retrieve` and reducing it in
+memory. Reports the time taken and the peak size of the data held.
+
+Usage::
+
+    python benchmarks/bench_query.py [members] [rows-per-member]
+
+"""
+import os
+import sys
+import shutil
+import tempfile
+import timeit
+
+import numpy as np
+import pandas as pd
+
+import datreant.core as dtr
+import datreant.data.attach
+
+
+def main(nmembers=100, nrows=100000):
+    nmembers, nrows = int(nmembers), int(nrows)
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        members = []
+        for i in range(nmembers):
+            t = dtr.Treant(os.path.join(tmpdir, 'member{}'.format(i)))
+            t.data.add('frames', pd.DataFrame({
+                'energy': np.random.normal(size=nrows),
+                'rmsd': np.random.rand(nrows),
+                'state': np.random.randint(0, 4, size=nrows)}))
+            members.append(t)
+        b = dtr.Bundle(*members)
+
+        def query():
+            return b.data.query('frames', agg='mean', where='rmsd < 0.1',
+                                columns=['energy'], groupby='state')
+
+        def retrieve():
+            df = b.data.retrieve('frames', where='rmsd < 0.1',
+                                 columns=['energy', 'state'])
+            return df.groupby('state')[['energy']].mean(), df
+
+        print("{:>10} {:>10} {:>12}".format('method', 'time (s)', 'held MB'))
+        t_query = min(timeit.repeat(query, number=1, repeat=3))
+        held = query().memory_usage(deep=True).sum()
+        print("{:>10} {:10.3f} {:12.3f}".format('query', t_query, held / 1e6))
+
+        t_retrieve = min(timeit.repeat(retrieve, number=1, repeat=3))
+        held = retrieve()[1].memory_usage(deep=True).sum()
+        print("{:>10} {:10.3f} {:12.3f}".format('retrieve', t_retrieve,
+                                                held / 1e6))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
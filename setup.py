@@ -38,5 +38,9 @@ setup(name='datreant.data',
           'pandas',
           'tables',
           'h5py',
-          ]
+          'futures; python_version < "3.0"',
+          ],
+      extras_require={
+          'compression': ['zstandard', 'lz4'],
+          },
       )
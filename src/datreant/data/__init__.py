@@ -8,10 +8,20 @@ datreant.data --- numpy and pandas data storage for Treants in HDF5
 ===================================================================
 
 """
+import sys
+
 from datreant.core import Treant, Tree, Bundle, View, Group
 
 from .core import DataFile
 from . import pydata, npdata, pddata
+from . import parallel
+from . import lazy
+from . import pool
+from . import cache
+from . import shm
+from . import spool
+if sys.version_info >= (3, 5):
+    from . import aio
 from . import tests
 from . import limbs
 from . import agglimbs
@@ -2,13 +2,210 @@
 AggLimbs for convenient Treant data storage and retrieval.
 
 """
+import sys
+from collections import OrderedDict
+
 import six
 import pandas as pd
 
+from datreant.core import Tree
 from datreant.core.agglimbs import AggTreeLimb
+from . import parallel
+from . import pool
+from .limbs import Data
+
+if sys.version_info >= (3, 5):
+    from .aio import AsyncAggData
+else:
+    AsyncAggData = object
+
+
+def _retrieve_member(path, handle, kwargs):
+    """Retrieve a dataset from the Tree at *path*.
+
+    Defined at module level so that it can be shipped to worker processes.
+
+    :Returns:
+        *found*
+            True if the member has a dataset for *handle*
+        *data*
+            the stored data; ``None`` if not found
+
+    """
+    try:
+        return True, Data(Tree(path)).retrieve(handle, **kwargs)
+    except KeyError:
+        return False, None
+
+
+def _info_member(path, handle):
+    """Get metadata for a dataset from the Tree at *path*.
+
+    Defined at module level so that it can be shipped to worker processes.
+
+    :Returns:
+        *found*
+            True if the member has a dataset for *handle*
+        *info*
+            metadata for the dataset; ``None`` if not found
+
+    """
+    try:
+        return True, Data(Tree(path)).info(handle)
+    except KeyError:
+        return False, None
+
+
+def dict2multiindex(agg):
+    """Aggregate a dictionary of pandas Series or DataFrames into one.
+
+    The structures are concatenated in a single pass, with a new outermost
+    level added to the index giving the key each set of rows came from. This
+    is linear in the total number of rows, unlike appending one structure at
+    a time.
+
+    :Arguments:
+        *agg*
+            dictionary of Series or DataFrames, keyed by member
+
+    :Returns:
+        *agg_mi*
+            multi-index Series or DataFrame; ``None`` if *agg* is empty
+
+    """
+    if not agg:
+        return None
+
+    return pd.concat(list(agg.values()), keys=list(agg.keys()))
+
+
+#: reductions that can be computed by :meth:`AggData.query`, giving for each
+#: the partial results it is computed from
+reductions = OrderedDict([('sum', ('sum',)),
+                          ('count', ('count',)),
+                          ('min', ('min',)),
+                          ('max', ('max',)),
+                          ('mean', ('sum', 'count'))])
+
+#: how partial results of each kind are combined
+_combine = {'sum': 'sum', 'count': 'sum', 'min': 'min', 'max': 'max'}
+
+
+def _partials(chunk, stats, groupby):
+    """Compute partial results of reductions over a chunk of rows.
+
+    :Returns:
+        *partials*
+            dictionary giving, for each partial result, a DataFrame with a
+            row for each group, or a single row if *groupby* is ``None``
+
+    """
+    if isinstance(chunk, pd.Series):
+        chunk = chunk.to_frame()
+    elif not isinstance(chunk, pd.DataFrame):
+        raise TypeError('Only pandas Series and DataFrames can be queried.')
+
+    if groupby is None:
+        return {stat: getattr(chunk, stat)().to_frame().T.infer_objects()
+                for stat in stats}
+
+    grouped = chunk.groupby(groupby)
+    return {stat: getattr(grouped, stat)() for stat in stats}
+
+
+def _merge_partials(partials, stats, groupby):
+    """Combine partial results of reductions into one row per group.
+
+    :Arguments:
+        *partials*
+            list of partial results, as given by :func:`_partials`
+
+    """
+    merged = dict()
+    for stat in stats:
+        frame = pd.concat([partial[stat] for partial in partials])
+        if groupby is None:
+            merged[stat] = getattr(
+                frame, _combine[stat])().to_frame().T.infer_objects()
+        else:
+            levels = list(range(frame.index.nlevels))
+            grouped = frame.groupby(level=levels if len(levels) > 1 else 0)
+            merged[stat] = getattr(grouped, _combine[stat])()
+
+    return merged
+
+
+def _finish(merged, agg, groupby):
+    """Compute the reductions asked for from merged partial results.
+
+    """
+    aggs = [agg] if isinstance(agg, six.string_types) else list(agg)
+
+    results = OrderedDict()
+    for name in aggs:
+        if name == 'mean':
+            results[name] = merged['sum'] / merged['count']
+        else:
+            results[name] = merged[name]
+
+    if groupby is None:
+        out = pd.concat(list(results.values()))
+        out.index = aggs
+        return out.iloc[0] if isinstance(agg, six.string_types) else out
+
+    if isinstance(agg, six.string_types):
+        return results[agg]
+
+    out = pd.concat(list(results.values()), axis=1, keys=aggs)
+    out = out.swaplevel(0, 1, axis=1)
+    return out[[(column, name) for column in results[aggs[0]].columns
+                for name in aggs]]
+
+
+def _query_member(path, handle, kwargs):
+    """Reduce a dataset from the Tree at *path* to partial results.
+
+    Defined at module level so that it can be shipped to worker processes.
 
+    :Returns:
+        *found*
+            True if the member has a dataset for *handle*
+        *merged*
+            the member's partial results, merged; ``None`` if not found
 
-class AggData(AggTreeLimb):
+    """
+    stats, groupby = kwargs['stats'], kwargs['groupby']
+    data = Data(Tree(path))
+
+    # the member's file is opened once for all of its chunks
+    with pool.session():
+        try:
+            chunks = data.iter_chunks(handle, chunksize=kwargs['chunksize'],
+                                      where=kwargs['where'],
+                                      columns=kwargs['columns'])
+            partials = [_partials(chunk, stats, groupby) for chunk in chunks]
+        except KeyError:
+            return False, None
+
+        if not partials:
+            # no rows stored; reduce an empty selection for the columns
+            empty = data.retrieve(handle, start=0, stop=0,
+                                  columns=kwargs['columns'])
+            partials = [_partials(empty, stats, groupby)]
+
+    return True, _merge_partials(partials, stats, groupby)
+
+
+def _add_many_member(path, datasets, kwargs):
+    """Store datasets in the Tree at *path*.
+
+    Defined at module level so that it can be shipped to worker processes.
+
+    """
+    return Data(Tree(path)).add_many(datasets, **kwargs)
+
+
+class AggData(AsyncAggData, AggTreeLimb):
     """Manipulators for collection data.
 
     """
@@ -84,7 +281,324 @@ class AggData(AggTreeLimb):
     def all(self):
         return self.keys('all')
 
-    def retrieve(self, handle, by='path', **kwargs):
+    def _get_indexer(self, by):
+        """Get function giving the key for each member in aggregated output.
+
+        :Arguments:
+            *by*
+                'path' uses member path, 'name' uses member names, 'uuid' uses
+                member uuids
+
+        :Returns:
+            *get_index*
+                function giving the key for a given member
+
+        """
+        if by == 'path':
+            def get_index(member): return member.abspath
+        elif by == 'uuid':
+            def get_index(member): return member.uuid
+        elif by == 'name':
+            def get_index(member): return member.name
+            names = [member.name for member in self._collection]
+            if len(set(names)) != len(names):
+                raise KeyError(
+                        "Member names not unique; data structure may not"
+                        " look as expected. Set `by` to 'path' or 'uuid'"
+                        " to avoid this.")
+        else:
+            raise ValueError(
+                    "*by* keyword must be either 'path', 'name', or 'uuid'")
+
+        return get_index
+
+    def add_many(self, datasets, by='path', workers=None, executor=None,
+                 **kwargs):
+        """Store several datasets in every member at once.
+
+        Each member stores the datasets as with
+        :meth:`datreant.data.limbs.Data.add_many`. Members are independent,
+        so they can be written to concurrently.
+
+        :Arguments:
+            *datasets*
+                dictionary giving the data structure to store for each handle
+
+        :Keywords:
+            *by*
+                key given for each member in output; 'path' uses member path,
+                'name' uses member names, 'uuid' uses member uuids ['path']
+            *workers*
+                number of members to write to concurrently; ``None`` writes
+                to members serially [``None``]
+            *executor*
+                'thread' to write with a thread pool, 'process' to use a
+                process pool, or an existing
+                :class:`concurrent.futures.Executor` to submit writes to
+                ['thread']
+
+        All other keywords are storage options applied to each dataset; see
+        :meth:`datreant.data.limbs.Data.add`.
+
+        :Returns:
+            *timings*
+                dictionary giving, for each member, a dictionary of the time
+                taken to store each dataset, in seconds
+
+        """
+        get_index = self._get_indexer(by)
+        members = [member for member in self._collection
+                   if hasattr(member, 'data')]
+
+        results = parallel.map_ordered(
+                _add_many_member,
+                [(member.abspath, datasets, kwargs) for member in members],
+                workers=workers, executor=executor)
+
+        return OrderedDict((get_index(member), timings)
+                           for member, timings in zip(members, results))
+
+    def session(self, maxopen=16):
+        """Keep data files open for reuse within a block.
+
+        See :meth:`datreant.data.limbs.Data.session`; sessions apply to all
+        data read by the current thread, including that of every member.
+
+        :Keywords:
+            *maxopen*
+                maximum number of files to keep open; least recently used
+                files are closed first [16]
+
+        """
+        return pool.session(maxopen=maxopen)
+
+    def info(self, handle, by='path', workers=None, executor=None):
+        """Get metadata for a dataset from all members without reading it.
+
+        Each member's dataset is described as with
+        :meth:`datreant.data.limbs.Data.info`, reading only metadata, so the
+        total rows or bytes to be read can be known before retrieving::
+
+            >>> sum(info['nrows'] for info in b.data.info('mydata').values())
+            40000000
+
+        Members for which there is no data with the given handle are
+        skipped. Raises :exc:`KeyError` if dataset doesn't exist for any
+        members.
+
+        :Arguments:
+            *handle*
+                name of data to describe
+
+        :Keywords:
+            *by*
+                key given for each member; 'path' uses member path, 'name'
+                uses member names, 'uuid' uses member uuids ['path']
+            *workers*
+                number of members to read concurrently; ``None`` reads
+                members serially [``None``]
+            *executor*
+                'thread' to read members with a thread pool, 'process' to
+                use a process pool, or an existing
+                :class:`concurrent.futures.Executor` to submit reads to
+                ['thread']
+
+        :Returns:
+            *info*
+                dictionary giving the metadata for each member's dataset, in
+                member order
+
+        """
+        if handle not in self.keys('any'):
+            raise KeyError(
+                    "No dataset '{}' found in any member".format(handle))
+
+        get_index = self._get_indexer(by)
+        members = [member for member in self._collection
+                   if hasattr(member, 'data')]
+        results = parallel.map_ordered(
+                _info_member,
+                [(member.abspath, handle) for member in members],
+                workers=workers, executor=executor)
+
+        return OrderedDict((get_index(member), info)
+                           for member, (found, info) in zip(members, results)
+                           if found)
+
+    def iter_chunks(self, handle, chunksize=100000, by='path', prefetch=0,
+                    **kwargs):
+        """Iterate over a dataset from all members in chunks of rows.
+
+        Members are visited in order, and each member's dataset is read one
+        chunk at a time, so only a bounded amount of data is held in memory
+        regardless of how much is stored across all members. Members for
+        which there is no data with the given handle are skipped.
+
+        Raises :exc:`KeyError` if dataset doesn't exist for any members.
+
+        :Arguments:
+            *handle*
+                name of data to iterate over
+
+        :Keywords:
+            *chunksize*
+                number of rows in each chunk [100000]
+            *by*
+                key given for each member; 'path' uses member path, 'name'
+                uses member names, 'uuid' uses member uuids ['path']
+            *prefetch*
+                number of chunks to read ahead in a background thread; with
+                a value of 1 or more, the next chunk, which may be from the
+                next member's file, is read while the current one is
+                processed [0]
+
+        All other keywords are applied to each chunk's selection; see
+        :meth:`datreant.data.limbs.Data.iter_chunks`.
+
+        :Yields:
+            *member*
+                key for the member the chunk came from (see *by*)
+            *chunk*
+                the chunk of data
+
+        """
+        if handle not in self.keys('any'):
+            raise KeyError(
+                    "No dataset '{}' found in any member".format(handle))
+
+        get_index = self._get_indexer(by)
+        members = [member for member in self._collection
+                   if hasattr(member, 'data')]
+
+        def chunks():
+            for member in members:
+                try:
+                    memberchunks = member.data.iter_chunks(
+                        handle, chunksize=chunksize, **kwargs)
+                except KeyError:
+                    continue
+
+                key = get_index(member)
+                for chunk in memberchunks:
+                    yield key, chunk
+
+        if prefetch:
+            return parallel.prefetch(chunks(), prefetch)
+        else:
+            return chunks()
+
+    def query(self, handle, agg='sum', where=None, columns=None, groupby=None,
+              by=None, chunksize=100000, workers=None, executor=None):
+        """Reduce a pandas dataset from all members without aggregating it.
+
+        Each member's dataset is read in chunks of rows, with *where* and
+        *columns* applied by the store as each chunk is read, and each chunk
+        is reduced to partial results as soon as it is read. Only these
+        partial results are returned from each member and combined, so the
+        memory used and the data moved between workers depend on the number
+        of groups, not on the number of rows stored. For example, to get the
+        mean of columns 'A' and 'B' over rows with positive 'C', for each
+        value of 'D', across all members::
+
+            query('mydata', agg='mean', where='C > 0', columns=['A', 'B'],
+                  groupby='D')
+
+        Selections with *where* require datasets stored as tables (see
+        :meth:`datreant.data.limbs.Data.add`), with the columns in *where*
+        stored as data columns. Series are reduced as single-column
+        DataFrames. Members for which there is no data with the given handle
+        are skipped.
+
+        Raises :exc:`KeyError` if dataset doesn't exist for any members, and
+        :exc:`TypeError` if it isn't a pandas Series or DataFrame.
+
+        :Arguments:
+            *handle*
+                name of data to reduce
+
+        :Keywords:
+            *agg*
+                reduction to compute, one of 'sum', 'count', 'min', 'max', or
+                'mean', or a list of these; 'count' gives the number of
+                non-null values ['sum']
+            *where*
+                conditions for what rows to include
+            *columns*
+                list of columns to reduce; all columns by default
+            *groupby*
+                column, or list of columns, whose values give the groups to
+                reduce separately; ``None`` to reduce all rows together
+            *by*
+                if given, reduce each member separately, with results
+                indexed by member; 'path' uses member path, 'name' uses
+                member names, 'uuid' uses member uuids; ``None`` to reduce
+                all members together [``None``]
+            *chunksize*
+                number of rows to read from a member at a time [100000]
+            *workers*
+                number of members to read concurrently; ``None`` reads
+                members serially [``None``]
+            *executor*
+                'thread' to read members with a thread pool, 'process' to
+                use a process pool, or an existing
+                :class:`concurrent.futures.Executor` to submit reads to
+                ['thread']
+
+        :Returns:
+            *result*
+                without *groupby*, a Series giving the reduction of each
+                column, or a DataFrame with a row for each reduction if *agg*
+                is a list; with *groupby*, a DataFrame with a row for each
+                group, with a column for each column and reduction if *agg*
+                is a list; with *by*, results are given for each member,
+                with the member as the outermost level of the index
+
+        """
+        aggs = [agg] if isinstance(agg, six.string_types) else list(agg)
+        for name in aggs:
+            if name not in reductions:
+                raise ValueError("*agg* must be one of {}, or a list of "
+                                 "these".format(list(reductions)))
+        stats = sorted(set(stat for name in aggs for stat in reductions[name]))
+
+        if handle not in self.keys('any'):
+            raise KeyError(
+                    "No dataset '{}' found in any member".format(handle))
+
+        if columns is not None and groupby is not None:
+            groups = [groupby] if isinstance(groupby,
+                                             six.string_types) else groupby
+            columns = list(columns) + [g for g in groups if g not in columns]
+
+        members = [member for member in self._collection
+                   if hasattr(member, 'data')]
+        kwargs = {'stats': stats, 'groupby': groupby, 'where': where,
+                  'columns': columns, 'chunksize': chunksize}
+        results = parallel.map_ordered(
+                _query_member,
+                [(member.abspath, handle, kwargs) for member in members],
+                workers=workers, executor=executor)
+
+        found = [(member, merged) for member, (ok, merged)
+                 in zip(members, results) if ok]
+
+        if by is None:
+            merged = _merge_partials([merged for member, merged in found],
+                                     stats, groupby)
+            return _finish(merged, agg, groupby)
+
+        get_index = self._get_indexer(by)
+        agg_results = OrderedDict((get_index(member),
+                                   _finish(merged, agg, groupby))
+                                  for member, merged in found)
+
+        if groupby is None and isinstance(agg, six.string_types):
+            return pd.DataFrame.from_dict(agg_results, orient='index')
+
+        return dict2multiindex(agg_results)
+
+    def retrieve(self, handle, by='path', workers=None, executor=None,
+                 **kwargs):
         """Retrieve aggregated dataset from all members.
 
         This is a convenience method. The stored data structure for each member
@@ -113,6 +627,10 @@ class AggData(AggTreeLimb):
           pandas DataFrames, while some are anything else, a dictionary is
           returned
 
+        Since all data is collected into memory before it is aggregated, use
+        :meth:`iter_chunks` instead to work through data too large for this,
+        or :meth:`query` to get only reductions of the data.
+
         :Arguments:
             *handle*
                 name of data to retrieve
@@ -123,6 +641,20 @@ class AggData(AggTreeLimb):
                 path, 'name' uses member names, 'uuid' uses member uuids; if
                 names are not unique, it is better to go with 'path' or 'uuid'
                 ['path']
+            *workers*
+                number of members to read concurrently; ``None`` reads
+                members serially [``None``]
+            *executor*
+                'thread' to read members with a thread pool, 'process' to
+                use a process pool, or an existing
+                :class:`concurrent.futures.Executor` to submit reads to;
+                because HDF5 serializes library calls within a process,
+                'process' gives the most concurrency for HDF5 datasets
+                ['thread']
+
+        Member ordering is preserved in the output regardless of the order in
+        which reads complete. Each read takes the same shared lock on the
+        member's dataset that a serial read would.
 
         See :meth:`datreant.data.limbs.Data.retrieve` for more information on
         keyword usage.
@@ -147,51 +679,45 @@ class AggData(AggTreeLimb):
                 aggregated data structure
 
         """
-        def dict2multiindex(agg):
-            agg_mi = None
-            for member in agg:
-                d = agg[member]
-                label = len(d.index)*[member]
-                index = pd.MultiIndex.from_arrays([label, d.index])
-                d.index = index
-
-                if agg_mi is not None:
-                    agg_mi = agg_mi.append(d)
-                else:
-                    agg_mi = d
-
-            return agg_mi
-
         # first, check for existence in any member
         if handle not in self.keys('any'):
             raise KeyError(
                     "No dataset '{}' found in any member".format(handle))
 
-        # get indexer from *by* keyword
-        if by == 'path':
-            def get_index(member): return member.abspath
-        elif by == 'uuid':
-            def get_index(member): return member.uuid
-        elif by == 'name':
-            def get_index(member): return member.name
-            names = [member.name for member in self._collection]
-            if len(set(names)) != len(names):
-                raise KeyError(
-                        "Member names not unique; data structure may not"
-                        " look as expected. Set `by` to 'path' or 'uuid'"
-                        " to avoid this.")
-        else:
-            raise ValueError(
-                    "*by* keyword must be either 'path', 'name', or 'uuid'")
+        get_index = self._get_indexer(by)
 
         # first, collect all the data into a dictionary, the
         # lowest-common-denominator aggregation structure
-        agg = dict()
-        for member in self._collection:
-            try:
-                agg[get_index(member)] = member.data.retrieve(handle, **kwargs)
-            except (KeyError, AttributeError):
-                continue
+        members = [member for member in self._collection
+                   if hasattr(member, 'data')]
+        results = parallel.map_ordered(
+                _retrieve_member,
+                [(member.abspath, handle, kwargs) for member in members],
+                workers=workers, executor=executor)
+
+        return self._aggregate(members, results, get_index)
+
+    def _aggregate(self, members, results, get_index):
+        """Aggregate the data retrieved from each member.
+
+        :Arguments:
+            *members*
+                members data was retrieved from
+            *results*
+                for each member, whether it has the dataset and its data, as
+                given by :func:`_retrieve_member`
+            *get_index*
+                function giving the key for a given member
+
+        :Returns:
+            *data*
+                aggregated data structure
+
+        """
+        agg = OrderedDict()
+        for member, (found, data) in zip(members, results):
+            if found:
+                agg[get_index(member)] = data
 
         # if data are all Series or all DataFrames, we build a multi-index
         # Series or DataFrame (respectively)
@@ -0,0 +1,270 @@
+"""
+Asyncio interface to dataset storage and retrieval.
+
+Reading and writing datasets blocks on file I/O and locks. The coroutines
+given here run the blocking calls of :class:`Data
+<datreant.data.limbs.Data>` and :class:`AggData
+<datreant.data.agglimbs.AggData>` in a bounded pool of threads, so a single
+event loop can serve many dataset requests at once::
+
+    >>> data = await t.data.aretrieve('mydata', start=-1000)
+    >>> agg = await b.data.aretrieve('mydata', columns=['A'])
+
+The number of calls running at once is bounded by the pool's number of
+workers, and separately for each filesystem, identified by its device
+number, so that many requests to one slow filesystem don't hold up requests
+to others; calls beyond these limits wait their turn without blocking the
+event loop. Set the limits with :func:`configure`.
+
+Calls using the same data file also take turns, as do any calls made from
+separate threads; see :func:`datreant.data.pool.file_lock`.
+
+Cancelling a coroutine waiting for its turn cancels its call before it
+starts. A call already running in the pool can't be interrupted; it runs to
+completion, holding its locks as usual, and its result is discarded.
+
+Requires Python 3.5 or later.
+
+"""
+import os
+import asyncio
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+
+#: maximum number of blocking calls running at once, in total and for each
+#: filesystem
+_limits = {'workers': 8, 'per_filesystem': 4}
+
+#: the pool blocking calls are run in; created on first use
+_executor = None
+
+#: semaphores limiting calls for each filesystem, by event loop and device
+_semaphores = weakref.WeakKeyDictionary()
+
+_lock = threading.Lock()
+
+# the loop running the current coroutine; ``get_running_loop`` was added in
+# Python 3.7
+_running_loop = getattr(asyncio, 'get_running_loop', asyncio.get_event_loop)
+
+
+def configure(workers=None, per_filesystem=None):
+    """Set the limits on blocking calls run for coroutines.
+
+    Changing the number of workers replaces the pool; calls running in the
+    old pool complete there. Changing the limit for each filesystem applies
+    to event loops that haven't yet made calls.
+
+    :Keywords:
+        *workers*
+            maximum number of calls running at once; ``None`` to leave
+            unchanged [8]
+        *per_filesystem*
+            maximum number of calls running at once on each filesystem;
+            ``None`` to leave unchanged [4]
+
+    """
+    global _executor
+    with _lock:
+        if workers is not None and workers != _limits['workers']:
+            _limits['workers'] = workers
+            if _executor is not None:
+                _executor.shutdown(wait=False)
+                _executor = None
+
+        if per_filesystem is not None:
+            _limits['per_filesystem'] = per_filesystem
+            _semaphores.clear()
+
+
+def get_executor():
+    """Get the pool blocking calls are run in, creating it if needed.
+
+    :Returns:
+        *executor*
+            the :class:`concurrent.futures.ThreadPoolExecutor` in use
+
+    """
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=_limits['workers'])
+
+        return _executor
+
+
+def _device(path):
+    """Get the device number of the filesystem holding a path.
+
+    The nearest existing parent is used for paths that don't exist yet.
+
+    """
+    while True:
+        try:
+            return os.stat(path).st_dev
+        except OSError:
+            parent = os.path.dirname(path)
+            if parent == path:
+                raise
+            path = parent
+
+
+def _semaphore(loop, device):
+    """Get the semaphore limiting calls on a filesystem from an event loop.
+
+    """
+    with _lock:
+        semaphores = _semaphores.setdefault(loop, dict())
+        if device not in semaphores:
+            semaphores[device] = asyncio.Semaphore(_limits['per_filesystem'])
+
+        return semaphores[device]
+
+
+async def run(path, func, *args, **kwargs):
+    """Run a blocking call in the pool, within the limit for its filesystem.
+
+    :Arguments:
+        *path*
+            path on the filesystem the call reads from or writes to
+        *func*
+            callable to run
+
+    All other arguments and keywords are passed on to *func*.
+
+    :Returns:
+        *result*
+            the result of the call
+
+    """
+    loop = _running_loop()
+    executor = get_executor()
+    device = await loop.run_in_executor(executor, _device, path)
+
+    async with _semaphore(loop, device):
+        return await loop.run_in_executor(executor,
+                                          partial(func, *args, **kwargs))
+
+
+def _call(limb, method, *args, **kwargs):
+    """Call a method of a new limb for the same Tree as *limb*.
+
+    Data limbs hold the datafile being used for the duration of each call,
+    so concurrent calls each need their own limb.
+
+    """
+    return getattr(type(limb)(limb._tree), method)(*args, **kwargs)
+
+
+class AsyncData(object):
+    """Coroutines for :class:`Data <datreant.data.limbs.Data>`.
+
+    """
+    async def aretrieve(self, handle, **kwargs):
+        """Retrieve stored data without blocking the event loop.
+
+        See :meth:`retrieve <datreant.data.limbs.Data.retrieve>` for the
+        keywords taken.
+
+        :Arguments:
+            *handle*
+                name of data to retrieve
+
+        :Returns:
+            *data*
+                stored data; ``None`` if nonexistent
+
+        """
+        return await run(self._tree.abspath, _call, self, 'retrieve', handle,
+                         **kwargs)
+
+    async def aadd(self, handle, data, **kwargs):
+        """Store data without blocking the event loop.
+
+        See :meth:`add <datreant.data.limbs.Data.add>` for the keywords
+        taken.
+
+        :Arguments:
+            *handle*
+                name given to data; needed to retrieve data later
+            *data*
+                data structure to store
+
+        """
+        return await run(self._tree.abspath, _call, self, 'add', handle,
+                         data, **kwargs)
+
+    async def aappend(self, handle, data, **kwargs):
+        """Append rows to a dataset without blocking the event loop.
+
+        See :meth:`append <datreant.data.limbs.Data.append>` for the keywords
+        taken.
+
+        :Arguments:
+            *handle*
+                name of data to append to
+            *data*
+                data to append
+
+        """
+        return await run(self._tree.abspath, _call, self, 'append', handle,
+                         data, **kwargs)
+
+
+class AsyncAggData(object):
+    """Coroutines for :class:`AggData <datreant.data.agglimbs.AggData>`.
+
+    """
+    async def aretrieve(self, handle, by='path', **kwargs):
+        """Retrieve aggregated dataset from all members without blocking.
+
+        Members are listed, read concurrently, each within the limit for
+        its filesystem, and aggregated as with :meth:`retrieve
+        <datreant.data.agglimbs.AggData.retrieve>`, all in the pool.
+        Cancelling this cancels reads that haven't started.
+
+        Raises :exc:`KeyError` if dataset doesn't exist for any members.
+
+        :Arguments:
+            *handle*
+                name of data to retrieve
+
+        :Keywords:
+            *by*
+                top-level index of output data structure; 'path' uses member
+                path, 'name' uses member names, 'uuid' uses member uuids
+                ['path']
+
+        All other keywords are applied to each member's selection; see
+        :meth:`datreant.data.limbs.Data.retrieve`.
+
+        :Returns:
+            *data*
+                aggregated data structure
+
+        """
+        from .agglimbs import _retrieve_member
+
+        def list_members():
+            return (self._get_indexer(by),
+                    [member for member in self._collection
+                     if hasattr(member, 'data')])
+
+        loop = _running_loop()
+        get_index, members = await loop.run_in_executor(get_executor(),
+                                                        list_members)
+
+        # members without the dataset are found out by reading, rather than
+        # by listing every member's datasets beforehand
+        results = await asyncio.gather(
+            *[run(member.abspath, _retrieve_member, member.abspath, handle,
+                  kwargs) for member in members])
+        if not any(found for found, data in results):
+            raise KeyError(
+                    "No dataset '{}' found in any member".format(handle))
+
+        return await loop.run_in_executor(
+            get_executor(), self._aggregate, members, results, get_index)
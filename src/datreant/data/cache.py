@@ -0,0 +1,316 @@
+"""
+In-memory cache of retrieved datasets.
+
+Retrieving the same dataset again normally reads and decodes it from disk
+again. With the cache enabled, results of :meth:`Data.retrieve
+<datreant.data.limbs.Data.retrieve>` are kept in memory, up to a maximum
+total size, and later retrievals of the same selection are served from
+memory. Least recently used results are dropped first to make room.
+
+A cached result is reused only if the dataset's file has the same inode,
+size, and modification time as when it was read, and no rows have been
+staged for it since, so changes made by other processes are seen. Changes
+made through :class:`Data <datreant.data.limbs.Data>` drop cached results
+for the dataset at once.
+
+Cached results are shared between callers, so they are not returned as is.
+Numpy arrays are returned as read-only views, pandas objects as copies, and
+other python objects as deep copies.
+
+The cache is shared by all Treants in the process, and is disabled by
+default; enable it with :func:`enable`::
+
+    >>> import datreant.data
+    >>> datreant.data.cache.enable(maxbytes=2**30)
+
+"""
+import copy
+import pickle
+import sys
+import threading
+from collections import OrderedDict
+
+import six
+import numpy as np
+import pandas as pd
+
+from .pool import _stamp
+from . import spool
+
+
+#: the active cache; ``None`` if caching is disabled
+_cache = None
+
+
+def enable(maxbytes=2**28):
+    """Enable caching of retrieved datasets.
+
+    If the cache is already enabled, its maximum size is changed, and
+    results are dropped as needed to fit.
+
+    :Keywords:
+        *maxbytes*
+            maximum total size of cached results, in bytes [256 MiB]
+
+    :Returns:
+        *cache*
+            the active :class:`ResultCache`
+
+    """
+    global _cache
+    if _cache is None:
+        _cache = ResultCache(maxbytes=maxbytes)
+    else:
+        _cache.resize(maxbytes)
+
+    return _cache
+
+
+def disable():
+    """Disable caching of retrieved datasets, dropping all cached results.
+
+    """
+    global _cache
+    if _cache is not None:
+        _cache.clear()
+    _cache = None
+
+
+def get_cache():
+    """Get the active cache.
+
+    :Returns:
+        *cache*
+            the active :class:`ResultCache`; ``None`` if caching is disabled
+
+    """
+    return _cache
+
+
+def invalidate(datadir):
+    """Drop all cached results for a dataset, if caching is enabled.
+
+    :Arguments:
+        *datadir*
+            absolute path to the dataset's directory
+
+    """
+    if _cache is not None:
+        _cache.invalidate(datadir)
+
+
+def _freeze(value):
+    """Convert a selection keyword's value to a hashable form.
+
+    :Returns:
+        *frozen*
+            hashable form of *value*; raises :exc:`TypeError` for values that
+            cannot be compared reliably, such as arrays
+
+    """
+    if isinstance(value, np.generic):
+        value = value.item()
+
+    if value is None or isinstance(value, (bool, float) +
+                                   six.integer_types + six.string_types):
+        return (type(value).__name__, value)
+    elif isinstance(value, slice):
+        return ('slice', _freeze(value.start), _freeze(value.stop),
+                _freeze(value.step))
+    elif isinstance(value, (tuple, list)):
+        return (type(value).__name__,) + tuple(_freeze(v) for v in value)
+    elif value is Ellipsis:
+        return ('ellipsis',)
+    else:
+        raise TypeError("Cannot cache selection with {!r}".format(value))
+
+
+def selection_key(kwargs):
+    """Build a cache key for the selection given by retrieval keywords.
+
+    :Arguments:
+        *kwargs*
+            keywords given to :meth:`Data.retrieve
+            <datreant.data.limbs.Data.retrieve>`
+
+    :Returns:
+        *key*
+            hashable key for the selection; ``None`` if the result of this
+            selection should not be cached, such as for iterators, memory
+            maps, or selections using arrays
+
+    """
+    if kwargs.get('iterator') or kwargs.get('chunksize') or kwargs.get('mmap'):
+        return None
+
+    try:
+        return tuple((name, _freeze(value))
+                     for name, value in sorted(kwargs.items()))
+    except TypeError:
+        return None
+
+
+def nbytes(data):
+    """Estimate the memory used by a retrieved dataset.
+
+    """
+    if isinstance(data, np.ndarray):
+        return data.nbytes
+    elif isinstance(data, (pd.Series, pd.DataFrame)):
+        usage = data.memory_usage(deep=True)
+        return int(np.sum(usage))
+
+    try:
+        return len(pickle.dumps(data, pickle.HIGHEST_PROTOCOL))
+    except Exception:
+        return sys.getsizeof(data)
+
+
+def export(data):
+    """Give a cached result to a caller without exposing it to changes.
+
+    """
+    if isinstance(data, np.ndarray):
+        view = data.view()
+        view.flags.writeable = False
+        return view
+    elif isinstance(data, pd.core.generic.NDFrame):
+        return data.copy()
+    else:
+        return copy.deepcopy(data)
+
+
+class ResultCache(object):
+    """Cache of retrieved datasets, bounded by total size in bytes.
+
+    Results are keyed by the dataset's directory and the selection made, and
+    validated against the stamp of the dataset's file.
+
+    :Keywords:
+        *maxbytes*
+            maximum total size of cached results, in bytes [256 MiB]
+
+    """
+    def __init__(self, maxbytes=2**28):
+        self.maxbytes = maxbytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+        self._results = OrderedDict()
+        self._bydir = dict()
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._results)
+
+    def retrieve(self, datadir, filename, kwargs, loader):
+        """Get a dataset's selection from the cache, loading it on a miss.
+
+        :Arguments:
+            *datadir*
+                absolute path to the dataset's directory
+            *filename*
+                absolute path to the dataset's file
+            *kwargs*
+                retrieval keywords giving the selection
+            *loader*
+                callable that reads the selection from disk
+
+        :Returns:
+            *data*
+                the selected data
+
+        """
+        selection = selection_key(kwargs)
+        if selection is None:
+            return loader()
+
+        key = (datadir, selection)
+        stamp = (filename, _stamp(filename), spool.stamp(datadir))
+
+        with self._lock:
+            if key in self._results:
+                oldstamp, data, size = self._results.pop(key)
+                if oldstamp == stamp:
+                    self._results[key] = (oldstamp, data, size)
+                    self.hits += 1
+                    return export(data)
+                self._drop(key, size)
+            self.misses += 1
+
+        data = loader()
+        if isinstance(data, np.memmap):
+            return data
+
+        size = nbytes(data)
+        if size > self.maxbytes:
+            return data
+
+        if isinstance(data, np.ndarray):
+            data.flags.writeable = False
+
+        with self._lock:
+            if key in self._results:
+                self._drop(key, self._results.pop(key)[2])
+
+            self._results[key] = (stamp, data, size)
+            self._bydir.setdefault(datadir, set()).add(key)
+            self.nbytes += size
+            self._evict()
+
+        return export(data)
+
+    def invalidate(self, datadir):
+        """Drop all cached results for a dataset.
+
+        :Arguments:
+            *datadir*
+                absolute path to the dataset's directory
+
+        """
+        with self._lock:
+            for key in self._bydir.pop(datadir, ()):
+                if key in self._results:
+                    _, _, size = self._results.pop(key)
+                    self.nbytes -= size
+
+    def resize(self, maxbytes):
+        """Change the maximum total size of cached results.
+
+        :Arguments:
+            *maxbytes*
+                maximum total size of cached results, in bytes
+
+        """
+        with self._lock:
+            self.maxbytes = maxbytes
+            self._evict()
+
+    def clear(self):
+        """Drop all cached results.
+
+        """
+        with self._lock:
+            self._results.clear()
+            self._bydir.clear()
+            self.nbytes = 0
+
+    def _drop(self, key, size):
+        """Account for a result already popped from the cache.
+
+        """
+        self.nbytes -= size
+        keys = self._bydir.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._bydir[key[0]]
+
+    def _evict(self):
+        """Drop least recently used results until the cache fits.
+
+        """
+        while self.nbytes > self.maxbytes and self._results:
+            key, (_, _, size) = self._results.popitem(last=False)
+            self._drop(key, size)
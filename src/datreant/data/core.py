@@ -4,6 +4,7 @@ Abstract interface components for reading and writing datasets.
 """
 
 import os
+from collections import Counter
 
 import numpy as np
 import pandas as pd
@@ -11,6 +12,13 @@ import pandas as pd
 from . import pydata
 from . import npdata
 from . import pddata
+from . import pool
+from . import spool
+
+
+#: counts of filesystem metadata operations made in locating datasets, by kind;
+#: useful for confirming the number of round-trips made on network filesystems
+metadata_ops = Counter()
 
 
 class DataFile(object):
@@ -23,7 +31,7 @@ class DataFile(object):
 
     """
 
-    def __init__(self, datadir, datafiletype=None, **kwargs):
+    def __init__(self, datadir, datafiletype=None, defaults=None, **kwargs):
         """Initialize data interface.
 
         :Arguments:
@@ -31,6 +39,9 @@ class DataFile(object):
               path to data directory
            *datafiletype*
               If known, either pddata.pddatafile or npdata.npdatafile
+           *defaults*
+              default storage options, keyed by kind of data ('numpy',
+              'pandas', or 'python'); see :mod:`datreant.data.defaults`
 
         """
         self.datadir = datadir
@@ -39,11 +50,23 @@ class DataFile(object):
         # if given, can get data
         self.datafiletype = datafiletype
 
-    def add_data(self, key, data):
+        self.defaults = defaults if defaults is not None else dict()
+
+    def _options(self, datatype, kwargs):
+        """Merge default storage options for a kind of data with those given.
+
+        """
+        options = dict(self.defaults.get(datatype, dict()))
+        options.update(kwargs)
+
+        return options
+
+    def add_data(self, key, data, **kwargs):
         """Add a pandas data object (Series, DataFrame, Panel), numpy array,
         or pickleable python object to the data file.
 
-        If data already exists for the given key, then it is overwritten.
+        If data already exists for the given key, then it is overwritten,
+        including data of another type; its datafile is removed.
 
         :Arguments:
             *key*
@@ -52,29 +75,77 @@ class DataFile(object):
             *data*
                 the data object to store; should be either a pandas Series,
                 DataFrame, Panel, or a numpy array
+
+        All other keyword arguments are storage options passed on to the
+        backend for the data's type, overriding any defaults.
+
         """
         if isinstance(data, np.ndarray):
+            self.datafiletype = npdata.npdatafile
             self.datafile = npdata.npDataFile(
                 os.path.join(self.datadir, npdata.npdatafile))
+            kwargs = self._options('numpy', kwargs)
         elif isinstance(data, (pd.Series, pd.DataFrame, pd.Panel, pd.Panel4D)):
+            self.datafiletype = pddata.pddatafile
             self.datafile = pddata.pdDataFile(
                 os.path.join(self.datadir, pddata.pddatafile))
+            kwargs = self._options('pandas', kwargs)
         else:
+            self.datafiletype = pydata.pydatafile
             self.datafile = pydata.pyDataFile(
                 os.path.join(self.datadir, pydata.pydatafile))
+            kwargs = self._options('python', kwargs)
 
-        self.datafile.add_data(key, data)
+        self.datafile.add_data(key, data, **kwargs)
 
         # dereference
         self.datafile = None
 
-    def append_data(self, key, data):
-        """Append rows to an existing pandas data object stored in the data file.
+        self._remove_others()
+
+    def _remove_others(self):
+        """Remove the datafiles of types other than this one's.
+
+        Otherwise the dataset previously stored with another type would be
+        left behind, and would be read instead if its type is looked for
+        first.
+
+        """
+        for datafiletype in (pddata.pddatafile, npdata.npdatafile,
+                             pydata.pydatafile):
+            filename = os.path.join(self.datadir, datafiletype)
+            if (datafiletype == self.datafiletype or
+                    not os.path.exists(filename)):
+                continue
+
+            pool.discard(filename)
+            os.remove(filename)
+
+            others = [os.path.join(self.datadir,
+                                   '.{}.proxy'.format(datafiletype))]
+            if datafiletype == pydata.pydatafile:
+                others.append(os.path.join(self.datadir,
+                                           pydata.pybuffersfile))
+            for other in others:
+                try:
+                    os.remove(other)
+                except OSError:
+                    pass
+
+            if datafiletype == pddata.pddatafile:
+                spool.Spool(self.datadir).remove()
+
+    def append_data(self, key, data, **kwargs):
+        """Append rows to an existing pandas data object or numpy array stored
+        in the data file.
 
         Note that column names of new data must match those of the existing
         data. Columns cannot be appended due to the technical details of the
         HDF5 standard. To add new columns, store as a new dataset.
 
+        For numpy arrays, rows are appended along the first axis; all other
+        dimensions must match those of the existing array.
+
         :Arguments:
             *key*
                 name of existing data object to append to
@@ -83,19 +154,32 @@ class DataFile(object):
                 stored data; must have same columns (with names) as existing
                 data
 
+        All other keyword arguments are storage options passed on to the
+        backend for the data's type, overriding any defaults.
+
         """
         # TODO: add exceptions where appending isn't possible
+        if (kwargs.get('buffered') and
+                not isinstance(data, (pd.Series, pd.DataFrame))):
+            raise TypeError('Only pandas objects can be appended buffered.')
+
         if isinstance(data, np.ndarray):
-            raise TypeError('Cannot append numpy arrays.')
+            self.datafiletype = npdata.npdatafile
+            self.datafile = npdata.npDataFile(
+                os.path.join(self.datadir, npdata.npdatafile))
+            self.datafile.append_data(key, data,
+                                      **self._options('numpy', kwargs))
         elif isinstance(data, (pd.Series, pd.DataFrame, pd.Panel, pd.Panel4D)):
+            self.datafiletype = pddata.pddatafile
             self.datafile = pddata.pdDataFile(
                 os.path.join(self.datadir, pddata.pddatafile))
-            self.datafile.append_data(key, data)
+            self.datafile.append_data(key, data,
+                                      **self._options('pandas', kwargs))
         else:
             raise TypeError('Cannot append python object.')
 
-            # dereference
-            self.datafile = None
+        # dereference
+        self.datafile = None
 
     def get_data(self, key, **kwargs):
         """Retrieve data object stored in file.
@@ -108,9 +192,11 @@ class DataFile(object):
             *where*
                 for pandas objects, conditions for what rows/columns to return
             *start*
-                for pandas objects, row number to start selection
+                for pandas objects and numpy arrays, row number to start
+                selection
             *stop*
-                for pandas objects, row number to stop selection
+                for pandas objects and numpy arrays, row number to stop
+                selection
             *columns*
                 for pandas objects, list of columns to return; all columns
                 returned by default
@@ -119,6 +205,14 @@ class DataFile(object):
             *chunksize*
                 for pandas objects, number of rows to include in iteration;
                 implies ``iterator=True``
+            *step*
+                for numpy arrays, step along first axis for selection
+            *index*
+                for numpy arrays, numpy-style index giving the selection to
+                return
+            *mmap*
+                for numpy arrays, if True, return a read-only memory map of
+                the array if it is stored contiguously and uncompressed
 
         :Returns:
             *data*
@@ -145,6 +239,131 @@ class DataFile(object):
 
         return out
 
+    def iter_data(self, key, chunksize, start=None, stop=None, **kwargs):
+        """Iterate over a data object stored in file in chunks of rows.
+
+        Each chunk is read separately, taking and releasing the file's shared
+        lock, so only one chunk is held in memory at a time and writers are
+        not blocked for the whole iteration. The number of rows is fixed when
+        iteration begins; rows appended during iteration are not included.
+
+        :Arguments:
+            *key*
+                name of data to iterate over
+            *chunksize*
+                number of rows in each chunk
+
+        :Keywords:
+            *start*
+                row number to start iteration
+            *stop*
+                row number to stop iteration
+
+        All other keywords are applied to each chunk's selection; see
+        :meth:`get_data`.
+
+        Pickled python objects and numpy scalars have no rows, and are
+        yielded whole as a single chunk.
+
+        """
+        if self.datafiletype == npdata.npdatafile:
+            datafile = npdata.npDataFile(
+                os.path.join(self.datadir, npdata.npdatafile))
+        elif self.datafiletype == pddata.pddatafile:
+            datafile = pddata.pdDataFile(
+                os.path.join(self.datadir, pddata.pddatafile))
+        elif self.datafiletype == pydata.pydatafile:
+            yield self.get_data(key)
+            return
+        else:
+            raise TypeError('Cannot return data without knowing datatype.')
+
+        nrows = datafile.get_nrows(key)
+        if nrows is None:
+            yield datafile.get_data(key, **kwargs)
+            return
+
+        start, stop, _ = slice(start, stop).indices(nrows)
+        for first in range(start, stop, chunksize):
+            yield datafile.get_data(key, start=first,
+                                    stop=min(first + chunksize, stop),
+                                    **kwargs)
+
+    def get_nrows(self, key):
+        """Get the number of rows of a data object stored in file.
+
+        Only metadata is read; the data itself is not loaded.
+
+        :Arguments:
+            *key*
+                name of data
+
+        :Returns:
+            *nrows*
+                number of rows of a pandas object, including rows staged by
+                buffered appends, or length of the first axis of a numpy
+                array; ``None`` for numpy scalars and pickled python objects
+        """
+        if self.datafiletype == npdata.npdatafile:
+            self.datafile = npdata.npDataFile(
+                os.path.join(self.datadir, npdata.npdatafile))
+            out = self.datafile.get_nrows(key)
+            self.datafile = None
+        elif self.datafiletype == pddata.pddatafile:
+            self.datafile = pddata.pdDataFile(
+                os.path.join(self.datadir, pddata.pddatafile))
+            out = self.datafile.get_nrows(key)
+            self.datafile = None
+        elif self.datafiletype == pydata.pydatafile:
+            out = None
+        else:
+            raise TypeError('Cannot count rows without knowing datatype.')
+
+        return out
+
+    def get_info(self, key):
+        """Get metadata for a data object stored in file.
+
+        Only metadata is read; the data itself is not loaded.
+
+        :Arguments:
+            *key*
+                name of data to describe
+
+        :Returns:
+            *info*
+                dictionary of metadata; always includes 'datatype', giving
+                the kind of data stored ('numpy', 'pandas', or 'python'),
+                'size', giving the bytes used on disk, and 'mtime', giving
+                the time the data file was last modified, along with
+                metadata specific to the kind of data
+        """
+        if self.datafiletype == npdata.npdatafile:
+            self.datafile = npdata.npDataFile(
+                os.path.join(self.datadir, npdata.npdatafile))
+            out = self.datafile.get_info(key)
+            out['datatype'] = 'numpy'
+            self.datafile = None
+        elif self.datafiletype == pddata.pddatafile:
+            self.datafile = pddata.pdDataFile(
+                os.path.join(self.datadir, pddata.pddatafile))
+            out = self.datafile.get_info(key)
+            out['datatype'] = 'pandas'
+            self.datafile = None
+        elif self.datafiletype == pydata.pydatafile:
+            self.datafile = pydata.pyDataFile(
+                os.path.join(self.datadir, pydata.pydatafile))
+            out = self.datafile.get_info(key)
+            out['datatype'] = 'python'
+            self.datafile = None
+        else:
+            raise TypeError('Cannot describe data without knowing datatype.')
+
+        out['mtime'] = os.path.getmtime(
+            os.path.join(self.datadir, self.datafiletype))
+
+        return out
+
     def del_data(self, key, **kwargs):
         """Delete a stored data object.
 
@@ -178,3 +397,78 @@ class DataFile(object):
             out = None
 
         return out
+
+    def reindex_data(self, key, **kwargs):
+        """Build indexes for a pandas object stored as a table.
+
+        :Arguments:
+            *key*
+                name of data to index
+
+        :Keywords:
+            *columns*
+                list of data columns to index; ``None`` for all
+            *optlevel*
+                optimization level of indexes, from 0 to 9
+            *kind*
+                kind of indexes, one of 'ultralight', 'light', 'medium', or
+                'full'
+
+        """
+        if self.datafiletype == pddata.pddatafile:
+            self.datafile = pddata.pdDataFile(
+                os.path.join(self.datadir, pddata.pddatafile))
+            self.datafile.reindex(key, **kwargs)
+            self.datafile = None
+        else:
+            raise TypeError('Only pandas objects can be indexed.')
+
+    def recompress_data(self, key, **kwargs):
+        """Rewrite a stored pandas object with different compression.
+
+        :Arguments:
+            *key*
+                name of data to recompress
+
+        :Keywords:
+            *complib*
+                compression library to use, such as 'zlib', 'blosc',
+                'blosc:lz4', or 'blosc:zstd'
+            *complevel*
+                compression level from 0 (none) to 9
+
+        """
+        if self.datafiletype == pddata.pddatafile:
+            self.datafile = pddata.pdDataFile(
+                os.path.join(self.datadir, pddata.pddatafile))
+            self.datafile.recompress(key, **kwargs)
+            self.datafile = None
+        else:
+            raise TypeError('Only pandas objects can be recompressed.')
+
+    def compact_data(self, key, **kwargs):
+        """Store rows staged by buffered appends to a pandas object.
+
+        :Arguments:
+            *key*
+                name of data to compact
+
+        :Keywords:
+            *index*
+                if True, update indexes after appending; if False, defer
+                updating them
+
+        :Returns:
+            *nrows*
+                number of rows stored
+
+        """
+        if self.datafiletype == pddata.pddatafile:
+            self.datafile = pddata.pdDataFile(
+                os.path.join(self.datadir, pddata.pddatafile))
+            nrows = self.datafile.compact(key, **kwargs)
+            self.datafile = None
+        else:
+            raise TypeError('Only pandas objects can be compacted.')
+
+        return nrows
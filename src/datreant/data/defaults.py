@@ -0,0 +1,32 @@
+"""
+Per-Tree default storage options for datasets.
+
+Options such as compression settings can be given each time a dataset is
+stored, but it is often more convenient to set them once for a Tree. These
+defaults are kept in a JSON file alongside the Tree's manifest, with options
+grouped by the kind of data they apply to.
+
+"""
+from datreant.core.backends.core import JSONFile
+
+from . import npdata, pddata, pydata
+
+
+defaultsfile = 'defaults.json'
+
+#: kinds of data options can be set for, and their corresponding datafiles
+datatypes = {'numpy': npdata.npdatafile,
+             'pandas': pddata.pddatafile,
+             'python': pydata.pydatafile}
+
+
+class Defaults(JSONFile):
+    """Interface to the file of default storage options for a Tree.
+
+    The state is a dictionary giving, for each kind of data in
+    :data:`datatypes`, a dictionary of keyword arguments to use when storing
+    data of that kind.
+
+    """
+    def _init_state(self):
+        self._state = dict()
@@ -0,0 +1,209 @@
+"""
+Lazy access to stored datasets.
+
+A :class:`DataProxy` stands in for a stored dataset, exposing its shape,
+dtypes, and columns from metadata alone. Data is only read when the proxy is
+indexed, and then only the selection requested.
+
+"""
+import numbers
+
+import six
+
+
+class LazyData(object):
+    """Accessor giving lazy proxies to a Tree's datasets.
+
+    This is available from a Tree as ``tree.data.lazy``::
+
+        >>> proxy = t.data.lazy['something_wicked']
+        >>> proxy.shape
+        (1000000, 3)
+        >>> proxy[1000:2000].shape
+        (1000, 3)
+
+    """
+    def __init__(self, data):
+        self._data = data
+
+    def __repr__(self):
+        return "<LazyData({})>".format(self._data.keys())
+
+    def __iter__(self):
+        return self._data.keys().__iter__()
+
+    def keys(self):
+        """List available datasets.
+
+        :Returns:
+            *handles*
+                list of handles to available datasets
+
+        """
+        return self._data.keys()
+
+    def __getitem__(self, handle):
+        """Get a lazy proxy to the dataset corresponding to given handle(s).
+
+        Raises :exc:`KeyError` if dataset doesn't exist.
+
+        :Arguments:
+            *handle*
+                name of dataset; may also be a list of names
+
+        :Returns:
+            *proxy*
+                proxy to the dataset; if *handle* was a list, will be a list
+                of proxies of equal length
+
+        """
+        if isinstance(handle, list):
+            return [DataProxy(self._data, item) for item in handle]
+        elif isinstance(handle, six.string_types):
+            return DataProxy(self._data, handle)
+        else:
+            raise TypeError("*handle* must be a string or a list of strings")
+
+
+class DataProxy(object):
+    """Proxy to a stored dataset that reads data only on demand.
+
+    Metadata for the dataset is read once, when the proxy is created. Indexing
+    the proxy reads only the selection requested:
+
+    numpy arrays
+      any numpy-style index, such as ``proxy[1000:2000]`` or
+      ``proxy[::10, 2]``
+
+    pandas Series and DataFrames
+      a slice of row numbers, such as ``proxy[1000:2000]``, or a column name
+      or list of column names, such as ``proxy['A']``
+
+    pickled python objects
+      the object must be loaded in full before it is indexed
+
+    :Arguments:
+        *data*
+            :class:`~datreant.data.limbs.Data` limb the dataset belongs to
+        *handle*
+            name of the dataset
+
+    """
+    def __init__(self, data, handle):
+        self._data = data
+        self._handle = handle
+        self._info = data.info(handle)
+
+    def __repr__(self):
+        if self.datatype == 'numpy':
+            desc = "shape={}, dtype={}".format(self.shape, self.dtype)
+        elif self.datatype == 'pandas':
+            desc = "{}, nrows={}".format(self._info['pandas_type'],
+                                         self.nrows)
+        else:
+            desc = "pickled"
+
+        return "<DataProxy('{}', {})>".format(self._handle, desc)
+
+    @property
+    def handle(self):
+        """Name of the proxied dataset."""
+        return self._handle
+
+    @property
+    def datatype(self):
+        """Kind of data stored; one of 'numpy', 'pandas', or 'python'."""
+        return self._info['datatype']
+
+    @property
+    def shape(self):
+        """Shape of the stored array, Series, or DataFrame.
+
+        ``None`` for pickled python objects and pandas Panels.
+
+        """
+        return self._info.get('shape')
+
+    @property
+    def ndim(self):
+        """Number of dimensions of the stored array, Series, or DataFrame.
+
+        """
+        if self.shape is None:
+            return None
+        return len(self.shape)
+
+    @property
+    def nrows(self):
+        """Number of rows (length along first axis) of the stored data.
+
+        ``None`` for pickled python objects and numpy scalars.
+
+        """
+        if 'nrows' in self._info:
+            return self._info['nrows']
+        elif self.shape:
+            return self.shape[0]
+        else:
+            return None
+
+    @property
+    def dtype(self):
+        """dtype of the stored array or Series.
+
+        For DataFrames, this is a Series giving the dtype of each column.
+
+        """
+        return self._info.get('dtype', self._info.get('dtypes'))
+
+    @property
+    def dtypes(self):
+        """dtypes of the stored pandas object's columns."""
+        return self._info.get('dtypes')
+
+    @property
+    def columns(self):
+        """Columns of the stored DataFrame; ``None`` otherwise."""
+        return self._info.get('columns')
+
+    def __len__(self):
+        if self.nrows is None:
+            raise TypeError("len() of unsized dataset")
+        return self.nrows
+
+    def retrieve(self, **kwargs):
+        """Read the dataset, or some selection of it, from disk.
+
+        See :meth:`datreant.data.limbs.Data.retrieve` for the keywords
+        available.
+
+        """
+        return self._data.retrieve(self._handle, **kwargs)
+
+    def __getitem__(self, key):
+        if self.datatype == 'numpy':
+            if isinstance(key, slice):
+                return self.retrieve(start=key.start, stop=key.stop,
+                                     step=key.step)
+            return self.retrieve(index=key)
+
+        elif self.datatype == 'pandas':
+            if isinstance(key, slice):
+                if not all(k is None or isinstance(k, numbers.Integral)
+                           for k in (key.start, key.stop)):
+                    raise TypeError("rows of pandas datasets can only be "
+                                    "selected with integer slices")
+                out = self.retrieve(start=key.start, stop=key.stop)
+                if key.step is not None:
+                    out = out.iloc[::key.step]
+                return out
+            elif isinstance(key, list):
+                return self.retrieve(columns=key)
+            elif self._info['pandas_type'] == 'DataFrame':
+                return self.retrieve(columns=[key])[key]
+            else:
+                raise TypeError("pandas datasets can be indexed by a slice "
+                                "of rows, or for DataFrames, a column name "
+                                "or list of column names")
+
+        return self.retrieve()[key]
@@ -3,15 +3,70 @@ Limbs for convenient Treant data storage and retrieval.
 
 """
 import os
+import sys
 import six
-from functools import wraps
+import time
+from functools import partial, wraps
 
 from datreant.core.limbs import TreeLimb
 from . import npdata, pddata, pydata
-from .core import DataFile
+from . import manifest
+from . import defaults
+from . import parallel
+from . import pool
+from . import cache
+from . import shm
+from . import spool
+from .core import DataFile, metadata_ops
+from .lazy import LazyData
 
+if sys.version_info >= (3, 5):
+    from .aio import AsyncData
+else:
+    AsyncData = object
 
-class Data(TreeLimb):
+
+def _retrieve_datafile(datadir, datafiletype, kwargs):
+    """Retrieve a dataset from the given data directory.
+
+    Defined at module level so that it can be shipped to worker processes.
+
+    """
+    datafile = DataFile(datadir, datafiletype=datafiletype)
+    filename = os.path.join(datadir, datafiletype)
+
+    def load():
+        return datafile.get_data('main', **kwargs)
+
+    # results are looked for in this process, then in shared memory, before
+    # being read from disk
+    for layer in (shm.get_cache(), cache.get_cache()):
+        if layer is not None:
+            load = partial(layer.retrieve, datadir, filename, kwargs, load)
+
+    return load()
+
+
+def _add_datafile(datadir, data, defaults, kwargs):
+    """Store a dataset in the given data directory.
+
+    Defined at module level so that it can be shipped to worker processes.
+
+    :Returns:
+        *datafiletype*
+            datafile type the data was stored as
+        *elapsed*
+            time taken to store the data, in seconds
+
+    """
+    start = time.time()
+    datafile = DataFile(datadir, defaults=defaults)
+    datafile.add_data('main', data, **kwargs)
+
+    return datafile.datafiletype, time.time() - start
+
+
+class Data(AsyncData, TreeLimb):
     """Interface to stored data.
 
     """
@@ -67,21 +122,23 @@ class Data(TreeLimb):
                 ``persistence.npdatafile``
 
         """
-        datafile = None
-        datafiletype = None
-        for dfiletype in (pddata.pddatafile, npdata.npdatafile,
-                          pydata.pydatafile):
-            dfile = os.path.join(self._tree.abspath,
-                                 handle, dfiletype)
-            if os.path.exists(dfile):
-                datafile = dfile
-                proxyfile = os.path.join(self._tree.abspath,
-                                         handle, ".{}.proxy".format(dfiletype))
-                datafiletype = dfiletype
+        dirname = os.path.join(self._tree.abspath, handle)
 
-        if datafile is None and datafiletype is None:
+        # a single directory listing resolves the datafile type, instead of
+        # checking for each possible datafile in turn
+        metadata_ops['listdir'] += 1
+        try:
+            files = set(os.listdir(dirname))
+        except OSError:
+            files = set()
+
+        datafiletype = manifest.resolve(files)
+        if datafiletype is None:
             raise KeyError("No data for '{}'".format(handle))
 
+        datafile = os.path.join(dirname, datafiletype)
+        proxyfile = os.path.join(dirname, ".{}.proxy".format(datafiletype))
+
         return (datafile, proxyfile, datafiletype)
 
     def _read_datafile(func):
@@ -131,14 +188,27 @@ class Data(TreeLimb):
         @wraps(func)
         def inner(self, handle, *args, **kwargs):
             dirname = os.path.join(self._tree.abspath, handle)
+            tracked = manifest.tracked_dirs(handle)
+            before = manifest.stat_dirs(self._tree.abspath, tracked)
 
             self._makedirs(dirname)
-            self._datafile = DataFile(dirname)
+            self._datafile = DataFile(dirname, defaults=self.get_defaults())
 
             try:
                 out = func(self, handle, *args, **kwargs)
+                datafiletype = self._datafile.datafiletype
             finally:
                 del self._datafile
+                cache.invalidate(dirname)
+                shm.invalidate(dirname)
+
+            # the manifest depends only on the entries of the directories it
+            # tracks, so writes to existing datafiles in place, such as
+            # appends, leave it as valid as it was
+            if datafiletype is not None and (
+                    None in before.values() or
+                    manifest.stat_dirs(self._tree.abspath, tracked) != before):
+                self._update_manifest({handle: datafiletype}, before)
 
             return out
 
@@ -161,9 +231,8 @@ class Data(TreeLimb):
 
         """
         if isinstance(handle, list):
-            out = list()
-            for item in handle:
-                out.append(self.retrieve(item))
+            datasets = self.retrieve_many(handle)
+            out = [datasets[item] for item in handle]
         elif isinstance(handle, six.string_types):
             out = self.retrieve(handle)
 
@@ -200,7 +269,7 @@ class Data(TreeLimb):
         self.remove(handle)
 
     @_write_datafile
-    def add(self, handle, data):
+    def add(self, handle, data, **kwargs):
         """Store data in Treant.
 
         A data instance can be a pandas object (Series, DataFrame, Panel),
@@ -208,14 +277,132 @@ class Data(TreeLimb):
         exist, it is added. If a dataset already exists for the given handle,
         it is replaced.
 
+        Storage options for the data's type can be given as keywords; these
+        override any defaults set with :meth:`set_defaults`.
+
         :Arguments:
             *handle*
                 name given to data; needed for retrieval
             *data*
                 data structure to store
 
+        :Keywords for numpy arrays:
+            *chunks*
+                chunk shape to store the array with; 'auto' chooses one based
+                on the array's shape and dtype; ``None`` stores the array
+                contiguously unless compression is used
+            *compression*
+                compression filter to apply, such as 'gzip' or 'lzf'
+            *compression_opts*
+                options for the compression filter; for 'gzip', the
+                compression level from 0 to 9
+            *shuffle*
+                if True, apply the byte-shuffle filter before compression
+
+        :Keywords for pandas objects:
+            *profile*
+                storage profile to use: 'fast-read' stores the object in the
+                HDF5 fixed format, fastest to write and read in full;
+                'queryable' stores it as a table with all columns indexed,
+                for selection with *where*; 'appendable' stores it as a table
+                without indexes, fastest to append to ['queryable']
+            *data_columns*
+                for tables, list of columns to store as separate, indexable
+                columns usable in *where* selections; ``True`` for all
+                columns; indexing only the columns that will be queried keeps
+                writes fast and files small for wide frames
+            *optlevel*
+                for tables, optimization level of indexes, from 0 to 9
+            *kind*
+                for tables, kind of indexes, one of 'ultralight', 'light',
+                'medium', or 'full'
+            *index*
+                for tables, if False, defer building indexes to
+                :meth:`reindex`
+            *complib*
+                compression library to use, such as 'zlib', 'blosc',
+                'blosc:lz4' (fast to read), or 'blosc:zstd' (compact);
+                tables use 'blosc' by default, while the 'fast-read' profile
+                is uncompressed unless this is given
+            *complevel*
+                compression level from 0 (none) to 9 [5]
+
+        :Keywords for python objects:
+            *compression*
+                compression to apply to the pickle, one of 'zstd', 'lz4',
+                'gzip', or 'lzma'; ``True`` uses the first of these that is
+                installed; compressed pickles are detected on retrieval
+            *compression_opts*
+                compression level
+            *oob_threshold*
+                buffers of at least this many bytes, such as those of large
+                numpy arrays, are stored uncompressed in a sidecar file that
+                is memory-mapped on retrieval; ``None`` to disable
+
+        """
+        self._datafile.add_data('main', data, **kwargs)
+
+    def add_many(self, datasets, workers=None, executor=None, **kwargs):
+        """Store several datasets in Treant at once.
+
+        Directories for all datasets are created up front, and the Tree's
+        defaults and manifest are each read and written once for the whole
+        batch rather than once per dataset. Since each dataset is stored in
+        its own file, the writes are independent and can be done
+        concurrently.
+
+        :Arguments:
+            *datasets*
+                dictionary giving the data structure to store for each handle
+
+        :Keywords:
+            *workers*
+                number of datasets to write concurrently; ``None`` writes
+                datasets serially [``None``]
+            *executor*
+                'thread' to write datasets with a thread pool, 'process' to
+                use a process pool, or an existing
+                :class:`concurrent.futures.Executor` to submit writes to
+                ['thread']
+
+        All other keywords are storage options applied to each dataset; see
+        :meth:`add`.
+
+        :Returns:
+            *timings*
+                dictionary giving the time taken to store each dataset, in
+                seconds
+
         """
-        self._datafile.add_data('main', data)
+        top = self._tree.abspath
+        handles = list(datasets)
+
+        reldirs = set()
+        for handle in handles:
+            reldirs.update(manifest.tracked_dirs(handle))
+        before = manifest.stat_dirs(top, reldirs)
+
+        for handle in handles:
+            self._makedirs(os.path.join(top, handle))
+
+        options = self.get_defaults()
+        results = parallel.map_ordered(
+                _add_datafile,
+                [(os.path.join(top, handle), datasets[handle], options,
+                  kwargs) for handle in handles],
+                workers=workers, executor=executor)
+
+        for handle in handles:
+            cache.invalidate(os.path.join(top, handle))
+            shm.invalidate(os.path.join(top, handle))
+
+        self._update_manifest(
+            {handle: filetype
+             for handle, (filetype, elapsed) in zip(handles, results)},
+            before)
+
+        return {handle: elapsed
+                for handle, (filetype, elapsed) in zip(handles, results)}
 
     def remove(self, handle, **kwargs):
         """Remove a dataset, or some subset of a dataset.
@@ -248,9 +435,21 @@ class Data(TreeLimb):
         if kwargs and datafiletype == pddata.pddatafile:
             self._delete_data(handle, **kwargs)
         elif datafile:
+            top = self._tree.abspath
+            before = manifest.stat_dirs(top, manifest.tracked_dirs(handle))
+
+            pool.discard(datafile)
+
             os.remove(datafile)
             os.remove(proxy)
-            top = self._tree.abspath
+            if datafiletype == pydata.pydatafile:
+                buffersfile = os.path.join(os.path.dirname(datafile),
+                                           pydata.pybuffersfile)
+                if os.path.exists(buffersfile):
+                    os.remove(buffersfile)
+            spool.Spool(os.path.dirname(datafile)).remove()
+            cache.invalidate(os.path.join(top, handle))
+            shm.invalidate(os.path.join(top, handle))
             directory = os.path.dirname(datafile)
             while directory != top:
                 try:
@@ -259,6 +458,8 @@ class Data(TreeLimb):
                 except OSError:
                     break
 
+            self._update_manifest({handle: datafiletype}, before)
+
     @_write_datafile
     def _delete_data(self, handle, **kwargs):
         """Remove a dataset, or some subset of a dataset.
@@ -293,12 +494,13 @@ class Data(TreeLimb):
         try:
             self._datafile.del_data('main', **kwargs)
         except NotImplementedError:
-            datafile = self._get_datafile(handle)[0]
+            pool.discard(filename)
 
-            os.remove(datafile)
+            os.remove(filename)
             os.remove(proxy)
+            spool.Spool(os.path.dirname(filename)).remove()
             top = self._tree.abspath
-            directory = os.path.dirname(datafile)
+            directory = os.path.dirname(filename)
             while directory != top:
                 try:
                     os.rmdir(directory)
@@ -316,7 +518,14 @@ class Data(TreeLimb):
 
         For pandas objects (Series, DataFrame, or Panel) subsets of the whole
         dataset can be returned using keywords such as *start* and *stop* for
-        ranges of rows, and *columns* for selected columns.
+        ranges of rows, and *columns* for selected columns. Negative *start*
+        and *stop* count back from the last row, so the latest 1000 rows of
+        a table that is being appended to can be had with::
+
+            retrieve('mydata', start=-1000)
+
+        The number of rows is taken from the file's metadata, so only the
+        rows selected are read; see also :meth:`nrows`.
 
         Also for pandas objects, the *where* keyword takes a string as input
         and can be used to filter out rows and columns without loading the full
@@ -331,7 +540,30 @@ class Data(TreeLimb):
 
             retrieve('mydata', where='index = 3')
 
-        See :meth:`pandas.HDFStore.select` for more information.
+        See :meth:`pandas.HDFStore.select` for more information. Objects
+        stored with the 'fast-read' profile (see :meth:`add`) can't be
+        selected from with *where*, and select *columns* after reading.
+
+        For numpy arrays, *start*, *stop*, and *step* select along the first
+        axis, while *index* takes any numpy-style index. Only the selected
+        elements are read from disk, so the last 1000 rows of a large array
+        can be had with::
+
+            retrieve('myarray', start=-1000)
+
+        Numpy arrays stored contiguously and without compression can also be
+        returned as a read-only :class:`numpy.memmap` with *mmap*, avoiding a
+        copy and sharing the page cache between processes reading the same
+        array. Replacing the array writes a new file, so a map in use keeps
+        giving the data it was made from.
+
+        If caching is enabled with :func:`datreant.data.cache.enable`,
+        repeated retrievals of the same selection are served from memory
+        while the dataset is unchanged. Numpy arrays are then returned as
+        read-only views, so copy them before modifying them in place. With
+        :func:`datreant.data.shm.enable`, numeric arrays and pandas objects
+        are also shared with other processes on the node through shared
+        memory, and are returned read-only.
 
         :Arguments:
             *handle*
@@ -341,9 +573,10 @@ class Data(TreeLimb):
             *where*
                 conditions for what rows/columns to return
             *start*
-                row number to start selection
+                row number to start selection; negative to count from the
+                end
             *stop*
-                row number to stop selection
+                row number to stop selection; negative to count from the end
             *columns*
                 list of columns to return; all columns returned by default
             *iterator*
@@ -351,21 +584,227 @@ class Data(TreeLimb):
             *chunksize*
                 number of rows to include in iteration; implies
                 ``iterator=True``
+            *step*
+                for numpy arrays, step along first axis for selection
+            *index*
+                for numpy arrays, numpy-style index (integer, slice, or tuple
+                of these) giving the selection to return
+            *mmap*
+                for numpy arrays, if True, return a read-only memory map of
+                the array if it is stored contiguously and uncompressed;
+                otherwise, the array is read as usual [``False``]
 
         :Returns:
             *data*
                 stored data; ``None`` if nonexistent
 
         """
-        return self._datafile.get_data('main', **kwargs)
+        return _retrieve_datafile(self._datafile.datadir,
+                                  self._datafile.datafiletype, kwargs)
 
-    @_write_datafile
-    def append(self, handle, data):
+    def retrieve_many(self, handles, workers=None, executor=None, **kwargs):
+        """Retrieve several stored datasets at once.
+
+        The datafile for each dataset is resolved from the Tree's manifest in
+        one pass, instead of looking in each dataset's directory in turn.
+        Reads are grouped by datafile type and can be done concurrently. As
+        with :meth:`retrieve`, results are served from the caches, if
+        enabled; with a process pool, those of the worker processes.
+
+        Raises :exc:`KeyError` if any of the datasets doesn't exist.
+
+        :Arguments:
+            *handles*
+                names of data to retrieve
+
+        :Keywords:
+            *workers*
+                number of datasets to read concurrently; ``None`` reads
+                datasets serially [``None``]
+            *executor*
+                'thread' to read datasets with a thread pool, 'process' to
+                use a process pool, or an existing
+                :class:`concurrent.futures.Executor` to submit reads to
+                ['thread']
+
+        All other keywords are applied to each dataset's selection; see
+        :meth:`retrieve`.
+
+        :Returns:
+            *datasets*
+                dictionary giving the stored data for each handle
+
+        """
+        known = self._read_manifest()
+        if known is None:
+            known = self._build_manifest()
+
+        filetypes = dict()
+        for handle in handles:
+            if handle in known:
+                filetypes[handle] = known[handle]
+            else:
+                filetypes[handle] = self._get_datafile(handle)[2]
+
+        # group reads of the same type of datafile together
+        order = sorted(filetypes, key=lambda handle: filetypes[handle])
+        results = parallel.map_ordered(
+                _retrieve_datafile,
+                [(os.path.join(self._tree.abspath, handle), filetypes[handle],
+                  kwargs) for handle in order],
+                workers=workers, executor=executor)
+
+        return dict(zip(order, results))
+
+    def iter_chunks(self, handle, chunksize=100000, **kwargs):
+        """Iterate over a stored dataset in chunks of rows.
+
+        Each chunk is read from disk only when it is reached, so datasets
+        larger than memory can be processed one chunk at a time. For pandas
+        objects and numpy arrays, chunks are taken along the first axis;
+        pickled python objects are yielded whole as a single chunk.
+
+        Raises :exc:`KeyError` if dataset doesn't exist.
+
+        :Arguments:
+            *handle*
+                name of data to iterate over
+
+        :Keywords:
+            *chunksize*
+                number of rows in each chunk [100000]
+            *start*
+                row number to start iteration
+            *stop*
+                row number to stop iteration
+
+        All other keywords are applied to each chunk's selection; see
+        :meth:`retrieve`.
+
+        """
+        filename, proxy, filetype = self._get_datafile(handle)
+        datafile = DataFile(os.path.join(self._tree.abspath, handle),
+                            datafiletype=filetype)
+
+        return datafile.iter_data('main', chunksize, **kwargs)
+
+    @_read_datafile
+    def info(self, handle):
+        """Get metadata for a stored dataset without reading its data.
+
+        Only the metadata stored in HDF5 files and the headers of pickles are
+        read, so this is cheap regardless of how large the dataset is, and
+        can be used to plan memory use before retrieving it::
+
+            >>> t.data.info('mydata')['nrows']
+            1000000
+
+        Raises :exc:`KeyError` if dataset doesn't exist.
+
+        :Arguments:
+            *handle*
+                name of dataset to describe
+
+        :Returns:
+            *info*
+                dictionary of metadata for the dataset; all datasets give
+                their 'datatype' ('numpy', 'pandas', or 'python'), the
+                'size' in bytes they use on disk, and the 'mtime' of their
+                file; numpy arrays give their 'shape', 'nrows', 'dtype',
+                'chunks', and 'compression'; pandas objects give their
+                'pandas_type', 'shape', 'nrows', 'columns', 'dtypes',
+                'profile', and 'compression'; pickled python objects give
+                their 'compression' and number of out-of-band 'buffers'
+
+        """
+        return self._datafile.get_info('main')
+
+    @_read_datafile
+    def nrows(self, handle):
+        """Get the number of rows of a stored dataset without reading it.
+
+        For pandas objects, this is the number of rows recorded in the file's
+        metadata, plus any rows staged by buffered appends (see
+        :meth:`append`); for numpy arrays, it is the length of the first
+        axis. Together with negative *start* and *stop* in :meth:`retrieve`,
+        this gives the latest rows of a growing dataset without reading the
+        rest.
+
+        Raises :exc:`KeyError` if dataset doesn't exist.
+
+        :Arguments:
+            *handle*
+                name of dataset
+
+        :Returns:
+            *nrows*
+                number of rows; ``None`` for numpy scalars and pickled python
+                objects
+
+        """
+        return self._datafile.get_nrows('main')
+
+    def session(self, maxopen=16):
+        """Keep data files open for reuse within a block.
+
+        Reading a dataset normally opens its file, reads from it, and closes
+        it. Within a session, files opened for reading are instead kept open
+        and reused by later reads, which helps in loops that read from the
+        same datasets many times::
+
+            with t.data.session():
+                for i in range(0, 1000000, 1000):
+                    chunk = t.data.retrieve('mydata', start=i, stop=i+1000)
+
+        Locks are applied for each read as usual, and a pooled file is
+        reopened if it has changed since it was opened, so changes made by
+        other processes are seen. Sessions apply to all data read by the
+        current thread, not just that of this Tree.
+
+        Pooled handles to pandas datasets keep other processes from writing
+        to them, unless HDF5's file locks are disabled in those processes;
+        see :mod:`datreant.data.pool`.
+
+        :Keywords:
+            *maxopen*
+                maximum number of files to keep open; least recently used
+                files are closed first [16]
+
+        """
+        return pool.session(maxopen=maxopen)
+
+    @property
+    def lazy(self):
+        """Lazy access to stored datasets.
+
+        Indexing this with a handle gives a
+        :class:`~datreant.data.lazy.DataProxy` for the dataset, exposing its
+        shape, dtypes, and columns without reading its data. Data is read
+        only when the proxy itself is indexed, and then only the selection
+        requested::
+
+            >>> proxy = t.data.lazy['mydata']
+            >>> proxy.nrows
+            1000000
+            >>> proxy[1000:2000]  # reads only these rows
+            >>> proxy['A']        # reads only this column
+
+        """
+        return LazyData(self)
+
+    def append(self, handle, data, **kwargs):
         """Append rows to an existing dataset.
 
-        The object must be of the same pandas class (Series, DataFrame, Panel)
-        as the existing dataset, and it must have exactly the same columns
-        (names included).
+        For pandas objects, the object must be of the same pandas class
+        (Series, DataFrame, Panel) as the existing dataset, and it must have
+        exactly the same columns (names included).
+
+        For numpy arrays, rows are appended along the first axis, and all
+        other dimensions must match those of the existing array. Only the new
+        rows are written, so arrays can be grown incrementally at a cost
+        proportional to the rows added.
+
+        If the dataset doesn't exist, it is created.
 
         :Arguments:
             *handle*
@@ -373,25 +812,394 @@ class Data(TreeLimb):
             *data*
                 data to append
 
+        Pandas objects stored with the 'fast-read' profile are rewritten as
+        tables with the 'appendable' profile on their first append. When
+        appending to a pandas table many times in a row, pass ``index=False``
+        to skip updating its indexes each time, then build them once at the
+        end with :meth:`reindex`; selections with *where* stay correct in
+        between, but don't use the out-of-date indexes::
+
+            for chunk in chunks:
+                t.data.append('mydata', chunk, index=False)
+            t.data.reindex('mydata')
+
+        When many processes make small appends to the same pandas dataset,
+        pass ``buffered=True`` to stage the rows in a spool file belonging to
+        each process instead of storing them. Staging doesn't wait on other
+        writers or readers, and staged rows are returned by :meth:`retrieve`
+        after the stored rows. Staged rows are stored together in one append
+        by :meth:`compact`, once a process has staged *buffersize* bytes, or
+        before rows are appended directly.
+
+        Storage options used when creating a new dataset can be given as
+        keywords; see :meth:`add`.
+
+        :Keywords:
+            *buffered*
+                if True, stage rows of pandas objects for a later
+                :meth:`compact` instead of storing them; rows are stored
+                directly if the dataset doesn't exist yet [``False``]
+            *buffersize*
+                if buffered, compact once this process has staged this many
+                bytes; ``None`` to compact only when :meth:`compact` is
+                called [16 MiB]
+
+        """
+        if kwargs.get('buffered'):
+            # staging rows for an existing dataset changes neither the Tree's
+            # datasets nor their files, so the manifest is left alone; cached
+            # results are stamped with the spool's state, so go stale alone
+            datadir = os.path.join(self._tree.abspath, handle)
+            if os.path.exists(os.path.join(datadir, pddata.pddatafile)):
+                datafile = DataFile(datadir, datafiletype=pddata.pddatafile)
+                datafile.append_data('main', data, **kwargs)
+                return
+
+        self._append(handle, data, **kwargs)
+
+    @_write_datafile
+    def _append(self, handle, data, **kwargs):
+        """Append rows to a dataset, storing it if it doesn't exist.
+
+        """
+        self._datafile.append_data('main', data, **kwargs)
+
+    def compact(self, handle, index=None):
+        """Store all rows staged by buffered appends to a pandas dataset.
+
+        Rows staged by all processes are stored in a single append, which
+        writes the table in larger pieces than the appends that staged them.
+        Retrieving the dataset gives the same rows before and after.
+
+        Raises :exc:`KeyError` if dataset doesn't exist, and :exc:`TypeError`
+        if it isn't a pandas object.
+
+        :Arguments:
+            *handle*
+                name of dataset to compact
+
+        :Keywords:
+            *index*
+                if True, update indexes after appending; if False, defer
+                updating them to :meth:`reindex`; ``None`` for the dataset's
+                storage profile's default
+
+        :Returns:
+            *nrows*
+                number of staged rows stored
+
+        """
+        filename, proxy, filetype = self._get_datafile(handle)
+        datafile = DataFile(os.path.join(self._tree.abspath, handle),
+                            datafiletype=filetype)
+        return datafile.compact_data('main', index=index)
+
+    def reindex(self, handle, columns=None, optlevel=None, kind=None):
+        """Build indexes for a pandas object stored as a table.
+
+        Raises :exc:`KeyError` if dataset doesn't exist, and :exc:`TypeError`
+        if it isn't a pandas object.
+
+        :Arguments:
+            *handle*
+                name of dataset to index
+
+        :Keywords:
+            *columns*
+                list of data columns to index; ``None`` for all
+            *optlevel*
+                optimization level of indexes, from 0 to 9; ``None`` for that
+                given when the dataset was stored
+            *kind*
+                kind of indexes, one of 'ultralight', 'light', 'medium', or
+                'full'; ``None`` for that given when the dataset was stored
+
         """
-        self._datafile.append_data('main', data)
+        filename, proxy, filetype = self._get_datafile(handle)
+        datafile = DataFile(os.path.join(self._tree.abspath, handle),
+                            datafiletype=filetype)
+        datafile.reindex_data('main', columns=columns, optlevel=optlevel,
+                              kind=kind)
+
+    def recompress(self, handle, complib=None, complevel=None):
+        """Rewrite a pandas object stored in Treant with different compression.
+
+        The dataset is rewritten in place, keeping its storage profile, data
+        columns, and indexes, and the space used by its old data is
+        reclaimed. Retrieving the dataset blocks until this is done. For
+        example, to store a dataset that is read often for faster
+        decompression::
+
+            recompress('mydata', complib='blosc:lz4', complevel=1)
+
+        Raises :exc:`KeyError` if dataset doesn't exist, and :exc:`TypeError`
+        if it isn't a pandas object.
+
+        :Arguments:
+            *handle*
+                name of dataset to recompress
+
+        :Keywords:
+            *complib*
+                compression library to use, such as 'zlib', 'blosc',
+                'blosc:lz4', or 'blosc:zstd'; ``None`` for that currently
+                used
+            *complevel*
+                compression level from 0 (none) to 9; ``None`` for that
+                currently used
+
+        """
+        filename, proxy, filetype = self._get_datafile(handle)
+        datafile = DataFile(os.path.join(self._tree.abspath, handle),
+                            datafiletype=filetype)
+        datafile.recompress_data('main', complib=complib, complevel=complevel)
 
     def keys(self):
         """List available datasets.
 
+        Datasets are listed from the Tree's manifest, which is rebuilt
+        automatically if any directory leading to a dataset has changed since
+        it was written. Datasets added by hand to directories not already
+        holding data may not be seen until :meth:`rebuild_manifest` is called.
+
+        :Returns:
+            *handles*
+                list of handles to available datasets
+
+        """
+        datasets = self._read_manifest()
+        if datasets is None:
+            datasets = self._build_manifest()
+
+        return sorted(datasets)
+
+    def _get_defaults_file(self, create=False):
+        """Return the Tree's file of default storage options.
+
+        :Keywords:
+            *create*
+                if True, create the directory for the file if it doesn't
+                already exist
+
+        :Returns:
+            *defaults*
+                the defaults file; ``None`` if it can't be used
+
+        """
+        mdir = os.path.join(self._tree.abspath, manifest.manifestdir)
+        if create:
+            self._makedirs(mdir)
+
+        try:
+            return defaults.Defaults(os.path.join(mdir, defaults.defaultsfile))
+        except (IOError, OSError):
+            return None
+
+    def get_defaults(self, datatype=None):
+        """Get default storage options for this Tree's datasets.
+
+        :Keywords:
+            *datatype*
+                kind of data to get options for; one of 'numpy', 'pandas', or
+                'python'; if ``None``, get options for all kinds
+
+        :Returns:
+            *options*
+                dictionary of storage options; if *datatype* is ``None``,
+                a dictionary of these keyed by kind of data
+
+        """
+        if datatype is not None and datatype not in defaults.datatypes:
+            raise ValueError("*datatype* must be one of {}".format(
+                sorted(defaults.datatypes)))
+
+        options = dict()
+        df = self._get_defaults_file()
+        if df is not None:
+            try:
+                with df.read() as state:
+                    options = dict(state)
+            except (IOError, OSError, ValueError):
+                pass
+
+        if datatype is not None:
+            return options.get(datatype, dict())
+
+        return options
+
+    def set_defaults(self, datatype, **kwargs):
+        """Set default storage options for this Tree's datasets.
+
+        Options given here are used whenever data of the given kind is
+        stored, unless overridden by keywords given to :meth:`add`. Setting
+        an option to ``None`` removes it from the defaults.
+
+        For example, to compress all numpy arrays stored in this Tree::
+
+            set_defaults('numpy', compression='gzip', compression_opts=4)
+
+        :Arguments:
+            *datatype*
+                kind of data the options apply to; one of 'numpy', 'pandas',
+                or 'python'
+
+        See :meth:`add` for the options available for each kind of data.
+
+        """
+        if datatype not in defaults.datatypes:
+            raise ValueError("*datatype* must be one of {}".format(
+                sorted(defaults.datatypes)))
+
+        df = self._get_defaults_file(create=True)
+        with df.write() as state:
+            options = state.setdefault(datatype, dict())
+            for key, value in kwargs.items():
+                if value is None:
+                    options.pop(key, None)
+                else:
+                    options[key] = value
+
+    def rebuild_manifest(self):
+        """Rebuild the manifest of datasets by walking the full Tree.
+
         :Returns:
             *handles*
                 list of handles to available datasets
 
         """
-        datasets = list()
+        return sorted(self._build_manifest())
+
+    def _get_manifest(self, create=False):
+        """Return the Tree's manifest file.
+
+        :Keywords:
+            *create*
+                if True, create the directory for the manifest if it doesn't
+                already exist
+
+        :Returns:
+            *manifest*
+                the manifest file; ``None`` if it can't be used
+
+        """
+        mdir = os.path.join(self._tree.abspath, manifest.manifestdir)
+        if create:
+            self._makedirs(mdir)
+
+        try:
+            return manifest.Manifest(os.path.join(mdir, manifest.manifestfile))
+        except (IOError, OSError):
+            return None
+
+    def _read_manifest(self):
+        """Read the dataset handles and types from the manifest.
+
+        :Returns:
+            *datasets*
+                dictionary giving the datafile type for each dataset handle;
+                ``None`` if the manifest doesn't exist or is stale
+
+        """
+        mf = self._get_manifest()
+        if mf is None:
+            return None
+
+        try:
+            with mf.read() as state:
+                datasets = state['datasets']
+                dirs = state['dirs']
+        except (IOError, OSError, ValueError, KeyError):
+            return None
+
+        if not dirs or manifest.stat_dirs(self._tree.abspath, dirs) != dirs:
+            return None
+
+        return datasets
+
+    def _build_manifest(self):
+        """Walk the Tree for datasets and write the result to the manifest.
+
+        :Returns:
+            *datasets*
+                dictionary giving the datafile type for each dataset handle
+
+        """
         top = self._tree.abspath
-        for root, dirs, files in os.walk(top):
-            if ((pddata.pddatafile in files) or
-                    (npdata.npdatafile in files) or
-                    (pydata.pydatafile in files)):
-                datasets.append(os.path.relpath(root, start=top))
+        if not os.path.isdir(top):
+            return dict()
+
+        mf = self._get_manifest(create=True)
+        datasets = manifest.walk_datasets(top)
 
-        datasets.sort()
+        if mf is not None:
+            reldirs = set()
+            for handle in datasets:
+                reldirs.update(manifest.tracked_dirs(handle))
+            reldirs.add('.')
+
+            try:
+                with mf.write() as state:
+                    state['datasets'] = datasets
+                    state['dirs'] = manifest.stat_dirs(top, reldirs)
+            except (IOError, OSError):
+                pass
 
         return datasets
+
+    def _update_manifest(self, changed, before):
+        """Update the manifest entries for datasets after they were changed.
+
+        If any directory leading to the datasets was modified by someone else
+        before this change, the manifest is marked stale instead so that it
+        will be rebuilt on next use.
+
+        :Arguments:
+            *changed*
+                dictionary giving the datafile type written or removed for
+                each changed dataset
+            *before*
+                modification times of the datasets' tracked directories from
+                just before the change was made
+
+        """
+        top = self._tree.abspath
+        mf = self._get_manifest()
+        if mf is None:
+            return
+
+        # datasets are recorded with the datafile type reads will pick, which
+        # need not be the one changed
+        reldirs = set()
+        resolved = dict()
+        for handle in changed:
+            reldirs.update(manifest.tracked_dirs(handle))
+            metadata_ops['listdir'] += 1
+            try:
+                files = os.listdir(os.path.join(top, handle))
+            except OSError:
+                files = []
+            resolved[handle] = manifest.resolve(files)
+
+        try:
+            with mf.write() as state:
+                dirs = state['dirs']
+                if not dirs:
+                    return
+
+                if any(d in dirs and dirs[d] != before[d] for d in reldirs):
+                    state['dirs'] = dict()
+                    return
+
+                for handle, datafiletype in resolved.items():
+                    if datafiletype is not None:
+                        state['datasets'][handle] = datafiletype
+                    else:
+                        state['datasets'].pop(handle, None)
+
+                for d, mtime in manifest.stat_dirs(top, reldirs).items():
+                    if mtime is None:
+                        dirs.pop(d, None)
+                    else:
+                        dirs[d] = mtime
+        except (IOError, OSError, ValueError, KeyError):
+            pass
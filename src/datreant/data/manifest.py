@@ -0,0 +1,136 @@
+"""
+Persistent index of the datasets stored in a Tree.
+
+Listing datasets by walking the whole Tree is expensive when the Tree also
+holds large non-data hierarchies. The manifest records each dataset's handle
+and datafile type, along with the modification times of the directories
+leading to them. If any of these directories has changed since the manifest
+was written, the manifest is considered stale and is rebuilt with a walk.
+
+"""
+import os
+
+from datreant.core.backends.core import JSONFile
+
+from . import npdata, pddata, pydata, spool
+from .core import metadata_ops
+
+
+manifestdir = '.data'
+manifestfile = 'manifest.json'
+
+datafiletypes = (pddata.pddatafile, npdata.npdatafile, pydata.pydatafile)
+
+
+class Manifest(JSONFile):
+    """Interface to the manifest file of a Tree.
+
+    The state is a dictionary with two entries: 'datasets', giving the
+    datafile type for each dataset handle, and 'dirs', giving the
+    modification time of each directory the manifest's validity depends on,
+    relative to the top of the Tree.
+
+    """
+    def _init_state(self):
+        self._state = {'datasets': {}, 'dirs': {}}
+
+
+def resolve(files):
+    """Pick the datafile type read for a dataset from its directory's files.
+
+    A dataset directory can hold datafiles of several types, such as when an
+    array was appended to a pickled object; the type listed last in
+    :data:`datafiletypes` is the one read.
+
+    :Arguments:
+        *files*
+            names of the files in the dataset's directory
+
+    :Returns:
+        *datafiletype*
+            datafile type read; ``None`` if there is no datafile
+
+    """
+    datafiletype = None
+    for dfiletype in datafiletypes:
+        if dfiletype in files:
+            datafiletype = dfiletype
+
+    return datafiletype
+
+
+def tracked_dirs(handle):
+    """Return the directories whose modification times track a dataset.
+
+    These are the dataset's own directory and all of its parents, up to and
+    including the top of the Tree (given as '.').
+
+    :Arguments:
+        *handle*
+            name of dataset
+
+    :Returns:
+        *dirs*
+            list of directory paths relative to the top of the Tree
+
+    """
+    dirs = []
+    while handle:
+        dirs.append(handle)
+        handle = os.path.dirname(handle)
+    dirs.append('.')
+
+    return dirs
+
+
+def stat_dirs(top, reldirs):
+    """Get modification times for the given directories.
+
+    :Arguments:
+        *top*
+            absolute path to top of Tree
+        *reldirs*
+            directory paths relative to *top*
+
+    :Returns:
+        *mtimes*
+            dictionary giving the modification time of each directory;
+            ``None`` for directories that do not exist
+
+    """
+    mtimes = dict()
+    metadata_ops['stat'] += len(reldirs)
+    for reldir in reldirs:
+        try:
+            mtimes[reldir] = os.stat(os.path.join(top, reldir)).st_mtime
+        except OSError:
+            mtimes[reldir] = None
+
+    return mtimes
+
+
+def walk_datasets(top):
+    """Find all datasets in a Tree by walking its full directory tree.
+
+    :Arguments:
+        *top*
+            absolute path to top of Tree
+
+    :Returns:
+        *datasets*
+            dictionary giving the datafile type for each dataset handle
+
+    """
+    datasets = dict()
+    metadata_ops['walk'] += 1
+    for root, dirs, files in os.walk(top):
+        if root == top and manifestdir in dirs:
+            dirs.remove(manifestdir)
+        if spool.spooldir in dirs:
+            dirs.remove(spool.spooldir)
+
+        datafiletype = resolve(files)
+        if datafiletype is not None:
+            datasets[os.path.relpath(root, start=top)] = datafiletype
+
+    return datasets
@@ -3,15 +3,72 @@ File backends for storing numpy arrays.
 
 """
 
+import os
+from contextlib import contextmanager
+
+import numpy as np
 import h5py
 
-from datreant.core.backends.core import File
+from .pool import PooledFile
 
 
 npdatafile = 'npData.h5'
 
+#: keywords for opening files without HDF5's own file locks, where h5py
+#: supports it; see :mod:`datreant.data.pool`
+h5py_nolocking = ({'locking': False}
+                  if h5py.version.version_tuple[:2] >= (3, 5) else {})
+
+
+def guess_chunks(shape, dtype, target=2**18, unlimited=False):
+    """Guess a chunk shape for an array.
+
+    Chunks span whole rows where possible, taking as many rows along the
+    first axis as fit in roughly *target* bytes, since datasets are most
+    often read and appended in blocks of rows. If a single row is larger
+    than *target*, the largest remaining dimensions are halved until the
+    chunk fits.
+
+    :Arguments:
+        *shape*
+            shape of the array
+        *dtype*
+            dtype of the array
+
+    :Keywords:
+        *target*
+            approximate size of each chunk in bytes [256 KiB]
+        *unlimited*
+            if True, the first axis can grow, so the number of rows in
+            each chunk isn't limited by the array's current length
+
+    :Returns:
+        *chunks*
+            chunk shape; ``None`` for scalars, which cannot be chunked
+
+    """
+    if not shape:
+        return None
+
+    itemsize = np.dtype(dtype).itemsize
+    chunks = [max(1, dim) for dim in shape]
 
-class npDataFile(File):
+    rowbytes = itemsize * int(np.prod(chunks[1:]))
+    rows = target // rowbytes
+    if not unlimited:
+        rows = min(chunks[0], rows)
+    chunks[0] = max(1, rows)
+
+    while chunks[0] == 1 and itemsize * np.prod(chunks) > target:
+        largest = int(np.argmax(chunks[1:])) + 1
+        if chunks[largest] == 1:
+            break
+        chunks[largest] = (chunks[largest] + 1) // 2
+
+    return tuple(chunks)
+
+
+class npDataFile(PooledFile):
     """Interface to numpy object data files.
 
     Data is stored as numpy arrays in the HDF5 format. This class gives the
@@ -19,13 +76,74 @@ class npDataFile(File):
     its backend.
 
     """
+    # new data replaces the whole file, unless appending
+    _truncate = True
+
+    @property
+    def _tmpfile(self):
+        return self.filename + '.tmp'
+
     def _open_file_r(self):
-        return h5py.File(self.filename, 'r')
+        return h5py.File(self.filename, 'r', **h5py_nolocking)
 
     def _open_file_w(self):
-        return h5py.File(self.filename, 'w')
+        if self._truncate:
+            return h5py.File(self._tmpfile, 'w', **h5py_nolocking)
+        else:
+            return h5py.File(self.filename, 'a', **h5py_nolocking)
+
+    @contextmanager
+    def write(self):
+        # a file replacing the whole of the existing one is written anew and
+        # moved into place once complete, so that memory maps of the existing
+        # file held by readers stay valid
+        nested = self.fdlock == 'exclusive'
+        with super(npDataFile, self).write() as handle:
+            try:
+                yield handle
+            except Exception:
+                if not nested and self._truncate:
+                    self.handle.close()
+                    if os.path.exists(self._tmpfile):
+                        os.remove(self._tmpfile)
+                raise
+
+            if not nested and self._truncate:
+                self.handle.close()
+                os.rename(self._tmpfile, self.filename)
 
-    def add_data(self, key, data):
+    @staticmethod
+    def _storage_options(data, chunks=None, compression=None,
+                         compression_opts=None, shuffle=False,
+                         unlimited=False):
+        """Build keywords for creating a dataset with the given options.
+
+        With *unlimited*, options are for a dataset with an unlimited first
+        axis, which is chunked even if *data* is empty.
+
+        """
+        kwargs = dict()
+        if data.ndim > 0 and (data.size > 0 or unlimited):
+            if chunks is None and (compression is not None or shuffle):
+                chunks = 'auto'
+            if chunks in ('auto', True):
+                chunks = guess_chunks(data.shape, data.dtype,
+                                      unlimited=unlimited)
+            elif chunks is not None:
+                chunks = tuple(chunks)
+
+            if chunks is not None:
+                kwargs['chunks'] = chunks
+            if compression is not None:
+                kwargs['compression'] = compression
+                kwargs['compression_opts'] = compression_opts
+            if shuffle:
+                kwargs['shuffle'] = True
+
+        return kwargs
+
+    def add_data(self, key, data, chunks=None, compression=None,
+                 compression_opts=None, shuffle=False):
         """Add a numpy array to the data file.
 
         If data already exists for the given key, then it is overwritten.
@@ -36,27 +154,232 @@ class npDataFile(File):
                 the data later
             *data*
                 the numpy array to store
+
+        :Keywords:
+            *chunks*
+                chunk shape to store the array with; 'auto' chooses one
+                with :func:`guess_chunks`; ``None`` stores the array
+                contiguously unless compression is used, in which case
+                'auto' is implied
+            *compression*
+                compression filter to apply, such as 'gzip' or 'lzf';
+                ``None`` for no compression
+            *compression_opts*
+                options for the compression filter; for 'gzip', the
+                compression level from 0 to 9
+            *shuffle*
+                if True, apply the byte-shuffle filter before compression,
+                which often improves compression of numeric data
         """
+        kwargs = self._storage_options(data, chunks, compression,
+                                       compression_opts, shuffle)
+
         with self.write():
             try:
-                self.handle.create_dataset(key, data=data)
+                self.handle.create_dataset(key, data=data, **kwargs)
             except RuntimeError:
                 del self.handle[key]
-                self.handle.create_dataset(key, data=data)
+                self.handle.create_dataset(key, data=data, **kwargs)
+
+    def append_data(self, key, data, chunks=None, compression=None,
+                    compression_opts=None, shuffle=False):
+        """Append rows to a numpy array stored in the data file.
+
+        Rows are appended along the first axis, so all other dimensions of
+        *data* must match those of the stored array. Arrays are stored as
+        chunked datasets with an unlimited first axis, so an append writes
+        only the new rows. An array stored without an unlimited first axis,
+        as :meth:`add_data` does, is rewritten once as such on its first
+        append.
+
+        If no array exists for the given key, *data* is stored as a new
+        array that can be appended to.
+
+        :Arguments:
+            *key*
+                name of existing array to append to
+            *data*
+                the array whose rows are to be appended
+
+        :Keywords:
+            *chunks*, *compression*, *compression_opts*, *shuffle*
+                storage options used if a new dataset must be created; see
+                :meth:`add_data`; chunking is always used, with 'auto' as
+                the default chunk shape
+
+        """
+        if data.ndim == 0:
+            raise ValueError("Cannot append a scalar array; "
+                             "rows must be appended along the first axis")
+
+        self._truncate = False
+        try:
+            with self.write():
+                if key in self.handle:
+                    dataset = self.handle[key]
+                    if dataset.shape[1:] != data.shape[1:]:
+                        raise ValueError(
+                            "Cannot append rows of shape {} to stored array "
+                            "with rows of shape {}".format(data.shape[1:],
+                                                           dataset.shape[1:]))
 
-    def get_data(self, key, **kwargs):
+                    if dataset.maxshape[0] is not None:
+                        # store existing data again as an appendable dataset;
+                        # the file is replaced to reclaim the old space
+                        chunks = dataset.chunks or chunks
+                        compression = dataset.compression or compression
+                        compression_opts = (dataset.compression_opts or
+                                            compression_opts)
+                        shuffle = dataset.shuffle or shuffle
+                        data = np.concatenate((dataset[()], data))
+
+                        self.handle.close()
+                        self._truncate = True
+                        self.handle = self._open_file_w()
+                    else:
+                        nrows = dataset.shape[0]
+                        dataset.resize(nrows + data.shape[0], axis=0)
+                        dataset[nrows:] = data
+                        return
+
+                kwargs = self._storage_options(
+                    data, chunks or 'auto', compression, compression_opts,
+                    shuffle, unlimited=True)
+                self.handle.create_dataset(
+                    key, data=data, maxshape=(None,) + data.shape[1:],
+                    **kwargs)
+        finally:
+            self._truncate = True
+
+    def get_data(self, key, start=None, stop=None, step=None, index=None,
+                 mmap=False, **kwargs):
         """Retrieve numpy array stored in file.
 
+        Selections are resolved as HDF5 hyperslab reads, so only the selected
+        elements are read from disk.
+
+        With *mmap*, a contiguous, uncompressed array is returned as a
+        read-only :class:`numpy.memmap` over its location in the file instead
+        of being copied into memory. Processes mapping the same array share
+        its pages in the page cache. The map stays valid after this method
+        returns, and still gives the same data if the array is replaced.
+
         :Arguments:
             *key*
                 name of data to retrieve
 
+        :Keywords:
+            *start*
+                index along first axis to start selection
+            *stop*
+                index along first axis to stop selection
+            *step*
+                step along first axis for selection; must be positive
+            *index*
+                numpy-style index (integer, slice, or tuple of these) giving
+                the selection to return; cannot be combined with *start*,
+                *stop*, or *step*
+            *mmap*
+                if True, return a read-only memory map of the array if it is
+                stored contiguously and uncompressed; otherwise, the array is
+                read as usual [``False``]
+
         :Returns:
             *data*
                 the selected data
         """
+        if index is not None and not (start is None and stop is None and
+                                      step is None):
+            raise ValueError("*index* cannot be combined with *start*, "
+                             "*stop*, or *step*")
+
         with self.read():
-            return self.handle[key].value
+            dataset = self.handle[key]
+            if mmap:
+                mapped = self._memmap(dataset)
+                if mapped is not None:
+                    dataset = mapped
+
+            if index is not None:
+                return dataset[index]
+            elif start is None and stop is None and step is None:
+                return dataset[()]
+            else:
+                return dataset[start:stop:step]
+
+    def get_nrows(self, key):
+        """Get the length along the first axis of a numpy array stored in file.
+
+        Only the dataset's metadata is read.
+
+        :Arguments:
+            *key*
+                name of data
+
+        :Returns:
+            *nrows*
+                length of the array's first axis; ``None`` for scalars
+        """
+        with self.read():
+            shape = self.handle[key].shape
+            return shape[0] if shape else None
+
+    def get_info(self, key):
+        """Get metadata for a numpy array stored in file.
+
+        Only the dataset's metadata is read; none of its elements are.
+
+        :Arguments:
+            *key*
+                name of data to describe
+
+        :Returns:
+            *info*
+                dictionary giving the array's 'shape', 'nrows' (``None``
+                for scalars), and 'dtype', its 'chunks' (``None`` if stored
+                contiguously), its 'compression' as a dictionary of the
+                *compression*, *compression_opts*, and *shuffle* options it
+                was stored with, and the 'size' of the file in bytes
+        """
+        with self.read():
+            dataset = self.handle[key]
+            info = {'shape': dataset.shape,
+                    'nrows': dataset.shape[0] if dataset.ndim else None,
+                    'dtype': dataset.dtype,
+                    'chunks': dataset.chunks,
+                    'compression': {
+                        'compression': dataset.compression,
+                        'compression_opts': dataset.compression_opts,
+                        'shuffle': dataset.shuffle}}
+
+        info['size'] = os.path.getsize(self.filename)
+
+        return info
+
+    def _memmap(self, dataset):
+        """Memory-map a dataset, if its storage allows it.
+
+        :Arguments:
+            *dataset*
+                open h5py dataset to map
+
+        :Returns:
+            *mapped*
+                read-only memory map of the dataset; ``None`` if the dataset
+                is chunked, compressed, not yet allocated, or otherwise not
+                stored as one block in the file
+
+        """
+        if (dataset.ndim == 0 or dataset.size == 0 or
+                dataset.chunks is not None or dataset.dtype.hasobject):
+            return None
+
+        offset = dataset.id.get_offset()
+        if offset is None:
+            return None
+
+        return np.memmap(self.filename, mode='r', dtype=dataset.dtype,
+                         shape=dataset.shape, offset=offset)
 
     def del_data(self, key, **kwargs):
         """Delete a stored data object.
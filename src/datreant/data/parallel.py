@@ -0,0 +1,139 @@
+"""
+Helpers for fanning out dataset I/O across a pool of workers.
+
+"""
+import threading
+
+from six.moves import queue
+from concurrent.futures import (Executor, ThreadPoolExecutor,
+                                ProcessPoolExecutor)
+
+
+def get_executor(workers=None, executor=None):
+    """Build an executor for the given *workers* and *executor* settings.
+
+    :Arguments:
+        *workers*
+            number of workers to use; ``None`` or 1 means serial execution
+        *executor*
+            either 'thread' or 'process' to select the pool type, or an
+            existing :class:`concurrent.futures.Executor` instance to use
+            directly ['thread']
+
+    :Returns:
+        *executor*
+            executor to submit work to; ``None`` if work should be done
+            serially
+        *owned*
+            True if the executor was created here and should be shut down
+            by the caller when finished
+
+    """
+    if isinstance(executor, Executor):
+        return executor, False
+
+    if workers is None or workers <= 1:
+        return None, False
+
+    if executor in (None, 'thread'):
+        return ThreadPoolExecutor(max_workers=workers), True
+    elif executor == 'process':
+        return ProcessPoolExecutor(max_workers=workers), True
+    else:
+        raise ValueError("*executor* must be either 'thread', 'process', or "
+                         "an instance of concurrent.futures.Executor")
+
+
+def map_ordered(func, arglist, workers=None, executor=None):
+    """Apply *func* to each set of arguments in *arglist*.
+
+    Results are returned in the same order as *arglist*, regardless of the
+    order in which the workers complete. Exceptions raised by *func* are
+    re-raised in the calling thread.
+
+    :Arguments:
+        *func*
+            callable to apply; must be picklable (defined at module level) if
+            a process pool is used
+        *arglist*
+            list of argument tuples, one per call
+
+    :Keywords:
+        *workers*
+            number of workers to use; ``None`` or 1 means serial execution
+        *executor*
+            either 'thread' or 'process' to select the pool type, or an
+            existing :class:`concurrent.futures.Executor` instance to use
+            directly ['thread']
+
+    :Returns:
+        *results*
+            list of results, one per set of arguments
+
+    """
+    pool, owned = get_executor(workers, executor)
+
+    if pool is None:
+        return [func(*args) for args in arglist]
+
+    try:
+        futures = [pool.submit(func, *args) for args in arglist]
+        return [future.result() for future in futures]
+    finally:
+        if owned:
+            pool.shutdown(wait=True)
+
+
+def prefetch(iterable, size=1):
+    """Iterate over *iterable*, reading up to *size* items ahead.
+
+    Items are pulled from *iterable* by a background thread and buffered, so
+    that reading the next item overlaps with processing of the current one.
+    At most *size* items are held in the buffer at once. Exceptions raised
+    while reading are re-raised in the consuming thread.
+
+    :Arguments:
+        *iterable*
+            iterable to read from
+        *size*
+            maximum number of items to read ahead [1]
+
+    """
+    buffer = queue.Queue(maxsize=size)
+    done = object()
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put((True, item)):
+                    return
+        except Exception as e:
+            put((False, e))
+        else:
+            put((True, done))
+
+    thread = threading.Thread(target=produce)
+    thread.daemon = True
+    thread.start()
+
+    try:
+        while True:
+            ok, item = buffer.get()
+            if not ok:
+                raise item
+            elif item is done:
+                return
+            yield item
+    finally:
+        # signal the producer to stop if we are closed early
+        stop.set()
@@ -3,17 +3,39 @@ File backends for storing pandas objects.
 
 """
 
+import os
+import threading
+from contextlib import contextmanager
+
 import pandas as pd
 import numpy as np
 
 
-from datreant.core.backends.core import File
+from .pool import PooledFile
+from .spool import Spool
 
 
 pddatafile = 'pdData.h5'
 
+#: storage profiles for pandas objects, giving the HDFStore options each uses;
+#: 'fast-read' stores objects uncompressed in the fixed format, fastest to
+#: write and read in full; 'queryable' stores them as tables with all columns
+#: indexed for selection with *where*; 'appendable' stores them as tables
+#: without column indexes, which are fastest to append to
+profiles = {'fast-read': dict(format='fixed'),
+            'queryable': dict(format='table', data_columns=True,
+                              complevel=5, complib='blosc'),
+            'appendable': dict(format='table', index=False,
+                               complevel=5, complib='blosc')}
+
+default_profile = 'queryable'
+
+# PyTables is not thread-safe, so all access to pandas data files from within
+# a process is serialized through this lock
+tables_lock = threading.RLock()
 
-class pdDataFile(File):
+
+class pdDataFile(PooledFile):
     """Interface to pandas object data files.
 
     Data is stored as pandas data structures (Series, DataFrame, Panel) in
@@ -22,13 +44,170 @@ class pdDataFile(File):
     backend.
 
     """
+    # compression for objects in the fixed format, which HDFStore only applies
+    # to the whole store, not per object
+    _filters = dict()
+
+    def __init__(self, filename, **kwargs):
+        super(pdDataFile, self).__init__(filename, **kwargs)
+        self.spool = Spool(os.path.dirname(self.filename))
+
     def _open_file_r(self):
         return pd.HDFStore(self.filename, 'r')
 
     def _open_file_w(self):
-        return pd.HDFStore(self.filename, 'a')
+        return pd.HDFStore(self.filename, 'a', **self._filters)
+
+    @contextmanager
+    def read(self):
+        with tables_lock:
+            with super(pdDataFile, self).read() as handle:
+                yield handle
+
+    @contextmanager
+    def write(self):
+        with tables_lock:
+            with super(pdDataFile, self).write() as handle:
+                yield handle
+
+    @staticmethod
+    def _check_profile(profile):
+        if profile not in profiles:
+            raise ValueError("*profile* must be one of {}".format(
+                sorted(profiles)))
+
+    @staticmethod
+    def _compression(profile, complib=None, complevel=None):
+        """Resolve the compression to use for a storage profile.
+
+        """
+        compression = {'complib': profiles[profile].get('complib'),
+                       'complevel': profiles[profile].get('complevel')}
+        if complib is not None:
+            compression['complib'] = complib
+            if compression['complevel'] is None:
+                compression['complevel'] = 5
+        if complevel is not None:
+            compression['complevel'] = complevel
+
+        return compression
+
+    def _put(self, key, data, profile, data_columns=None, optlevel=None,
+             kind=None, index=None, complib=None, complevel=None):
+        """Store a pandas object with the options of a storage profile.
+
+        The profile, compression, and index options are recorded as
+        attributes of the stored object. Objects in the fixed format are
+        compressed with the filters the store was opened with, which should
+        match *complib* and *complevel*.
+
+        """
+        options = dict(profiles[profile])
+        options.update(self._compression(profile, complib, complevel))
+
+        if options['format'] != 'table':
+            del options['complib'], options['complevel']
+            self.handle.put(key, data, **options)
+
+            attrs = self.handle.get_storer(key).attrs
+            attrs.datreant_profile = profile
+            attrs.datreant_compression = self._compression(
+                profile, complib, complevel)
+            return
+
+        if index is None:
+            index = options.pop('index', True)
+        else:
+            options.pop('index', None)
+
+        if data_columns is not None:
+            options['data_columns'] = data_columns
+
+        if options.get('data_columns') is True:
+            # FIXME: band-aid heuristic to catch a known corner case that
+            # HDFStore doesn't catch; see ``Issue 20``
+            if (isinstance(data, pd.DataFrame) and
+                    data.columns.dtype == np.dtype('int64')):
+                del options['data_columns']
+
+        # indexes are built separately, with the options given
+        try:
+            self.handle.put(key, data, index=False, **options)
+        except AttributeError:
+            options.pop('data_columns', None)
+            self.handle.put(key, data, index=False, **options)
+
+        attrs = self.handle.get_storer(key).attrs
+        attrs.datreant_profile = profile
+        attrs.datreant_compression = {'complib': options.get('complib'),
+                                      'complevel': options.get('complevel')}
+        attrs.datreant_index = {'optlevel': optlevel, 'kind': kind}
+
+        if index:
+            self._create_index(key)
+
+    def _get_profile(self, key):
+        """Get the storage profile of a stored pandas object.
+
+        Objects stored before profiles were recorded are given the profile
+        matching their format.
+
+        """
+        storer = self.handle.get_storer(key)
+        profile = getattr(storer.attrs, 'datreant_profile', None)
+        if profile is None:
+            profile = 'queryable' if storer.is_table else 'fast-read'
+
+        return str(profile)
+
+    def _get_compression(self, key):
+        """Get the compression of a stored pandas object.
+
+        Objects stored before compression was recorded are given that of
+        their table, or of their first compressed array if not a table.
+
+        """
+        storer = self.handle.get_storer(key)
+        compression = getattr(storer.attrs, 'datreant_compression', None)
+        if compression is None and storer.is_table:
+            compression = {'complib': storer.table.filters.complib,
+                           'complevel': storer.table.filters.complevel}
+        elif compression is None:
+            compression = {'complib': None, 'complevel': None}
+            for leaf in storer.group._f_walknodes('Leaf'):
+                if leaf.filters.complevel:
+                    compression = {'complib': leaf.filters.complib,
+                                   'complevel': leaf.filters.complevel}
+                    break
+
+        return dict(compression)
+
+    def _create_index(self, key, columns=None, optlevel=None, kind=None):
+        """Build indexes for the columns of a stored table.
+
+        Index options not given are taken from those recorded when the table
+        was stored.
+
+        """
+        recorded = getattr(self.handle.get_storer(key).attrs,
+                           'datreant_index', None) or dict()
+        if optlevel is None:
+            optlevel = recorded.get('optlevel')
+        if kind is None:
+            kind = recorded.get('kind')
 
-    def add_data(self, key, data):
+        self.handle.create_table_index(key, columns=columns,
+                                       optlevel=optlevel, kind=kind)
+
+        # indexes left out of date by appends deferring them are rebuilt
+        table = self.handle.get_storer(key).table
+        if table.indexed:
+            table.autoindex = True
+            table.reindex_dirty()
+
+    def add_data(self, key, data, profile=default_profile, data_columns=None,
+                 optlevel=None, kind=None, index=None, complib=None,
+                 complevel=None):
         """Add a pandas data object (Series, DataFrame, Panel) to the data file.
 
         If data already exists for the given key, then it is overwritten.
@@ -40,30 +219,70 @@ class pdDataFile(File):
             *data*
                 the data object to store; should be either a Series, DataFrame,
                 or Panel
+
+        :Keywords:
+            *profile*
+                storage profile to use, one of 'fast-read', 'queryable', or
+                'appendable'; see :data:`profiles` ['queryable']
+            *data_columns*
+                list of columns to store as separate, indexable columns that
+                can be used in *where* selections; ``True`` for all columns;
+                ``None`` for the profile's default
+            *optlevel*
+                optimization level of indexes, from 0 to 9; ``None`` for the
+                PyTables default
+            *kind*
+                kind of indexes, one of 'ultralight', 'light', 'medium', or
+                'full'; ``None`` for the PyTables default
+            *index*
+                if True, build indexes now; if False, defer building them to
+                :meth:`reindex`; ``None`` for the profile's default
+            *complib*
+                compression library to use, such as 'zlib', 'blosc',
+                'blosc:lz4', or 'blosc:zstd'; ``None`` for the profile's
+                default, which is 'blosc' for tables and no compression for
+                the 'fast-read' profile
+            *complevel*
+                compression level from 0 (none) to 9; ``None`` for the
+                profile's default, or 5 if only *complib* is given
+
+        *data_columns*, *optlevel*, *kind*, and *index* apply only to tables,
+        and are ignored for the 'fast-read' profile.
         """
-        with self.write():
-            # index all columns if possible
-            try:
-                # FIXME: band-aid heuristic to catch a known corner case that
-                # HDFStore doesn't catch; see ``Issue 20``
-                if (isinstance(data, pd.DataFrame) and
-                        data.columns.dtype == np.dtype('int64')):
-                    raise AttributeError
-
-                self.handle.put(
-                    key, data, format='table', data_columns=True, complevel=5,
-                    complib='blosc')
-            except AttributeError:
-                self.handle.put(
-                    key, data, format='table', complevel=5, complib='blosc')
-
-    def append_data(self, key, data):
+        self._check_profile(profile)
+
+        if profiles[profile]['format'] != 'table':
+            self._filters = self._compression(profile, complib, complevel)
+        try:
+            with self.write():
+                # rows staged for the object being replaced are dropped
+                with self.spool.claim():
+                    self._put(key, data, profile, data_columns=data_columns,
+                              optlevel=optlevel, kind=kind, index=index,
+                              complib=complib, complevel=complevel)
+        finally:
+            self._filters = dict()
+
+    def append_data(self, key, data, profile=default_profile,
+                    data_columns=None, optlevel=None, kind=None, index=None,
+                    complib=None, complevel=None, buffered=False,
+                    buffersize=2**24):
         """Append rows to an existing pandas data object stored in the data file.
 
         Note that column names of new data must match those of the existing
         data. Columns cannot be appended due to the technical details of the
         HDF5 standard. To add new columns, store as a new dataset.
 
+        Objects stored with the 'fast-read' profile can't be appended to in
+        place; on the first append, they are rewritten as tables with the
+        'appendable' profile.
+
+        For many appends in a row, pass ``index=False`` to skip updating
+        indexes on each, then build them once with :meth:`reindex`. For many
+        small appends from concurrent writers, pass ``buffered=True`` to stage
+        rows in a spool file instead, and store them later with
+        :meth:`compact`.
+
         :Arguments:
             *key*
                 name of existing data object to append to
@@ -72,17 +291,226 @@ class pdDataFile(File):
                 stored data; must have same columns (with names) as existing
                 data
 
+        :Keywords:
+            *profile*
+                storage profile used if the object doesn't exist yet, along
+                with *data_columns*, *optlevel*, *kind*, *complib*, and
+                *complevel*; see :meth:`add_data`; tables keep the data
+                columns and compression they were stored with
+            *index*
+                if True, update indexes after appending; if False, defer
+                updating them to :meth:`reindex`; ``None`` for the profile's
+                default
+            *buffered*
+                if True, stage the rows in this process's spool file instead
+                of storing them, unless the data file doesn't exist yet;
+                staged rows are returned by :meth:`get_data`, but are checked
+                against the stored columns only when compacted [``False``]
+            *buffersize*
+                if buffered, compact staged rows once this process's spool
+                file reaches this many bytes; ``None`` to compact only when
+                :meth:`compact` is called [16 MiB]
+        """
+        self._check_profile(profile)
+
+        if buffered and os.path.exists(self.filename):
+            size = self.spool.stage(data)
+            if buffersize is not None and size >= buffersize:
+                self.compact(key, index=index)
+            return
+
+        if profiles[profile]['format'] != 'table':
+            self._filters = self._compression(profile, complib, complevel)
+        try:
+            with self.write():
+                # rows staged earlier are stored first, keeping their order
+                if key in self.handle and self.spool.pending():
+                    self._compact(key, index=index)
+
+                self._append(key, data, profile, data_columns=data_columns,
+                             optlevel=optlevel, kind=kind, index=index,
+                             complib=complib, complevel=complevel)
+        finally:
+            self._filters = dict()
+
+    def _append(self, key, data, profile, data_columns=None, optlevel=None,
+                kind=None, index=None, complib=None, complevel=None):
+        """Append rows to a stored pandas object, storing it if it's new.
+
+        """
+        if key not in self.handle:
+            self._put(key, data, profile, data_columns=data_columns,
+                      optlevel=optlevel, kind=kind, index=index,
+                      complib=complib, complevel=complevel)
+        elif not self.handle.get_storer(key).is_table:
+            existing = self.handle.get(key)
+            self.handle.remove(key)
+            self._put(key, pd.concat([existing, data]), 'appendable',
+                      optlevel=optlevel, kind=kind, index=index,
+                      complib=complib, complevel=complevel)
+        else:
+            # tables keep the data columns and compression they were stored
+            # with
+            if index is None:
+                stored = profiles[self._get_profile(key)]
+                index = stored.get('index', True)
+
+            # PyTables otherwise updates existing indexes as rows are
+            # appended; deferred, they are marked out of date instead
+            table = self.handle.get_storer(key).table
+            if table.indexed:
+                table.autoindex = bool(index)
+
+            self.handle.append(key, data, index=False)
+            if index:
+                self._create_index(key)
+
+    def compact(self, key, index=None):
+        """Store all rows staged by buffered appends in a single append.
+
+        Staged rows from all writers are appended in one batch, under the
+        data file's exclusive lock, and their spool files are removed. If
+        they can't be appended, such as for mismatched columns, they are left
+        staged.
+
+        :Arguments:
+            *key*
+                name of data the rows are staged for
+
+        :Keywords:
+            *index*
+                if True, update indexes after appending; if False, defer
+                updating them to :meth:`reindex`; ``None`` for the stored
+                profile's default
+
+        :Returns:
+            *nrows*
+                number of rows stored
         """
         with self.write():
+            return self._compact(key, index=index)
+
+    def _compact(self, key, index=None):
+        """Append staged rows to a stored pandas object.
+
+        """
+        with self.spool.claim() as staged:
+            if not staged:
+                return 0
+
+            data = pd.concat(staged)
+            self._append(key, data, 'appendable', index=index)
+
+        return len(data)
+
+    def reindex(self, key, columns=None, optlevel=None, kind=None):
+        """Build indexes for a pandas object stored as a table.
+
+        Existing indexes are rebuilt if their options differ from those
+        given, or if appends deferred updating them.
+
+        :Arguments:
+            *key*
+                name of data to index
+
+        :Keywords:
+            *columns*
+                list of data columns to index; ``None`` for all
+            *optlevel*
+                optimization level of indexes, from 0 to 9; ``None`` for that
+                recorded when the object was stored
+            *kind*
+                kind of indexes, one of 'ultralight', 'light', 'medium', or
+                'full'; ``None`` for that recorded when the object was stored
+        """
+        with self.write():
+            if not self.handle.get_storer(key).is_table:
+                raise ValueError("Only data stored as a table can be "
+                                 "indexed; data stored with the 'fast-read' "
+                                 "profile is not")
+
+            self._create_index(key, columns=columns, optlevel=optlevel,
+                               kind=kind)
+
+    def recompress(self, key, complib=None, complevel=None):
+        """Rewrite a stored pandas object with different compression.
+
+        The object is written with its storage profile, data columns, and
+        index options to a new file, which then replaces the data file; the
+        space used by the old data is reclaimed. Readers are locked out for
+        the duration.
+
+        :Arguments:
+            *key*
+                name of data to recompress
+
+        :Keywords:
+            *complib*
+                compression library to use, such as 'zlib', 'blosc',
+                'blosc:lz4', or 'blosc:zstd'; ``None`` for that currently
+                used
+            *complevel*
+                compression level from 0 (none) to 9; ``None`` for that
+                currently used
+        """
+        tmpfile = self.filename + '.tmp'
+
+        with self.write():
+            storer = self.handle.get_storer(key)
+            attrs = storer.attrs
+            profile = self._get_profile(key)
+
+            current = self._get_compression(key)
+            if complib is None:
+                complib = current['complib']
+            if complevel is None:
+                complevel = current['complevel']
+
+            options = dict()
+            if storer.is_table:
+                indexed = getattr(attrs, 'datreant_index', None) or dict()
+                options = dict(data_columns=list(storer.data_columns),
+                               index=bool(storer.table.colindexes),
+                               **indexed)
+
+            data = self.handle.get(key)
+
+            filters = dict()
+            if profiles[profile]['format'] != 'table':
+                filters = self._compression(profile, complib, complevel)
+
+            # the new file is written through the same methods as usual
+            original = self.handle
+            self.handle = pd.HDFStore(tmpfile, 'w', **filters)
             try:
-                self.handle.append(
-                    key, data, data_columns=True, complevel=5, complib='blosc')
-            except AttributeError:
-                self.handle.append(key, data, complevel=5, complib='blosc')
+                self._put(key, data, profile, complib=complib,
+                          complevel=complevel, **options)
+                self.handle.close()
+            except Exception:
+                self.handle.close()
+                os.remove(tmpfile)
+                raise
+            finally:
+                self.handle = original
+
+            os.rename(tmpfile, self.filename)
 
     def get_data(self, key, **kwargs):
         """Retrieve pandas object stored in file, optionally based on where criteria.
 
+        Objects stored with the 'fast-read' profile read only the rows
+        selected with *start* and *stop*, but select *columns* in memory, and
+        can't be selected from with *where* or read as an iterator.
+
+        Rows staged by buffered appends follow the stored rows, and are
+        selected from with *where* in an in-memory table like the stored one;
+        they are never compacted by reading. Iterators give only stored rows.
+
+        Negative *start* and *stop* count back from the last row, as for
+        slices; they are resolved from the number of rows recorded in the
+        file's metadata, so the last rows can be read without reading the
+        rest.
+
         :Arguments:
             *key*
                 name of data to retrieve
@@ -91,9 +519,10 @@ class pdDataFile(File):
             *where*
                 conditions for what rows/columns to return
             *start*
-                row number to start selection
+                row number to start selection; negative to count from the
+                end
             *stop*
-                row number to stop selection
+                row number to stop selection; negative to count from the end
             *columns*
                 list of columns to return; all columns returned by default
             *iterator*
@@ -106,12 +535,168 @@ class pdDataFile(File):
             *data*
                 the selected data
         """
+        iterator = kwargs.get('iterator') or kwargs.get('chunksize')
+
         with self.read():
+            staged = None if iterator else self.spool.staged()
+            if staged:
+                return self._merge(key, staged, **kwargs)
+
+            return self._select(key, **kwargs)
+
+    def _select(self, key, **kwargs):
+        """Select from a stored pandas object, in either format.
+
+        """
+        for bound in ('start', 'stop'):
+            if kwargs.get(bound) is not None and kwargs[bound] < 0:
+                kwargs[bound] = max(self._nrows(key) + kwargs[bound], 0)
+
+        if self.handle.get_storer(key).is_table:
             return self.handle.select(key, **kwargs)
 
+        if (kwargs.get('where') is not None or kwargs.get('iterator') or
+                kwargs.get('chunksize')):
+            raise ValueError(
+                "Data stored with the 'fast-read' profile can't be "
+                "selected from with *where* or read as an iterator; store "
+                "it with the 'queryable' profile instead")
+
+        columns = kwargs.pop('columns', None)
+        data = self.handle.select(key, **kwargs)
+
+        if columns is not None:
+            data = data[columns]
+
+        return data
+
+    def _merge(self, key, staged, where=None, start=None, stop=None,
+               columns=None):
+        """Select rows from a stored pandas object followed by staged rows.
+
+        Only the stored rows that are selected are read.
+
+        """
+        staged = pd.concat(staged)
+        nstored = self._nrows(key)
+        start, stop, _ = slice(start, stop).indices(nstored + len(staged))
+
+        parts = []
+        if start < min(stop, nstored):
+            parts.append(self._select(key, where=where, start=start,
+                                      stop=min(stop, nstored),
+                                      columns=columns))
+        if stop > nstored:
+            rows = staged.iloc[max(start - nstored, 0):stop - nstored]
+            if where is not None and len(rows):
+                parts.append(self._select_staged(key, rows, where, columns))
+            else:
+                parts.append(rows if columns is None else rows[columns])
+
+        if not parts:
+            return self._select(key, start=0, stop=0, columns=columns)
+
+        return pd.concat(parts) if len(parts) > 1 else parts[0]
+
+    def _select_staged(self, key, rows, where, columns=None):
+        """Select from staged rows with *where*.
+
+        The rows are written to an in-memory table with the data columns of
+        the stored table, so that *where* selects from them as it does from
+        the stored rows.
+
+        """
+        storer = self.handle.get_storer(key)
+        if not storer.is_table:
+            # raises the error given for selecting from the stored object
+            return self._select(key, where=where, start=0, stop=0)
+
+        store = pd.HDFStore(self.filename + '.staged', 'w',
+                            driver='H5FD_CORE', driver_core_backing_store=0)
+        try:
+            store.append(key, rows, index=False,
+                         data_columns=list(storer.data_columns))
+            return store.select(key, where=where, columns=columns)
+        finally:
+            store.close()
+
+    def _nrows(self, key):
+        """Get the number of rows stored, not counting staged rows.
+
+        """
+        storer = self.handle.get_storer(key)
+        if storer.is_table:
+            return storer.nrows
+        else:
+            return int(storer.shape[0])
+
+    def get_nrows(self, key):
+        """Get the number of rows of a pandas object stored in file.
+
+        Only the object's metadata is read, along with any staged rows.
+
+        :Arguments:
+            *key*
+                name of data
+
+        :Returns:
+            *nrows*
+                number of rows stored, including staged rows
+        """
+        with self.read():
+            staged = self.spool.staged()
+            return self._nrows(key) + sum(len(rows) for rows in staged)
+
+    def get_info(self, key):
+        """Get metadata for a pandas object stored in file.
+
+        Only the object's metadata is read, along with an empty selection to
+        give its columns and dtypes; none of its stored rows are read. The
+        'nrows' given includes rows staged by buffered appends.
+
+        :Arguments:
+            *key*
+                name of data to describe
+
+        :Returns:
+            *info*
+                dictionary giving the object's 'pandas_type' (e.g.
+                'DataFrame'), 'nrows', storage 'profile', 'compression' as a
+                dictionary of its *complib* and *complevel*, and the 'size'
+                in bytes of the file and any staged rows, and, for Series
+                and DataFrames, its 'shape', 'columns', and 'dtypes'
+        """
+        with self.read():
+            empty = self.handle.select(key, start=0, stop=0)
+            profile = self._get_profile(key)
+            compression = self._get_compression(key)
+            staged = self.spool.staged()
+            nrows = self._nrows(key) + sum(len(rows) for rows in staged)
+
+        info = {'pandas_type': type(empty).__name__,
+                'nrows': nrows,
+                'profile': profile,
+                'compression': compression,
+                'size': os.path.getsize(self.filename) + self.spool.nbytes()}
+
+        if isinstance(empty, pd.DataFrame):
+            info['shape'] = (nrows, len(empty.columns))
+            info['columns'] = list(empty.columns)
+            info['dtypes'] = empty.dtypes
+        elif isinstance(empty, pd.Series):
+            info['shape'] = (nrows,)
+            info['columns'] = None
+            info['dtypes'] = empty.dtype
+
+        return info
+
     def del_data(self, key, **kwargs):
         """Delete a stored data object.
 
+        Rows staged by buffered appends are compacted first when deleting a
+        selection, so that it applies to them too, and dropped when deleting
+        the whole object.
+
         :Arguments:
             *key*
                 name of data to delete
@@ -126,7 +711,12 @@ class pdDataFile(File):
 
         """
         with self.write():
-            self.handle.remove(key, **kwargs)
+            if kwargs:
+                self._compact(key)
+                self.handle.remove(key, **kwargs)
+            else:
+                with self.spool.claim():
+                    self.handle.remove(key)
 
     # TODO: remove this; since we only place one datastructure in an HDF5 file,
     # we don't need it
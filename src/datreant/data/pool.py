@@ -0,0 +1,277 @@
+"""
+Pool of open data files for repeated reads.
+
+Each read of a dataset normally opens its file, reads, and closes it again.
+In tight loops reading the same datasets many times, the cost of opening
+files can dominate. Within a :func:`session`, files opened for reading are
+kept open in a pool and reused, up to a maximum number of open files.
+
+Locks are still applied for each read as usual. A pooled file is reused only
+if its inode, size, and modification time are unchanged since it was opened;
+otherwise it is reopened so that changes made by other processes are seen.
+Sessions belong to a thread, but writes close the pooled handles of every
+thread's session to the file written, since a file can't be opened for
+writing in a process that has it open for reading.
+
+Access to data files is serialized by the locks on their proxy files. HDF5
+also locks the files it opens, which would block writers in other processes
+for as long as a pooled handle is held open, even with no proxy lock held.
+Numpy datasets are opened without HDF5's locks, where h5py supports it.
+PyTables has no such option for pandas datasets; HDF5's locks can only be
+disabled for every file a process opens, by setting
+``HDF5_USE_FILE_LOCKING=FALSE`` in its environment before it starts. Do so
+for processes writing to pandas datasets that others hold open in sessions.
+
+"""
+import os
+import threading
+import weakref
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from datreant.core.backends.core import File
+
+
+_local = threading.local()
+
+# locks on proxy files are held by the process, so they don't keep threads of
+# the same process from using a file at once; these do, by filename
+_file_locks = weakref.WeakValueDictionary()
+_file_locks_lock = threading.Lock()
+
+# pools of all sessions in this process holding handles, by filename, so
+# writers can close the handles of every thread's session
+_pooled = dict()
+_pooled_lock = threading.Lock()
+
+
+def get_pool():
+    """Get the handle pool of the current thread's session.
+
+    :Returns:
+        *pool*
+            the active :class:`HandlePool`; ``None`` if no session is active
+
+    """
+    return getattr(_local, 'pool', None)
+
+
+@contextmanager
+def session(maxopen=16):
+    """Keep data files open for reuse within a block.
+
+    Sessions apply to all data reads made by the current thread while the
+    session is active. Nested sessions reuse the outermost session's pool.
+    All pooled files are closed when the outermost session ends.
+
+    :Keywords:
+        *maxopen*
+            maximum number of files to keep open; least recently used files
+            are closed first [16]
+
+    """
+    pool = get_pool()
+    if pool is not None:
+        yield pool
+        return
+
+    _local.pool = HandlePool(maxopen=maxopen)
+    try:
+        yield _local.pool
+    finally:
+        _local.pool.close()
+        _local.pool = None
+
+
+def _stamp(filename):
+    """Get a stamp identifying the current contents of a file.
+
+    """
+    st = os.stat(filename)
+    mtime = getattr(st, 'st_mtime_ns', st.st_mtime)
+
+    return (st.st_ino, st.st_size, mtime)
+
+
+def file_lock(filename):
+    """Get the lock serializing use of a file between threads.
+
+    :Arguments:
+        *filename*
+            absolute path to file
+
+    :Returns:
+        *lock*
+            reentrant lock shared by all users of the file in this process
+
+    """
+    with _file_locks_lock:
+        lock = _file_locks.get(filename)
+        if lock is None:
+            lock = _file_locks[filename] = threading.RLock()
+
+        return lock
+
+
+def discard(filename):
+    """Close the pooled handles to a file of every thread's session.
+
+    :Arguments:
+        *filename*
+            absolute path to file
+
+    """
+    with file_lock(filename):
+        with _pooled_lock:
+            pools = list(_pooled.get(filename, ()))
+
+        for pool in pools:
+            pool.discard(filename)
+
+
+def _register(filename, pool):
+    """Record that a pool holds a handle to a file.
+
+    """
+    with _pooled_lock:
+        _pooled.setdefault(filename, set()).add(pool)
+
+
+def _unregister(filename, pool):
+    """Record that a pool no longer holds a handle to a file.
+
+    """
+    with _pooled_lock:
+        pools = _pooled.get(filename)
+        if pools is not None:
+            pools.discard(pool)
+            if not pools:
+                del _pooled[filename]
+
+
+class HandlePool(object):
+    """Pool of files open for reading, with least-recently-used eviction.
+
+    :Keywords:
+        *maxopen*
+            maximum number of files to keep open [16]
+
+    """
+    def __init__(self, maxopen=16):
+        self.maxopen = maxopen
+        self._handles = OrderedDict()
+
+        # writers in other threads may close this pool's handles
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._handles)
+
+    def __contains__(self, filename):
+        return filename in self._handles
+
+    def acquire(self, filename, opener):
+        """Get an open handle to a file, opening it if necessary.
+
+        Must be called while holding a lock on the file, so that its stamp is
+        not changing.
+
+        :Arguments:
+            *filename*
+                absolute path to file
+            *opener*
+                callable that opens the file for reading, returning the handle
+
+        :Returns:
+            *handle*
+                open handle to the file
+
+        """
+        stamp = _stamp(filename)
+
+        with self._lock:
+            handle = None
+            if filename in self._handles:
+                handle, oldstamp = self._handles.pop(filename)
+                if oldstamp != stamp:
+                    handle.close()
+                    handle = None
+
+            if handle is None:
+                handle = opener()
+
+            self._handles[filename] = (handle, stamp)
+            _register(filename, self)
+
+            while len(self._handles) > self.maxopen:
+                oldname, (oldest, _) = self._handles.popitem(last=False)
+                _unregister(oldname, self)
+                oldest.close()
+
+        return handle
+
+    def discard(self, filename):
+        """Close a file if it is in the pool.
+
+        :Arguments:
+            *filename*
+                absolute path to file
+
+        """
+        with self._lock:
+            if filename in self._handles:
+                handle, _ = self._handles.pop(filename)
+                _unregister(filename, self)
+                handle.close()
+
+    def close(self):
+        """Close all files in the pool.
+
+        """
+        with self._lock:
+            while self._handles:
+                filename, (handle, _) = self._handles.popitem()
+                _unregister(filename, self)
+                handle.close()
+
+
+class PooledFile(File):
+    """File whose handles for reading are kept open during a session.
+
+    Outside of a :func:`session`, this behaves exactly as
+    :class:`datreant.core.backends.core.File`. Within one, reads reuse
+    pooled handles, and writes first close the pooled handles to the file of
+    every thread's session.
+
+    Reads and writes also hold the file's :func:`file_lock`, so that threads
+    of a process, which share its locks on the proxy file, take turns.
+
+    """
+    def __init__(self, filename, **kwargs):
+        super(PooledFile, self).__init__(filename, **kwargs)
+        self._file_lock = file_lock(self.filename)
+
+    @contextmanager
+    def read(self):
+        with self._file_lock:
+            pool = get_pool()
+            if pool is None or self.fdlock:
+                with super(PooledFile, self).read() as handle:
+                    yield handle
+            else:
+                self._apply_shared_lock()
+                try:
+                    self.handle = pool.acquire(self.filename,
+                                               self._open_file_r)
+                    yield self.handle
+                finally:
+                    self.handle = None
+                    self._release_lock()
+
+    @contextmanager
+    def write(self):
+        with self._file_lock:
+            discard(self.filename)
+
+            with super(PooledFile, self).write() as handle:
+                yield handle
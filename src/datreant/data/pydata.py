@@ -1,17 +1,184 @@
 """
 File backends for storing general python objects.
 
+Where pickle protocol 5 is available (Python 3.8+), large buffers within an
+object, such as the contents of numpy arrays, are written out-of-band to a
+sidecar file next to the pickle instead of being copied through the pickle
+stream. On load, the sidecar is memory-mapped and the buffers are used in
+place, so loading a large container of arrays needs no more memory than the
+arrays themselves, and only the pages actually touched are read from disk.
+
+Pickles can instead be compressed as they are written, with zstd or lz4 if
+installed, or with gzip or lzma from the standard library. The compression
+used is detected from the leading bytes of the file on read, so compressed
+and uncompressed pickles can be mixed freely.
+
 """
+import io
+import os
+import gzip
+import json
+import mmap
+import struct
+from collections import OrderedDict
 
 from six.moves import cPickle as pickle
 
-from datreant.core.backends.core import File
+from .pool import PooledFile
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+try:
+    import lzma
+except ImportError:
+    lzma = None
 
 
 pydatafile = 'pyData.pkl'
+pybuffersfile = 'pyData.buf'
+
+#: marks pickles whose large buffers are stored in a sidecar file
+magic = b'DTRPKL5\n'
+
+#: buffers in the sidecar file start at multiples of this many bytes
+alignment = 64
+
+PickleBuffer = getattr(pickle, 'PickleBuffer', None)
+
+#: leading bytes of the stream written by each compression, in order of
+#: preference when any available compression will do
+compressions = OrderedDict([
+    ('zstd', b'\x28\xb5\x2f\xfd'),
+    ('lz4', b'\x04\x22\x4d\x18'),
+    ('gzip', b'\x1f\x8b'),
+    ('lzma', b'\xfd7zXZ\x00'),
+])
+
+
+def available_compressions():
+    """List the compressions that can be used for pickles.
+
+    :Returns:
+        *available*
+            names of usable compressions, in order of preference
+
+    """
+    modules = {'zstd': zstandard, 'lz4': lz4, 'gzip': gzip, 'lzma': lzma}
+    return [name for name in compressions if modules[name] is not None]
+
+
+def compress_writer(handle, compression, level=None):
+    """Wrap a file handle so that what is written to it is compressed.
+
+    Closing the returned writer finishes the compressed stream, but leaves
+    *handle* open.
+
+    :Arguments:
+        *handle*
+            file handle open for writing in binary mode
+        *compression*
+            name of compression to use; ``True`` for the first available of
+            :data:`compressions`
+
+    :Keywords:
+        *level*
+            compression level; ``None`` for the compression's default
+
+    :Returns:
+        *writer*
+            file-like object to write to
+
+    """
+    available = available_compressions()
+    if compression is True:
+        compression = available[0]
+    elif compression not in compressions:
+        raise ValueError("*compression* must be one of {}".format(
+            list(compressions)))
+    elif compression not in available:
+        raise ImportError("Compression '{}' requires a module that is not "
+                          "installed".format(compression))
+
+    if compression == 'zstd':
+        compressor = zstandard.ZstdCompressor(
+            level=3 if level is None else level)
+        return compressor.stream_writer(handle, closefd=False)
+    elif compression == 'lz4':
+        return lz4.frame.LZ4FrameFile(
+            handle, 'wb', compression_level=level or 0)
+    elif compression == 'gzip':
+        return gzip.GzipFile(fileobj=handle, mode='wb',
+                             compresslevel=6 if level is None else level)
+    else:
+        return lzma.LZMAFile(handle, 'wb', preset=level)
+
+
+def detect_compression(head):
+    """Detect the compression of a pickle from its leading bytes.
+
+    :Arguments:
+        *head*
+            leading bytes of the file
+
+    :Returns:
+        *compression*
+            name of the compression used; ``None`` if not compressed
+
+    """
+    for compression, leading in compressions.items():
+        if head.startswith(leading):
+            return compression
+
+    return None
+
+
+def decompress_reader(handle):
+    """Wrap a file handle so that what is read from it is decompressed.
+
+    The compression is detected from the leading bytes of the file.
+
+    :Arguments:
+        *handle*
+            file handle open for reading in binary mode, positioned at the
+            start of the file
+
+    :Returns:
+        *reader*
+            file-like object to read from; ``None`` if the file is not
+            compressed
+
+    """
+    compression = detect_compression(
+        handle.read(max(len(m) for m in compressions.values())))
+    handle.seek(0)
+
+    if compression is None:
+        return None
+
+    if compression not in available_compressions():
+        raise ImportError("Reading this data requires compression '{}', "
+                          "whose module is not installed".format(compression))
 
+    if compression == 'zstd':
+        return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(
+            handle, closefd=False))
+    elif compression == 'lz4':
+        return lz4.frame.LZ4FrameFile(handle, 'rb')
+    elif compression == 'gzip':
+        return gzip.GzipFile(fileobj=handle, mode='rb')
+    else:
+        return lzma.LZMAFile(handle, 'rb')
 
-class pyDataFile(File):
+
+class pyDataFile(PooledFile):
     """Interface to python object data files.
 
     Arbitrary python objects are stored as pickled objects on disk. This class
@@ -19,14 +186,26 @@ class pyDataFile(File):
     same basic way as for pandas and numpy objects. It uses pickle files for
     serialization.
 
+    Pickles with out-of-band buffers begin with :data:`magic`, followed by
+    the pickle stream, a JSON header giving the offset and length of each
+    buffer in the sidecar file, and the length of the header as an unsigned
+    64-bit little-endian integer. Compressed pickles are a single compressed
+    stream, with all buffers in-band. All others are plain pickles.
+
     """
+    def __init__(self, filename, **kwargs):
+        super(pyDataFile, self).__init__(filename, **kwargs)
+        self.buffersfile = os.path.join(os.path.dirname(self.filename),
+                                        pybuffersfile)
+
     def _open_file_r(self):
         return open(self.filename, 'rb')
 
     def _open_file_w(self):
         return open(self.filename, 'wb+')
 
-    def add_data(self, key, data):
+    def add_data(self, key, data, oob_threshold=2**20, compression=None,
+                 compression_opts=None):
         """Add a numpy array to the data file.
 
         If data already exists for the given key, then it is overwritten.
@@ -36,13 +215,113 @@ class pyDataFile(File):
                 not used, but needed to give consistent interface
             *data*
                 the numpy array to store
+
+        :Keywords:
+            *oob_threshold*
+                buffers of at least this many bytes are stored out-of-band in
+                the sidecar file, if pickle protocol 5 is available; ``None``
+                stores all buffers in the pickle itself [1 MiB]
+            *compression*
+                compression to apply as the pickle is written, one of
+                'zstd', 'lz4', 'gzip', or 'lzma'; ``True`` uses the first of
+                these that is installed; ``None`` for no compression; if
+                used, buffers are never stored out-of-band
+            *compression_opts*
+                compression level; ``None`` for the compression's default
         """
         with self.write():
-            pickle.dump(data, self.handle, pickle.HIGHEST_PROTOCOL)
+            if compression:
+                writer = compress_writer(self.handle, compression,
+                                         compression_opts)
+                try:
+                    pickle.dump(data, writer, pickle.HIGHEST_PROTOCOL)
+                finally:
+                    writer.close()
+                self._remove_buffers()
+            elif PickleBuffer is None or oob_threshold is None:
+                pickle.dump(data, self.handle, pickle.HIGHEST_PROTOCOL)
+                self._remove_buffers()
+            else:
+                self._dump_oob(data, oob_threshold)
+
+    def _dump_oob(self, data, threshold):
+        """Pickle an object, writing its large buffers to the sidecar file.
+
+        If no buffer goes out-of-band, a plain pickle is written, readable
+        with :func:`pickle.load` and by earlier versions.
+
+        The sidecar is written anew and moved into place, so that memory maps
+        of the previous sidecar held by readers stay valid.
+
+        """
+        tmpfile = self.buffersfile + '.tmp'
+        sidecar = [None]
+        buffers = []
+
+        def callback(buf):
+            try:
+                raw = buf.raw()
+            except BufferError:
+                # non-contiguous buffers are serialized in-band
+                return True
+
+            # empty buffers are kept in-band too, since an empty sidecar
+            # can't be mapped
+            if raw.nbytes < threshold or not raw.nbytes:
+                return True
+
+            if sidecar[0] is None:
+                sidecar[0] = open(tmpfile, 'wb')
+            out = sidecar[0]
+
+            offset = -(-out.tell() // alignment) * alignment
+            out.write(b'\0' * (offset - out.tell()))
+            out.write(raw)
+            buffers.append((offset, raw.nbytes))
+            return False
+
+        # whether any buffer goes out-of-band is only known once the object
+        # is pickled, so the pickle is written to memory first
+        stream = io.BytesIO()
+        try:
+            pickle.Pickler(stream, 5, buffer_callback=callback).dump(data)
+        except Exception:
+            if sidecar[0] is not None:
+                sidecar[0].close()
+                os.remove(tmpfile)
+            raise
+
+        if sidecar[0] is None:
+            self.handle.write(stream.getbuffer())
+            self._remove_buffers()
+            return
+
+        sidecar[0].close()
+
+        header = json.dumps({'buffers': buffers}).encode('utf-8')
+        self.handle.write(magic)
+        self.handle.write(stream.getbuffer())
+        self.handle.write(header)
+        self.handle.write(struct.pack('<Q', len(header)))
+
+        os.replace(tmpfile, self.buffersfile)
+
+    def _remove_buffers(self):
+        """Remove the sidecar file, if present.
+
+        """
+        try:
+            os.remove(self.buffersfile)
+        except OSError:
+            pass
 
     def get_data(self, key, **kwargs):
         """Retrieve numpy array stored in file.
 
+        Out-of-band buffers are mapped copy-on-write from the sidecar file, so
+        objects built on them, such as numpy arrays, can be modified without
+        changing what is stored.
+
         :Arguments:
             *key*
                 not used, but needed to give consistent interface
@@ -52,4 +331,70 @@ class pyDataFile(File):
                 the selected data
         """
         with self.read():
-            return pickle.load(self.handle)
+            # handle may be reused from a session's pool
+            self.handle.seek(0)
+            reader = decompress_reader(self.handle)
+            if reader is not None:
+                with reader:
+                    return pickle.load(reader)
+
+            if self.handle.read(len(magic)) != magic:
+                self.handle.seek(0)
+                return pickle.load(self.handle)
+
+            self.handle.seek(-8, os.SEEK_END)
+            length, = struct.unpack('<Q', self.handle.read(8))
+            self.handle.seek(-8 - length, os.SEEK_END)
+            header = json.loads(self.handle.read(length).decode('utf-8'))
+
+            # an empty sidecar can't be mapped, and has nothing to map
+            view = memoryview(bytearray())
+            if any(nbytes for _, nbytes in header['buffers']):
+                with open(self.buffersfile, 'rb') as f:
+                    mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+                view = memoryview(mapped)
+            buffers = [view[offset:offset + nbytes]
+                       for offset, nbytes in header['buffers']]
+
+            self.handle.seek(len(magic))
+            return pickle.load(self.handle, buffers=buffers)
+
+    def get_info(self, key):
+        """Get metadata for a python object stored in file.
+
+        Pickles carry no metadata about the object that can be read without
+        loading it, so only the leading bytes of the file and, for pickles
+        with out-of-band buffers, its header are read.
+
+        :Arguments:
+            *key*
+                not used, but needed to give consistent interface
+
+        :Returns:
+            *info*
+                dictionary giving the pickle's 'compression' (``None`` if
+                uncompressed), the number of out-of-band 'buffers' and their
+                total size in bytes as 'buffer_size', and the 'size' in bytes
+                of the file and its sidecar
+        """
+        buffers = []
+        with self.read():
+            self.handle.seek(0)
+            head = self.handle.read(
+                max(len(magic), max(len(m) for m in compressions.values())))
+
+            if head.startswith(magic):
+                self.handle.seek(-8, os.SEEK_END)
+                length, = struct.unpack('<Q', self.handle.read(8))
+                self.handle.seek(-8 - length, os.SEEK_END)
+                header = json.loads(self.handle.read(length).decode('utf-8'))
+                buffers = header['buffers']
+
+        size = os.path.getsize(self.filename)
+        if buffers:
+            size += os.path.getsize(self.buffersfile)
+
+        return {'compression': detect_compression(head),
+                'buffers': len(buffers),
+                'buffer_size': sum(nbytes for offset, nbytes in buffers),
+                'size': size}
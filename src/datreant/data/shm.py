@@ -0,0 +1,602 @@
+"""
+Shared-memory cache of retrieved datasets.
+
+Worker processes on the same node often read the same datasets. With this
+cache enabled, a numpy array or pandas object read from disk by one process
+is placed in a named shared-memory segment, and other processes retrieving
+the same selection of the same dataset map that segment instead of reading
+the dataset again. Mapped results are read-only and share memory across
+processes, so each is held in memory once per node.
+
+Numpy arrays of numeric dtype, and pandas Series and DataFrames whose
+columns all share one numeric dtype, can be shared; other results are
+returned as read from disk. Requires Python 3.8 or later, for
+:mod:`multiprocessing.shared_memory`.
+
+Segments are recorded in an index file shared by all processes using the
+same index directory. The index records which processes hold references to
+each segment; each process counts its own references, and updates the index
+only when it takes its first reference to a segment or drops its last one,
+so repeated hits on a segment don't rewrite the index. Segments are released
+when the results mapping them are garbage collected. When the segments'
+total size exceeds the limit, the least recently used segments not
+referenced by any live process are removed.
+As with the in-process cache of :mod:`datreant.data.cache`, segments are
+named after the stamp of the dataset's file, so changes to a dataset are
+never served stale, and changes made through :class:`Data
+<datreant.data.limbs.Data>` remove the dataset's segments at once.
+
+Enable it in each process with :func:`enable`::
+
+    >>> import datreant.data
+    >>> datreant.data.shm.enable(maxbytes=2**32)
+
+"""
+import os
+import time
+import pickle
+import hashlib
+import tempfile
+import threading
+import weakref
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+from datreant.core.backends.core import JSONFile
+
+from .cache import selection_key
+from .pool import _stamp
+from . import spool
+
+try:
+    from multiprocessing import shared_memory, resource_tracker
+except ImportError:
+    shared_memory = None
+
+
+indexfile = 'datreant-shm.json'
+
+#: segments begin with their data, followed by pickled pandas labels, aligned
+#: to this many bytes
+alignment = 64
+
+#: the active cache; ``None`` if shared-memory caching is disabled
+_cache = None
+
+
+def enable(maxbytes=2**30, indexdir=None):
+    """Enable caching of retrieved datasets in shared memory.
+
+    Processes sharing datasets must use the same *indexdir*.
+
+    :Keywords:
+        *maxbytes*
+            maximum total size of segments, in bytes; enforced by each
+            process as it adds segments [1 GiB]
+        *indexdir*
+            directory for the index of segments; ``None`` uses the system's
+            temporary directory
+
+    :Returns:
+        *cache*
+            the active :class:`SharedCache`
+
+    """
+    global _cache
+    if shared_memory is None:
+        raise ImportError("Shared-memory caching requires "
+                          "multiprocessing.shared_memory (Python 3.8+)")
+
+    if indexdir is None:
+        indexdir = tempfile.gettempdir()
+
+    _cache = SharedCache(indexdir, maxbytes=maxbytes)
+    return _cache
+
+
+def disable():
+    """Disable caching of retrieved datasets in shared memory.
+
+    Segments are left in place for other processes; use
+    :meth:`SharedCache.clear` to remove them.
+
+    """
+    global _cache
+    _cache = None
+
+
+def get_cache():
+    """Get the active shared-memory cache.
+
+    :Returns:
+        *cache*
+            the active :class:`SharedCache`; ``None`` if disabled
+
+    """
+    return _cache
+
+
+def invalidate(datadir):
+    """Remove all segments for a dataset, if shared-memory caching is enabled.
+
+    :Arguments:
+        *datadir*
+            absolute path to the dataset's directory
+
+    """
+    if _cache is not None:
+        _cache.invalidate(datadir)
+
+
+def _pid_alive(pid):
+    """Check if a process is still running.
+
+    """
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == 1  # EPERM; exists, but owned by someone else
+    return True
+
+
+def _open_segment(name, size=None):
+    """Create or attach to a shared-memory segment.
+
+    The segment is not tracked for removal when this process exits, since it
+    outlives the process; segments are removed by the cache's eviction.
+
+    """
+    create = size is not None
+    try:
+        return shared_memory.SharedMemory(name, create=create,
+                                          size=size or 0, track=False)
+    except TypeError:
+        # before Python 3.13, every segment opened is tracked
+        shm = shared_memory.SharedMemory(name, create=create, size=size or 0)
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+
+def _unlink_segment(name):
+    """Remove a shared-memory segment, if it exists.
+
+    Processes that have the segment mapped keep their mappings.
+
+    """
+    # opened tracked, since removing the segment also untracks it
+    try:
+        shm = shared_memory.SharedMemory(name)
+    except (OSError, ValueError):
+        return
+
+    shm.close()
+    try:
+        shm.unlink()
+    except OSError:
+        pass
+
+
+def layout(data):
+    """Describe how a retrieved dataset would be stored in a segment.
+
+    :Arguments:
+        *data*
+            retrieved dataset
+
+    :Returns:
+        *values*
+            numpy array holding the dataset's values; ``None`` if the dataset
+            can't be shared
+        *entry*
+            index entry describing the dataset
+        *labels*
+            pickled pandas index and columns; empty for numpy arrays
+
+    """
+    if isinstance(data, np.ndarray) and not isinstance(data, np.memmap):
+        kind = 'ndarray'
+        values = data
+        labels = b''
+    elif isinstance(data, pd.Series):
+        kind = 'series'
+        values = data.values
+        labels = pickle.dumps((data.index, data.name),
+                              pickle.HIGHEST_PROTOCOL)
+    elif isinstance(data, pd.DataFrame) and len(set(data.dtypes)) == 1:
+        kind = 'dataframe'
+        values = data.values
+        labels = pickle.dumps((data.index, data.columns),
+                              pickle.HIGHEST_PROTOCOL)
+    else:
+        return None, None, None
+
+    if not isinstance(values, np.ndarray) or values.dtype.kind not in 'biufc':
+        return None, None, None
+
+    values = np.ascontiguousarray(values)
+    offset = -(-values.nbytes // alignment) * alignment
+
+    entry = {'kind': kind,
+             'dtype': values.dtype.str,
+             'shape': list(values.shape),
+             'labels': [offset, len(labels)],
+             'size': max(offset + len(labels), 1)}
+
+    return values, entry, labels
+
+
+def build(shm, entry):
+    """Build a dataset from its segment, without copying its values.
+
+    :Arguments:
+        *shm*
+            attached shared-memory segment
+        *entry*
+            index entry describing the dataset
+
+    :Returns:
+        *data*
+            the dataset, mapping the segment's memory
+
+    """
+    values = np.ndarray(tuple(entry['shape']), dtype=np.dtype(entry['dtype']),
+                        buffer=shm.buf)
+    values.flags.writeable = False
+
+    offset, length = entry['labels']
+    if entry['kind'] == 'ndarray':
+        return values
+
+    index, labels = pickle.loads(bytes(shm.buf[offset:offset + length]))
+    if entry['kind'] == 'series':
+        return pd.Series(values, index=index, name=labels, copy=False)
+    else:
+        return pd.DataFrame(values, index=index, columns=labels, copy=False)
+
+
+class SegmentIndex(JSONFile):
+    """Interface to the index of shared-memory segments.
+
+    The state is a dictionary with one entry, 'segments', giving for each
+    segment name the dataset directory it caches, its layout, its size, the
+    time it was last used, and the ids of the processes holding references
+    to it.
+
+    """
+    def _init_state(self):
+        self._state = {'segments': {}}
+
+
+class SharedCache(object):
+    """Cache of retrieved datasets in shared-memory segments.
+
+    :Arguments:
+        *indexdir*
+            directory for the index of segments
+
+    :Keywords:
+        *maxbytes*
+            maximum total size of segments, in bytes [1 GiB]
+
+    """
+    def __init__(self, indexdir, maxbytes=2**30):
+        self.indexdir = indexdir
+        self.maxbytes = maxbytes
+        self.hits = 0
+        self.misses = 0
+
+        self._index = SegmentIndex(os.path.join(indexdir, indexfile))
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        """Forget the references held by this process.
+
+        """
+        self._pid = os.getpid()
+
+        # references held by this process, by segment name, with the entry
+        # of each; the index only records which processes hold any
+        self._held = dict()
+
+        # times of use not yet written to the index, by segment name
+        self._used = dict()
+
+        # releases of collected results; these are queued, since results
+        # can be collected while the lock is held by the same thread
+        self._releases = deque()
+
+    def _name(self, filename, stamp, selection):
+        """Name the segment for a selection of a dataset.
+
+        """
+        digest = hashlib.sha1(repr((self.indexdir, filename, stamp,
+                                    selection)).encode('utf-8'))
+        return 'dtr_' + digest.hexdigest()[:24]
+
+    def retrieve(self, datadir, filename, kwargs, loader):
+        """Get a dataset's selection from shared memory, loading it on a miss.
+
+        :Arguments:
+            *datadir*
+                absolute path to the dataset's directory
+            *filename*
+                absolute path to the dataset's file
+            *kwargs*
+                retrieval keywords giving the selection
+            *loader*
+                callable that reads the selection from disk
+
+        :Returns:
+            *data*
+                the selected data
+
+        """
+        selection = selection_key(kwargs)
+        if selection is None:
+            return loader()
+
+        name = self._name(filename,
+                          (_stamp(filename), spool.stamp(datadir)), selection)
+
+        data = self._attach(name)
+        if data is not None:
+            self.hits += 1
+            return data
+
+        self.misses += 1
+        data = loader()
+
+        values, entry, labels = layout(data)
+        if values is None:
+            return data
+
+        try:
+            shm = _open_segment(name, size=entry['size'])
+        except OSError:
+            # another process is creating this segment
+            return data
+
+        try:
+            np.ndarray(values.shape, dtype=values.dtype,
+                       buffer=shm.buf)[...] = values
+            offset, length = entry['labels']
+            shm.buf[offset:offset + length] = labels
+        except Exception:
+            shm.close()
+            _unlink_segment(name)
+            raise
+
+        entry['datadir'] = datadir
+        entry['used'] = time.time()
+        entry['refs'] = [str(os.getpid())]
+        with self._lock, self._index.write() as state:
+            self._settle(state)
+            state['segments'][name] = entry
+            self._hold(name, entry)
+            self._evict(state['segments'])
+
+        return self._track(name, shm, entry)
+
+    def _attach(self, name):
+        """Attach to an existing segment, taking a reference to it.
+
+        Segments this process already holds references to are attached to
+        without touching the index.
+
+        :Returns:
+            *data*
+                the dataset held by the segment; ``None`` if there is no such
+                segment
+
+        """
+        with self._lock:
+            self._check_pid()
+            held = self._held.get(name)
+            if held is not None:
+                try:
+                    shm = _open_segment(name)
+                except (OSError, ValueError):
+                    # removed by another process; settled through the index
+                    pass
+                else:
+                    held[0] += 1
+                    self._used[name] = time.time()
+                    return self._track(name, shm, held[1])
+
+            with self._index.write() as state:
+                self._settle(state)
+                entry = state['segments'].get(name)
+                if entry is None:
+                    return None
+
+                try:
+                    shm = _open_segment(name)
+                except (OSError, ValueError):
+                    # removed from outside of the cache
+                    del state['segments'][name]
+                    return None
+
+                pid = str(os.getpid())
+                if pid not in entry['refs']:
+                    entry['refs'].append(pid)
+                entry['used'] = time.time()
+                self._hold(name, entry)
+
+        return self._track(name, shm, entry)
+
+    def _check_pid(self):
+        """Forget references inherited from a parent process.
+
+        Must be called holding the lock.
+
+        """
+        if self._pid != os.getpid():
+            self._reset()
+
+    def _hold(self, name, entry):
+        """Count a reference taken by this process to a segment.
+
+        Must be called holding the lock.
+
+        """
+        held = self._held.setdefault(name, [0, entry])
+        held[0] += 1
+        held[1] = entry
+
+    def _drain(self):
+        """Count queued releases against the references held.
+
+        Must be called holding the lock.
+
+        :Returns:
+            *released*
+                names of the segments this process no longer holds any
+                references to
+
+        """
+        self._check_pid()
+
+        released = []
+        while self._releases:
+            name = self._releases.popleft()
+            held = self._held.get(name)
+            if held is None:
+                continue
+
+            held[0] -= 1
+            if not held[0]:
+                del self._held[name]
+                released.append(name)
+
+        return released
+
+    def _settle(self, state, released=None):
+        """Write queued releases and times of use to the index's state.
+
+        Must be called holding the lock, within a write of the index.
+
+        """
+        if released is None:
+            released = self._drain()
+
+        pid = str(os.getpid())
+        segments = state['segments']
+        for name in released:
+            entry = segments.get(name)
+            if entry is not None and pid in entry['refs']:
+                entry['refs'].remove(pid)
+
+        for name, used in self._used.items():
+            if name in segments:
+                segments[name]['used'] = max(segments[name]['used'], used)
+        self._used.clear()
+
+    def _track(self, name, shm, entry):
+        """Build a dataset from a segment, releasing it once collected.
+
+        """
+        data = build(shm, entry)
+
+        # pandas objects may hold on to the values through internal copies,
+        # so the segment is released when the values array itself goes away
+        values = data if isinstance(data, np.ndarray) else None
+        if values is None:
+            values = data.values
+            while isinstance(values.base, np.ndarray):
+                values = values.base
+
+        # references held at exit are ignored once this process is gone
+        release = weakref.finalize(values, self._release, name, shm)
+        release.atexit = False
+
+        return data
+
+    def _release(self, name, shm):
+        """Drop a reference to a segment.
+
+        Releases are queued, and written to the index right away only if the
+        lock is free; otherwise they are written by the next update of the
+        index.
+
+        """
+        try:
+            shm.close()
+        except BufferError:
+            pass
+
+        self._releases.append(name)
+        if not self._lock.acquire(False):
+            return
+
+        try:
+            released = self._drain()
+            if released:
+                with self._index.write() as state:
+                    self._settle(state, released)
+        except (IOError, OSError):
+            pass
+        finally:
+            self._lock.release()
+
+    def _evict(self, segments):
+        """Remove least recently used, unreferenced segments until they fit.
+
+        """
+        total = sum(entry['size'] for entry in segments.values())
+        if total <= self.maxbytes:
+            return
+
+        for name in sorted(segments, key=lambda n: segments[n]['used']):
+            entry = segments[name]
+            live = [pid for pid in entry['refs'] if _pid_alive(int(pid))]
+            if live:
+                continue
+
+            _unlink_segment(name)
+            del segments[name]
+            total -= entry['size']
+            if total <= self.maxbytes:
+                break
+
+    def invalidate(self, datadir):
+        """Remove all segments for a dataset.
+
+        Processes with results mapping these segments can still use them.
+
+        :Arguments:
+            *datadir*
+                absolute path to the dataset's directory
+
+        """
+        with self._lock, self._index.write() as state:
+            self._settle(state)
+            segments = state['segments']
+            for name in [n for n in segments
+                         if segments[n]['datadir'] == datadir]:
+                _unlink_segment(name)
+                del segments[name]
+
+    def clear(self):
+        """Remove all segments in the index.
+
+        """
+        with self._lock, self._index.write() as state:
+            self._settle(state)
+            for name in state['segments']:
+                _unlink_segment(name)
+            state['segments'] = dict()
+
+    def __len__(self):
+        with self._lock, self._index.read() as state:
+            return len(state['segments'])
+
+    @property
+    def nbytes(self):
+        """Total size of all segments in the index, in bytes.
+
+        """
+        with self._lock, self._index.read() as state:
+            return sum(entry['size'] for entry in state['segments'].values())
@@ -0,0 +1,254 @@
+"""
+Spool of rows staged for appending to pandas datasets.
+
+Each append to a pandas dataset takes the exclusive lock on its file, opens
+the HDF5 store, and writes a few rows to the table. With many processes
+making small appends to the same dataset, they spend most of their time
+waiting on that lock, and the table is written in many small pieces.
+
+Buffered appends instead stage their rows in a spool file belonging to the
+writing process, in a '.spool' directory next to the dataset's file. Staging
+only locks the writer's own spool file, and leaves the Tree's manifest
+alone, so writers don't wait on each other or on readers. Compaction later
+moves all staged rows into the dataset's file in a single append, under the
+file's exclusive lock; it is done when asked for, once a writer has staged
+enough, or before rows are appended directly, but never by reading. Until
+then, readers see staged rows after the stored ones.
+
+Each spool file is a sequence of pickled pandas objects, appended to under
+an exclusive :func:`fcntl.flock` on the file itself. Compaction takes the
+same lock on every spool file, and removes the files once their rows are
+stored; writers find the file they locked has been removed, and start a new
+one.
+
+"""
+import os
+import errno
+import fcntl
+import shutil
+import socket
+from contextlib import contextmanager
+
+from six.moves import cPickle as pickle
+
+
+spooldir = '.spool'
+
+#: extension of spool files
+suffix = '.spool'
+
+
+def stamp(datadir):
+    """Get a stamp identifying the rows staged for a dataset.
+
+    Staging rows or removing spool files updates the modification time of
+    the spool directory.
+
+    :Arguments:
+        *datadir*
+            absolute path to the dataset's directory
+
+    :Returns:
+        *stamp*
+            modification time of the spool directory; ``None`` if it doesn't
+            exist
+
+    """
+    try:
+        st = os.stat(os.path.join(datadir, spooldir))
+    except OSError:
+        return None
+
+    return getattr(st, 'st_mtime_ns', st.st_mtime)
+
+
+class Spool(object):
+    """Interface to the spool files of a dataset.
+
+    :Arguments:
+        *datadir*
+            path to the dataset's directory
+
+    """
+    def __init__(self, datadir):
+        self.datadir = datadir
+        self.path = os.path.join(datadir, spooldir)
+
+    def _files(self):
+        """List the paths of all spool files, in order of name.
+
+        """
+        try:
+            names = os.listdir(self.path)
+        except OSError:
+            return []
+
+        return [os.path.join(self.path, name) for name in sorted(names)
+                if name.endswith(suffix)]
+
+    def _open(self, filename, mode, exclusive):
+        """Open and lock a spool file.
+
+        :Returns:
+            *handle*
+                the open file, holding the lock until it is closed; ``None``
+                if the file doesn't exist, or was removed before the lock
+                was acquired
+
+        """
+        try:
+            handle = open(filename, mode)
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return None
+
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        except Exception:
+            handle.close()
+            raise
+
+        try:
+            current = os.stat(filename).st_ino
+        except OSError:
+            current = None
+
+        if current != os.fstat(handle.fileno()).st_ino:
+            handle.close()
+            return None
+
+        return handle
+
+    def _load(self, handle):
+        """Read all records in a spool file.
+
+        A record cut short by a writer that died while writing it is ignored.
+
+        """
+        records = []
+        handle.seek(0)
+        while True:
+            try:
+                records.append(pickle.load(handle))
+            except EOFError:
+                break
+            except pickle.UnpicklingError:
+                break
+
+        return records
+
+    def stage(self, data):
+        """Stage rows in this process's spool file.
+
+        :Arguments:
+            *data*
+                pandas object whose rows are staged
+
+        :Returns:
+            *size*
+                size of this process's spool file after staging, in bytes
+
+        """
+        filename = os.path.join(self.path, '{}-{}{}'.format(
+            socket.gethostname(), os.getpid(), suffix))
+
+        while True:
+            try:
+                os.makedirs(self.path)
+            except OSError:
+                pass
+
+            handle = self._open(filename, 'ab', True)
+            if handle is None:
+                # removed by compaction while waiting for the lock
+                continue
+
+            try:
+                pickle.dump(data, handle, pickle.HIGHEST_PROTOCOL)
+                handle.flush()
+                os.utime(self.path, None)
+
+                return handle.tell()
+            finally:
+                handle.close()
+
+    def staged(self):
+        """Read all staged rows.
+
+        :Returns:
+            *staged*
+                list of staged pandas objects, in the order they were staged
+                by each writer
+
+        """
+        staged = []
+        for filename in self._files():
+            handle = self._open(filename, 'rb', False)
+            if handle is not None:
+                try:
+                    staged.extend(self._load(handle))
+                finally:
+                    handle.close()
+
+        return staged
+
+    def nbytes(self):
+        """Total size of all spool files, in bytes.
+
+        """
+        total = 0
+        for filename in self._files():
+            try:
+                total += os.path.getsize(filename)
+            except OSError:
+                pass
+
+        return total
+
+    def pending(self):
+        """Check if any rows are staged, without reading them.
+
+        """
+        for filename in self._files():
+            try:
+                if os.path.getsize(filename):
+                    return True
+            except OSError:
+                pass
+
+        return False
+
+    @contextmanager
+    def claim(self):
+        """Take all staged rows, removing them from the spool on success.
+
+        All spool files are locked for the duration of the block, which is
+        given the list of staged pandas objects. If the block completes,
+        the spool files are removed; if it raises, they are left in place.
+
+        """
+        handles = []
+        try:
+            staged = []
+            for filename in self._files():
+                handle = self._open(filename, 'rb', True)
+                if handle is not None:
+                    handles.append(handle)
+                    staged.extend(self._load(handle))
+
+            yield staged
+
+            for handle in handles:
+                os.remove(handle.name)
+            if handles:
+                os.utime(self.path, None)
+        finally:
+            for handle in handles:
+                handle.close()
+
+    def remove(self):
+        """Remove the spool directory and all rows staged in it.
+
+        """
+        shutil.rmtree(self.path, ignore_errors=True)
@@ -1,3 +1,5 @@
+import sys
+
 import pandas as pd
 import numpy as np
 import pytest
@@ -55,6 +57,73 @@ class CollectionTests():
                 np.testing.assert_equal(collection.data[self.handle],
                                         agg)
 
+            @pytest.mark.parametrize('workers', [None, 2])
+            def test_add_many(self, collection, datastruct, workers):
+                timings = collection.data.add_many(
+                        {self.handle: datastruct, 'other': datastruct},
+                        workers=workers)
+
+                assert list(timings) == [member.abspath
+                                         for member in collection]
+                for member in collection:
+                    assert sorted(timings[member.abspath]) == ['other',
+                                                               self.handle]
+                    assert member.data.keys() == ['other', self.handle]
+
+            @pytest.mark.parametrize('executor', ['thread', 'process'])
+            def test_retrieve_data_workers(self, collection, datastruct,
+                                           executor):
+                for member in collection:
+                    member.data.add(self.handle, datastruct)
+
+                stored = collection.data.retrieve(self.handle, workers=2,
+                                                  executor=executor)
+                assert list(stored.keys()) == [member.abspath
+                                               for member in collection]
+                np.testing.assert_equal(stored,
+                                        collection.data.retrieve(self.handle))
+
+            @pytest.mark.skipif(sys.version_info < (3, 5),
+                                reason="requires asyncio coroutines")
+            def test_aretrieve(self, collection, datastruct):
+                import asyncio
+
+                for member in collection:
+                    member.data.add(self.handle, datastruct)
+
+                loop = asyncio.new_event_loop()
+                try:
+                    stored = loop.run_until_complete(
+                        collection.data.aretrieve(self.handle))
+                    with pytest.raises(KeyError):
+                        loop.run_until_complete(
+                            collection.data.aretrieve('nonexistent'))
+                finally:
+                    loop.close()
+
+                expected = collection.data.retrieve(self.handle)
+                if isinstance(expected, pd.core.generic.NDFrame):
+                    np.testing.assert_equal(stored.values, expected.values)
+                else:
+                    np.testing.assert_equal(stored, expected)
+
+            @pytest.mark.parametrize('workers', [None, 2])
+            def test_info(self, collection, datastruct, workers):
+                members = list(collection)[:-1]
+                for member in members:
+                    member.data.add(self.handle, datastruct)
+
+                info = collection.data.info(self.handle, workers=workers)
+                assert list(info) == [member.abspath for member in members]
+                for member in members:
+                    expected = member.data.info(self.handle)
+                    for key in ('datatype', 'size', 'mtime', 'shape'):
+                        assert (info[member.abspath].get(key) ==
+                                expected.get(key))
+
+                with pytest.raises(KeyError):
+                    collection.data.info('nonexistent')
+
         class PanelMixin:
             """Mixin class for pandas structures that don't support
             MultiIndexing.
@@ -109,6 +178,78 @@ class CollectionTests():
                         collection.data[self.handle].values,
                         dict2multiindex(agg).values)
 
+            @pytest.mark.parametrize('executor', ['thread', 'process'])
+            def test_retrieve_data_workers(self, collection, datastruct,
+                                           executor):
+                for member in collection:
+                    member.data.add(self.handle, datastruct)
+
+                stored = collection.data.retrieve(self.handle, workers=2,
+                                                  executor=executor)
+                np.testing.assert_equal(
+                        stored.index.values,
+                        collection.data.retrieve(self.handle).index.values)
+                np.testing.assert_equal(
+                        stored.values,
+                        collection.data.retrieve(self.handle).values)
+
+            @pytest.mark.parametrize('prefetch', [0, 2])
+            def test_iter_chunks(self, collection, datastruct, prefetch):
+                for member in collection:
+                    member.data.add(self.handle, datastruct)
+
+                chunks = dict()
+                for member, chunk in collection.data.iter_chunks(
+                        self.handle, chunksize=4000, prefetch=prefetch):
+                    assert len(chunk) <= 4000
+                    chunks.setdefault(member, []).append(chunk)
+
+                assert list(chunks) == [member.abspath
+                                        for member in collection]
+                for member in chunks:
+                    np.testing.assert_equal(pd.concat(chunks[member]).values,
+                                            datastruct.values)
+
+            @pytest.mark.parametrize('agg', ['sum', 'mean',
+                                             ['min', 'max', 'count']])
+            def test_query(self, collection, datastruct, agg):
+                for member in collection:
+                    member.data.add(self.handle, datastruct)
+
+                frame = pd.concat([datastruct] * len(collection))
+                if isinstance(frame, pd.Series):
+                    frame = frame.to_frame()
+
+                stored = collection.data.query(self.handle, agg=agg,
+                                               chunksize=4000)
+                np.testing.assert_allclose(stored.values,
+                                           frame.agg(agg).values)
+
+            def test_query_groupby(self, collection, datastruct):
+                if not (isinstance(datastruct, pd.DataFrame) and
+                        all(isinstance(c, str) for c in datastruct.columns)):
+                    pytest.skip("needs a DataFrame with named columns")
+
+                column = datastruct.columns[0]
+                data = datastruct.assign(group=np.arange(len(datastruct)) % 3)
+                for member in collection:
+                    member.data.add(self.handle, data)
+
+                stored = collection.data.query(
+                    self.handle, agg=['mean', 'count'], columns=[column],
+                    where='{} > 0.5'.format(column), groupby='group',
+                    by='path', chunksize=4000)
+
+                selected = data[data[column] > 0.5]
+                expected = selected.groupby('group')[[column]].agg(
+                    ['mean', 'count'])
+                for member in collection:
+                    np.testing.assert_allclose(
+                        stored.loc[member.abspath].values, expected.values)
+
+                with pytest.raises(ValueError):
+                    collection.data.query(self.handle, agg='median')
+
         class Test_Series(test_data.Series, MultiIndexMixin):
             pass
 
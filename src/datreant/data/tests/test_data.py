@@ -131,3 +131,11 @@ class Dict_Mix():
     def datastruct(self):
         return {'an array': np.random.rand(100, 46),
                 'another': np.random.rand(3, 45, 2)}
+
+
+class Dict_Arrays():
+    @pytest.fixture
+    def datastruct(self):
+        return {'positions': np.random.rand(100000, 3),
+                'masses': np.random.rand(100000),
+                'name': 'arthur'}
@@ -1,4 +1,8 @@
+import os
+import sys
 import random
+import threading
+import subprocess
 import multiprocessing as mp
 import pytest
 import numpy as np
@@ -10,9 +14,14 @@ import datreant.data.attach
 from datreant.core.backends.statefiles import TreantFile
 
 
-def append(treantfilepath, df):
+def append(treantfilepath, df, **kwargs):
     treant = dtr.Treant(treantfilepath)
-    treant.data.append('testdata', df)
+    treant.data.append('testdata', df, **kwargs)
+
+
+def add(treantfilepath, handle, data):
+    treant = dtr.Treant(treantfilepath)
+    treant.data.add(handle, data)
 
 
 class TestTreantFile:
@@ -44,3 +53,79 @@ class TestTreantFile:
         pool.join()
 
         assert len(treant.data['testdata']) == len(dataframe)*(num+0)
+
+    def test_async_buffered_append(self, treant, dataframe):
+        treant.data.add('testdata', dataframe)
+
+        pool = mp.Pool(processes=4)
+        num = 53
+        for i in range(num):
+            pool.apply_async(append, args=(treant.filepath, dataframe),
+                             kwds={'buffered': True, 'buffersize': 20000})
+        pool.close()
+        pool.join()
+
+        assert len(treant.data['testdata']) == len(dataframe)*(num+1)
+
+        treant.data.compact('testdata')
+        assert len(treant.data['testdata']) == len(dataframe)*(num+1)
+
+    def test_add_during_session(self, treant, dataframe):
+        datasets = {'frame': dataframe, 'array': dataframe.values}
+        for handle in datasets:
+            treant.data.add(handle, datasets[handle])
+
+        with treant.data.session():
+            for handle in datasets:
+                treant.data.retrieve(handle)
+
+            # pooled handles must not keep other processes from writing
+            proc = mp.Process(target=add,
+                              args=(treant.filepath, 'array',
+                                    datasets['array'][:10]))
+            proc.start()
+            proc.join()
+            assert proc.exitcode == 0
+
+            # though for pandas datasets, only if the writer has disabled
+            # HDF5's file locks before starting
+            script = ("import sys, numpy, pandas, datreant.core, "
+                      "datreant.data.attach; "
+                      "datreant.core.Treant(sys.argv[1]).data.add('frame', "
+                      "pandas.DataFrame(numpy.random.rand(10, 3)))")
+            env = dict(os.environ, HDF5_USE_FILE_LOCKING='FALSE')
+            subprocess.check_call([sys.executable, '-c', script,
+                                   treant.filepath], env=env)
+
+            for handle in datasets:
+                assert len(treant.data.retrieve(handle)) == 10
+
+    def test_write_during_session_thread(self, treant, dataframe):
+        datasets = {'frame': dataframe, 'array': dataframe.values}
+        for handle in datasets:
+            treant.data.add(handle, datasets[handle])
+
+        errors = []
+
+        def write():
+            try:
+                treant.data.add('frame', dataframe[:10])
+                treant.data.append('frame', dataframe[:10])
+                treant.data.append('array', dataframe.values[:10])
+            except Exception as e:
+                errors.append(e)
+
+        with treant.data.session() as handles:
+            for handle in datasets:
+                treant.data.retrieve(handle)
+            assert len(handles) == 2
+
+            # pooled handles of this thread must not keep others from writing
+            thread = threading.Thread(target=write)
+            thread.start()
+            thread.join()
+            assert errors == []
+            assert len(handles) == 0
+
+            assert len(treant.data.retrieve('frame')) == 20
+            assert len(treant.data.retrieve('array')) == 110
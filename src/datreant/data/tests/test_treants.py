@@ -5,11 +5,26 @@ import pandas as pd
 import numpy as np
 import pytest
 import os
+import shutil
+import pickle
 import py
+import sys
+import multiprocessing as mp
 
+from datreant.data import cache, manifest, shm
+from datreant.data.core import metadata_ops
 from datreant.data.tests import test_data
 
 
+def retrieve_shared(treantpath, handle, indexdir):
+    shared = shm.enable(indexdir=indexdir)
+    try:
+        dtr.Treant(treantpath).data.retrieve(handle)
+        return shared.hits, shared.misses
+    finally:
+        shm.disable()
+
+
 class TestTreant:
     treantname = 'testtreant'
     treanttype = 'Treant'
@@ -60,10 +75,480 @@ class TestTreant:
                 np.testing.assert_equal(treant.data[self.handle],
                                         datastruct)
 
+            @pytest.mark.parametrize('workers', [None, 2])
+            def test_retrieve_many(self, treant, datastruct, workers):
+                handles = ['{}{}'.format(self.handle, i) for i in range(3)]
+                for handle in handles:
+                    treant.data.add(handle, datastruct)
+
+                stored = treant.data.retrieve_many(handles, workers=workers)
+                assert sorted(stored) == handles
+                for handle in handles:
+                    expected = treant.data.retrieve(handle)
+                    if isinstance(expected, pd.core.generic.NDFrame):
+                        np.testing.assert_equal(stored[handle].values,
+                                                expected.values)
+                    else:
+                        np.testing.assert_equal(stored[handle], expected)
+
+                with pytest.raises(KeyError):
+                    treant.data.retrieve_many(handles + ['nonexistent'])
+
+            def test_replace_type(self, treant, datastruct):
+                # datasets of other types are replaced, and their files removed
+                for other in (pd.DataFrame({'A': [1., 2.]}), {'a': 1},
+                              np.arange(3)):
+                    treant.data.add(self.handle, other)
+                treant.data.add(self.handle, datastruct)
+
+                files = os.listdir(os.path.join(treant.abspath, self.handle))
+                assert [name for name in files
+                        if name in manifest.datafiletypes] == [self.datafile]
+
+                many = treant.data.retrieve_many([self.handle])
+                stored = [treant.data.retrieve(self.handle), many[self.handle]]
+                for data in stored:
+                    if isinstance(data, pd.core.generic.NDFrame):
+                        np.testing.assert_equal(data.values, datastruct.values)
+                    else:
+                        np.testing.assert_equal(data, datastruct)
+
+            @pytest.mark.parametrize('workers', [None, 2])
+            def test_add_many(self, treant, datastruct, workers):
+                handles = ['{}{}'.format(self.handle, i) for i in range(3)]
+                timings = treant.data.add_many(
+                        {handle: datastruct for handle in handles},
+                        workers=workers)
+
+                assert sorted(timings) == handles
+                assert treant.data.keys() == handles
+                for handle in handles:
+                    assert os.path.exists(os.path.join(treant.abspath,
+                                                       handle,
+                                                       self.datafile))
+
+            def test_session(self, treant, datastruct):
+                treant.data.add(self.handle, datastruct)
+                datafile = os.path.join(treant.abspath, self.handle,
+                                        self.datafile)
+
+                with treant.data.session(maxopen=1) as handles:
+                    for i in range(3):
+                        stored = treant.data[self.handle]
+                    assert datafile in handles
+
+                    # writing closes the pooled file, and changes are seen
+                    treant.data[self.handle] = datastruct
+                    assert datafile not in handles
+                    stored = treant.data[self.handle]
+
+                    treant.data.add('other', datastruct)
+                    treant.data['other']
+                    assert datafile not in handles
+                    assert len(handles) == 1
+
+                assert len(handles) == 0
+                treant.data.remove(self.handle)
+
+            def test_cache(self, treant, datastruct):
+                results = cache.enable()
+                try:
+                    treant.data.add(self.handle, datastruct)
+                    for i in range(3):
+                        stored = treant.data.retrieve(self.handle)
+                    assert results.hits == 2
+                    assert results.misses == 1
+                    assert len(results) == 1
+
+                    # retrieving several datasets goes through the cache too
+                    treant.data[[self.handle]]
+                    assert results.hits == 3
+
+                    # changes drop cached results for the dataset
+                    treant.data.add(self.handle, datastruct)
+                    assert len(results) == 0
+                    stored = treant.data.retrieve(self.handle)
+                    assert results.misses == 2
+
+                    treant.data.remove(self.handle)
+                    assert len(results) == 0
+                    assert results.nbytes == 0
+                finally:
+                    cache.disable()
+
+            @pytest.mark.skipif(shm.shared_memory is None,
+                                reason="requires shared memory support")
+            def test_shared_cache(self, treant, datastruct, tmpdir):
+                shared = shm.enable(indexdir=str(tmpdir))
+                try:
+                    treant.data.add(self.handle, datastruct)
+                    stored = treant.data.retrieve(self.handle)
+                    assert shared.misses == 1
+
+                    # a sibling process maps what this one read, if shareable
+                    pool = mp.Pool(processes=1)
+                    hits, misses = pool.apply(
+                            retrieve_shared,
+                            args=(treant.abspath, self.handle, str(tmpdir)))
+                    pool.close()
+                    pool.join()
+
+                    if shm.layout(stored)[0] is None:
+                        assert (hits, misses) == (0, 1)
+                        assert len(shared) == 0
+                    else:
+                        assert (hits, misses) == (1, 0)
+                        assert len(shared) == 1
+
+                    treant.data.remove(self.handle)
+                    assert len(shared) == 0
+                finally:
+                    shared.clear()
+                    shm.disable()
+
+            def test_retrieve_metadata_ops(self, treant, datastruct):
+                treant.data.add(self.handle, datastruct)
+
+                before = metadata_ops['listdir']
+                treant.data.retrieve(self.handle)
+                assert metadata_ops['listdir'] - before == 1
+
+            @pytest.mark.skipif(sys.version_info < (3, 5),
+                                reason="requires asyncio coroutines")
+            def test_async(self, treant, datastruct):
+                import asyncio
+                from datreant.data import aio
+
+                handles = ['{}{}'.format(self.handle, i) for i in range(6)]
+                loop = asyncio.new_event_loop()
+                asyncio.set_event_loop(loop)
+                aio.configure(per_filesystem=2)
+                try:
+                    loop.run_until_complete(asyncio.gather(
+                        *[treant.data.aadd(handle, datastruct)
+                          for handle in handles]))
+                    assert treant.data.keys() == handles
+
+                    stored = loop.run_until_complete(asyncio.gather(
+                        *[treant.data.aretrieve(handle)
+                          for handle in handles]))
+                    # calls on the same dataset take turns
+                    stored += loop.run_until_complete(asyncio.gather(
+                        *[coro for i in range(8) for coro in (
+                            treant.data.aadd(handles[0], datastruct),
+                            treant.data.aretrieve(handles[0]))]))[1::2]
+                    for data in stored:
+                        if isinstance(data, pd.core.generic.NDFrame):
+                            np.testing.assert_equal(data.values,
+                                                    datastruct.values)
+                        else:
+                            np.testing.assert_equal(data, datastruct)
+
+                    # a cancelled call that hasn't started never runs
+                    task = loop.create_task(
+                        treant.data.aadd('cancelled', datastruct))
+                    task.cancel()
+                    with pytest.raises(asyncio.CancelledError):
+                        loop.run_until_complete(task)
+                    assert 'cancelled' not in treant.data.keys()
+                finally:
+                    aio.configure(per_filesystem=4)
+                    asyncio.set_event_loop(None)
+                    loop.close()
+
+            def test_info(self, treant, datastruct):
+                treant.data.add(self.handle, datastruct)
+                datafile = os.path.join(treant.abspath, self.handle,
+                                        self.datafile)
+
+                info = treant.data.info(self.handle)
+                assert info['size'] >= os.path.getsize(datafile)
+                assert info['mtime'] == os.path.getmtime(datafile)
+                if isinstance(datastruct, (np.ndarray, pd.Series,
+                                           pd.DataFrame)):
+                    assert info['shape'] == datastruct.shape
+                    assert info['nrows'] == (datastruct.shape[0]
+                                             if datastruct.ndim else None)
+                assert treant.data.nrows(self.handle) == info.get('nrows')
+
+                with pytest.raises(KeyError):
+                    treant.data.info('nonexistent')
+
+            def test_keys(self, treant, datastruct):
+                treant.data.add(self.handle, datastruct)
+                treant.data.add('nested/' + self.handle, datastruct)
+                assert treant.data.keys() == ['nested/testdata', 'testdata']
+
+                # removal at the filesystem level should be reflected
+                shutil.rmtree(os.path.join(treant.abspath, 'nested'))
+                assert treant.data.keys() == ['testdata']
+
+                treant.data.remove(self.handle)
+                assert treant.data.keys() == []
+
+            def test_append_manifest(self, treant, datastruct):
+                if not (isinstance(datastruct, (pd.Series, pd.DataFrame)) or
+                        isinstance(datastruct, np.ndarray) and
+                        datastruct.ndim):
+                    pytest.skip("only pandas objects and arrays have rows")
+
+                mf = os.path.join(treant.abspath, manifest.manifestdir,
+                                  manifest.manifestfile)
+                treant.data.append(self.handle, datastruct)
+                treant.data.append(self.handle, datastruct)
+                assert treant.data.keys() == [self.handle]
+
+                # appends in place leave the manifest untouched, and valid
+                before = os.stat(mf)
+                treant.data.append(self.handle, datastruct)
+                assert os.stat(mf).st_ino == before.st_ino
+                assert os.stat(mf).st_mtime == before.st_mtime
+                assert treant.data._read_manifest() == {
+                    self.handle: self.datafile}
+
+            def test_rebuild_manifest(self, treant, datastruct):
+                treant.data.add(self.handle, datastruct)
+
+                # copy dataset by hand into a directory already present
+                os.makedirs(os.path.join(treant.abspath, 'scratch'))
+                treant.data.keys()
+                shutil.copytree(os.path.join(treant.abspath, self.handle),
+                                os.path.join(treant.abspath, 'scratch',
+                                             self.handle))
+
+                assert treant.data.rebuild_manifest() == ['scratch/testdata',
+                                                          'testdata']
+                assert treant.data.keys() == ['scratch/testdata', 'testdata']
+
         class PandasMixin(DataMixin):
             """Mixin class for pandas tests"""
             datafile = datreant.data.pddata.pddatafile
 
+            def test_iter_chunks(self, treant, datastruct):
+                if not isinstance(datastruct, (pd.Series, pd.DataFrame)):
+                    pytest.skip("rows of stored Panels are not items")
+
+                treant.data.add(self.handle, datastruct)
+                chunksize = max(1, len(datastruct) // 3)
+                chunks = list(treant.data.iter_chunks(self.handle,
+                                                      chunksize=chunksize))
+
+                assert all(len(chunk) <= chunksize for chunk in chunks)
+                np.testing.assert_equal(pd.concat(chunks).values,
+                                        datastruct.values)
+
+            @pytest.mark.parametrize('profile', ['fast-read', 'queryable',
+                                                 'appendable'])
+            def test_profile(self, treant, datastruct, profile):
+                treant.data.add(self.handle, datastruct, profile=profile)
+                assert treant.data.info(self.handle)['profile'] == profile
+                np.testing.assert_equal(treant.data[self.handle].values,
+                                        datastruct.values)
+
+                if isinstance(datastruct, (pd.Series, pd.DataFrame)):
+                    stop = len(datastruct) // 2
+                    np.testing.assert_equal(
+                        treant.data.retrieve(self.handle, stop=stop).values,
+                        datastruct.values[:stop])
+
+                if profile == 'fast-read':
+                    with pytest.raises(ValueError):
+                        treant.data.retrieve(self.handle, where='index > 0')
+
+                # fixed-format objects become tables on first append
+                treant.data.append(self.handle, datastruct)
+                stored = treant.data[self.handle]
+                assert len(stored) == 2 * len(datastruct)
+                if profile == 'fast-read':
+                    assert (treant.data.info(self.handle)['profile'] ==
+                            'appendable')
+
+            def test_data_columns(self, treant, datastruct):
+                if not (isinstance(datastruct, pd.DataFrame) and
+                        all(isinstance(c, str) for c in datastruct.columns)):
+                    pytest.skip("needs a DataFrame with named columns")
+
+                column = datastruct.columns[0]
+                datafile = os.path.join(treant.abspath, self.handle,
+                                        self.datafile)
+
+                def indexed():
+                    with pd.HDFStore(datafile, 'r') as store:
+                        storer = store.get_storer('main')
+                        return (list(storer.data_columns),
+                                sorted(storer.table.colindexes))
+
+                treant.data.add(self.handle, datastruct,
+                                data_columns=[column], index=False,
+                                optlevel=9, kind='full')
+                assert indexed() == ([column], [])
+
+                # indexes are built only when asked for
+                treant.data.append(self.handle, datastruct, index=False)
+                assert indexed() == ([column], [])
+                treant.data.reindex(self.handle)
+                assert indexed() == ([column], sorted([column, 'index']))
+                with pd.HDFStore(datafile, 'r') as store:
+                    table = store.get_storer('main').table
+                    assert table.colindexes[column].optlevel == 9
+                    assert table.colindexes[column].kind == 'full'
+
+                stored = treant.data.retrieve(
+                    self.handle, where='{} > 0.5'.format(column))
+                assert len(stored) == 2 * (datastruct[column] > 0.5).sum()
+
+                def nindexed():
+                    with pd.HDFStore(datafile, 'r') as store:
+                        table = store.get_storer('main').table
+                        return table.colindexes[column].nelements
+
+                # existing indexes are brought up to date only when asked for
+                treant.data.append(self.handle, datastruct, index=False)
+                assert nindexed() == 2 * len(datastruct)
+                stored = treant.data.retrieve(
+                    self.handle, where='{} > 0.5'.format(column))
+                assert len(stored) == 3 * (datastruct[column] > 0.5).sum()
+                treant.data.reindex(self.handle)
+                assert nindexed() == 3 * len(datastruct)
+
+                treant.data.add('array', np.zeros(3))
+                with pytest.raises(TypeError):
+                    treant.data.reindex('array')
+
+            @pytest.mark.parametrize('profile', ['fast-read', 'queryable'])
+            def test_recompress(self, treant, datastruct, profile):
+                datafile = os.path.join(treant.abspath, self.handle,
+                                        self.datafile)
+
+                def compression():
+                    with pd.HDFStore(datafile, 'r') as store:
+                        group = store.get_storer('main').group
+                        return set((leaf.filters.complib,
+                                    leaf.filters.complevel)
+                                   for leaf in group._f_walknodes('Leaf')
+                                   if leaf.filters.complevel)
+
+                treant.data.add(self.handle, datastruct, profile=profile)
+                if profile == 'fast-read':
+                    assert compression() == set()
+
+                treant.data.recompress(self.handle, complib='zlib',
+                                       complevel=1)
+                assert compression() == {('zlib', 1)}
+                assert treant.data.info(self.handle)['profile'] == profile
+                np.testing.assert_equal(treant.data[self.handle].values,
+                                        datastruct.values)
+
+                # compression can also be set for the whole Tree
+                treant.data.set_defaults('pandas', complib='blosc:lz4',
+                                         complevel=1)
+                treant.data.add(self.handle, datastruct, profile=profile)
+                assert compression() == {('blosc:lz4', 1)}
+
+                treant.data.add('array', np.zeros(3))
+                with pytest.raises(TypeError):
+                    treant.data.recompress('array')
+
+            def test_tail(self, treant, datastruct):
+                if not isinstance(datastruct, (pd.Series, pd.DataFrame)):
+                    pytest.skip("rows of stored Panels are not items")
+
+                treant.data.add(self.handle, datastruct)
+                treant.data.append(self.handle, datastruct)
+                nrows = len(datastruct)
+                assert treant.data.nrows(self.handle) == 2 * nrows
+
+                tail = max(1, nrows // 4)
+                np.testing.assert_equal(
+                    treant.data.retrieve(self.handle, start=-tail).values,
+                    datastruct.values[-tail:])
+                np.testing.assert_equal(
+                    treant.data.retrieve(self.handle, start=-nrows - tail,
+                                         stop=-nrows).values,
+                    datastruct.values[-tail:])
+
+            def test_buffered_append(self, treant, datastruct):
+                if not isinstance(datastruct, (pd.Series, pd.DataFrame)):
+                    pytest.skip("rows of stored Panels are not items")
+
+                spooldir = os.path.join(treant.abspath, self.handle,
+                                        datreant.data.spool.spooldir)
+                expected = pd.concat([datastruct] * 3).values
+
+                # a new dataset is stored directly
+                treant.data.append(self.handle, datastruct, buffered=True)
+                assert not os.path.exists(spooldir)
+
+                treant.data.append(self.handle, datastruct, buffered=True)
+                treant.data.append(self.handle, datastruct, buffered=True)
+                assert os.listdir(spooldir)
+
+                # staged rows follow the stored ones
+                np.testing.assert_equal(treant.data[self.handle].values,
+                                        expected)
+                assert (treant.data.info(self.handle)['nrows'] ==
+                        len(expected))
+                start = len(datastruct) // 2
+                stop = len(expected) - start
+                np.testing.assert_equal(
+                    treant.data.retrieve(self.handle, start=start,
+                                         stop=stop).values,
+                    expected[start:stop])
+
+                # selections with where include staged rows, without storing
+                # them
+                half = len(datastruct) // 2
+                np.testing.assert_equal(
+                    treant.data.retrieve(
+                        self.handle, where='index < {}'.format(half)).values,
+                    pd.concat([datastruct[:half]] * 3).values)
+                assert os.listdir(spooldir)
+
+                assert treant.data.compact(self.handle) == 2 * len(datastruct)
+                assert not os.listdir(spooldir)
+                assert treant.data.compact(self.handle) == 0
+                np.testing.assert_equal(treant.data[self.handle].values,
+                                        expected)
+
+                # replacing the dataset drops staged rows
+                treant.data.append(self.handle, datastruct, buffered=True)
+                treant.data.add(self.handle, datastruct)
+                np.testing.assert_equal(treant.data[self.handle].values,
+                                        datastruct.values)
+
+                # appending directly stores staged rows first
+                treant.data.append(self.handle, datastruct, buffered=True)
+                treant.data.append(self.handle, datastruct)
+                assert not os.listdir(spooldir)
+                np.testing.assert_equal(treant.data[self.handle].values,
+                                        expected)
+
+                treant.data.append(self.handle, datastruct, buffered=True)
+                treant.data.remove(self.handle)
+                assert not os.path.exists(spooldir)
+
+                with pytest.raises(TypeError):
+                    treant.data.append('array', np.zeros(3), buffered=True)
+
+            def test_lazy(self, treant, datastruct):
+                if not isinstance(datastruct, (pd.Series, pd.DataFrame)):
+                    pytest.skip("rows of stored Panels are not items")
+
+                treant.data.add(self.handle, datastruct)
+                proxy = treant.data.lazy[self.handle]
+
+                assert proxy.datatype == 'pandas'
+                assert len(proxy) == len(datastruct)
+                assert proxy.shape == datastruct.shape
+                if isinstance(datastruct, pd.DataFrame):
+                    assert proxy.columns == list(datastruct.columns)
+                    column = datastruct.columns[0]
+                    np.testing.assert_equal(proxy[column].values,
+                                            datastruct[column].values)
+
+                np.testing.assert_equal(proxy[2:5].values,
+                                        datastruct[2:5].values)
+
             def test_retrieve_data(self, treant, datastruct):
                 treant.data.add(self.handle, datastruct)
                 np.testing.assert_equal(
@@ -114,6 +599,195 @@ class TestTreant:
             """Test numpy datastructure storage and retrieval"""
             datafile = datreant.data.npdata.npdatafile
 
+            def test_retrieve_selection(self, treant, datastruct):
+                if datastruct.ndim == 0:
+                    pytest.skip("scalars cannot be sliced")
+
+                treant.data.add(self.handle, datastruct)
+                np.testing.assert_equal(
+                        treant.data.retrieve(self.handle, start=-3),
+                        datastruct[-3:])
+                np.testing.assert_equal(
+                        treant.data.retrieve(self.handle, start=1, stop=8,
+                                             step=2),
+                        datastruct[1:8:2])
+
+                index = (slice(0, 2),) + (0,) * (datastruct.ndim - 1)
+                np.testing.assert_equal(
+                        treant.data.retrieve(self.handle, index=index),
+                        datastruct[index])
+
+            def test_append_data(self, treant, datastruct):
+                if datastruct.ndim == 0:
+                    with pytest.raises(ValueError):
+                        treant.data.append(self.handle, datastruct)
+                    return
+
+                # first append to stored array converts it to appendable
+                treant.data.add(self.handle, datastruct)
+                for i in range(3):
+                    treant.data.append(self.handle, datastruct)
+
+                np.testing.assert_equal(treant.data.retrieve(self.handle),
+                                        np.concatenate([datastruct]*4))
+
+            def test_append_chunks(self, treant, datastruct):
+                if datastruct.ndim == 0:
+                    pytest.skip("scalars cannot be appended to")
+
+                # chunks hold many rows, even if the first append doesn't
+                for first in (datastruct[:1], datastruct[:0]):
+                    treant.data.append(self.handle, first)
+                    for i in range(3):
+                        treant.data.append(self.handle, datastruct)
+
+                    np.testing.assert_equal(
+                            treant.data.retrieve(self.handle),
+                            np.concatenate([first] + [datastruct]*3))
+                    chunks = treant.data.info(self.handle)['chunks']
+                    assert chunks[0] == datreant.data.npdata.guess_chunks(
+                        datastruct.shape, datastruct.dtype,
+                        unlimited=True)[0]
+                    treant.data.remove(self.handle)
+
+            def test_retrieve_mmap(self, treant, datastruct):
+                treant.data.add(self.handle, datastruct)
+                stored = treant.data.retrieve(self.handle, mmap=True)
+                np.testing.assert_equal(stored, datastruct)
+
+                if datastruct.ndim > 0:
+                    assert isinstance(stored, np.memmap)
+                    assert not stored.flags.writeable
+
+                    np.testing.assert_equal(
+                            treant.data.retrieve(self.handle, start=1,
+                                                 stop=3, mmap=True),
+                            datastruct[1:3])
+
+                # compressed data can't be mapped, so is read as usual
+                treant.data.add(self.handle, datastruct, compression='gzip')
+                stored = treant.data.retrieve(self.handle, mmap=True)
+                assert not isinstance(stored, np.memmap)
+                np.testing.assert_equal(stored, datastruct)
+
+            def test_replace_mmap(self, treant, datastruct):
+                treant.data.add(self.handle, datastruct)
+                stored = treant.data.retrieve(self.handle, mmap=True)
+
+                # a map in use keeps its data when the array is replaced
+                treant.data.add(self.handle, np.zeros(1))
+                np.testing.assert_equal(stored, datastruct)
+                np.testing.assert_equal(treant.data.retrieve(self.handle),
+                                        np.zeros(1))
+
+            def test_lazy(self, treant, datastruct):
+                treant.data.add(self.handle, datastruct)
+                proxy = treant.data.lazy[self.handle]
+
+                assert proxy.datatype == 'numpy'
+                assert proxy.shape == datastruct.shape
+                assert proxy.dtype == datastruct.dtype
+
+                if datastruct.ndim > 0:
+                    np.testing.assert_equal(proxy[1:3], datastruct[1:3])
+                    np.testing.assert_equal(proxy[0], datastruct[0])
+
+            def test_iter_chunks(self, treant, datastruct):
+                treant.data.add(self.handle, datastruct)
+                if datastruct.ndim == 0:
+                    chunksize = 1
+                else:
+                    chunksize = max(1, len(datastruct) // 3)
+                chunks = list(treant.data.iter_chunks(self.handle,
+                                                      chunksize=chunksize))
+
+                if datastruct.ndim == 0:
+                    np.testing.assert_equal(chunks, [datastruct])
+                else:
+                    assert all(len(chunk) <= chunksize for chunk in chunks)
+                    np.testing.assert_equal(np.concatenate(chunks),
+                                            datastruct)
+
+            def test_cache_readonly(self, treant, datastruct):
+                cache.enable()
+                try:
+                    treant.data.add(self.handle, datastruct)
+                    first = treant.data.retrieve(self.handle)
+                    second = treant.data.retrieve(self.handle)
+                    assert not second.flags.writeable
+                    np.testing.assert_equal(second, datastruct)
+
+                    # selections using arrays are not cached
+                    if datastruct.ndim > 0:
+                        selected = treant.data.retrieve(
+                                self.handle, index=np.array([0]))
+                        assert selected.flags.writeable
+                finally:
+                    cache.disable()
+
+            @pytest.mark.skipif(shm.shared_memory is None,
+                                reason="requires shared memory support")
+            def test_shared_cache_refs(self, treant, datastruct, tmpdir):
+                import gc
+
+                shared = shm.enable(indexdir=str(tmpdir))
+                indexfile = os.path.join(str(tmpdir), shm.indexfile)
+
+                def refs():
+                    with shared._index.read() as state:
+                        return [entry['refs'] for entry
+                                in state['segments'].values()]
+
+                try:
+                    treant.data.add(self.handle, datastruct)
+                    first = treant.data.retrieve(self.handle)
+                    if shm.layout(first)[0] is None:
+                        pytest.skip("retrieved as a numpy scalar")
+                    assert refs() == [[str(os.getpid())]]
+
+                    # hits on a segment already held leave the index alone
+                    with open(indexfile) as f:
+                        before = f.read()
+                    os.remove(indexfile)
+                    second = treant.data.retrieve(self.handle)
+                    assert shared.hits == 1
+                    assert not os.path.exists(indexfile)
+                    with open(indexfile, 'w') as f:
+                        f.write(before)
+                    np.testing.assert_equal(second, datastruct)
+
+                    # results collected while the lock is held are released
+                    # once it is free, without deadlocking
+                    with shared._lock:
+                        del first
+                        gc.collect()
+                    assert refs() == [[str(os.getpid())]]
+
+                    del second
+                    gc.collect()
+                    assert refs() == [[]]
+                finally:
+                    shared.clear()
+                    shm.disable()
+
+            def test_add_compressed(self, treant, datastruct):
+                treant.data.add(self.handle, datastruct, compression='gzip',
+                                compression_opts=4, shuffle=True)
+                np.testing.assert_equal(treant.data.retrieve(self.handle),
+                                        datastruct)
+
+            def test_defaults(self, treant, datastruct):
+                treant.data.set_defaults('numpy', compression='gzip')
+                assert treant.data.get_defaults('numpy') == {
+                        'compression': 'gzip'}
+
+                treant.data.add(self.handle, datastruct)
+                np.testing.assert_equal(treant.data.retrieve(self.handle),
+                                        datastruct)
+
+                treant.data.set_defaults('numpy', compression=None)
+                assert treant.data.get_defaults('numpy') == {}
+
         class Test_NumpyScalar(test_data.NumpyScalar, NumpyMixin):
             pass
 
@@ -139,6 +813,90 @@ class TestTreant:
             """Test pandas datastructure storage and retrieval"""
             datafile = datreant.data.pydata.pydatafile
 
+            def test_lazy(self, treant, datastruct):
+                treant.data.add(self.handle, datastruct)
+                proxy = treant.data.lazy[self.handle]
+
+                assert proxy.datatype == 'python'
+                assert proxy.shape is None
+                np.testing.assert_equal(proxy.retrieve(), datastruct)
+
+            @pytest.mark.skipif(datreant.data.pydata.PickleBuffer is None,
+                                reason="requires pickle protocol 5")
+            def test_out_of_band(self, treant, datastruct):
+                buffersfile = os.path.join(treant.abspath, self.handle,
+                                           datreant.data.pydata.pybuffersfile)
+
+                treant.data.add(self.handle, datastruct, oob_threshold=0)
+                stored = treant.data.retrieve(self.handle)
+                np.testing.assert_equal(stored, datastruct)
+
+                arrays = isinstance(datastruct, dict) and any(
+                    isinstance(v, np.ndarray) for v in datastruct.values())
+                assert os.path.exists(buffersfile) == arrays
+                if arrays:
+                    # arrays are mapped copy-on-write from the sidecar
+                    for value in stored.values():
+                        if isinstance(value, np.ndarray):
+                            value[...] = 0
+                    np.testing.assert_equal(treant.data[self.handle],
+                                            datastruct)
+
+                # stored again without out-of-band buffers
+                treant.data.add(self.handle, datastruct, oob_threshold=None)
+                assert not os.path.exists(buffersfile)
+                np.testing.assert_equal(treant.data[self.handle], datastruct)
+
+                # empty arrays are kept in-band, alone or with others
+                empty = {'a': np.zeros(0)}
+                treant.data.add(self.handle, empty, oob_threshold=0)
+                assert not os.path.exists(buffersfile)
+                np.testing.assert_equal(treant.data[self.handle], empty)
+
+                # with nothing out-of-band, a plain pickle is written
+                datafile = os.path.join(treant.abspath, self.handle,
+                                        self.datafile)
+                for small in (empty, {'a': 1, 'b': np.arange(3)}):
+                    treant.data.add(self.handle, small)
+                    with open(datafile, 'rb') as f:
+                        np.testing.assert_equal(pickle.load(f), small)
+
+                empty['b'] = np.ones(3)
+                treant.data.add(self.handle, empty, oob_threshold=0)
+                assert os.path.exists(buffersfile)
+                np.testing.assert_equal(treant.data[self.handle], empty)
+
+                treant.data.add(self.handle, datastruct, oob_threshold=0)
+                treant.data.remove(self.handle)
+                assert not os.path.exists(os.path.join(treant.abspath,
+                                                       self.handle))
+
+            @pytest.mark.parametrize('compression',
+                                     list(datreant.data.pydata.compressions))
+            def test_compressed(self, treant, datastruct, compression):
+                if (compression not in
+                        datreant.data.pydata.available_compressions()):
+                    pytest.skip("{} not installed".format(compression))
+
+                treant.data.add(self.handle, datastruct,
+                                compression=compression)
+                np.testing.assert_equal(treant.data[self.handle], datastruct)
+
+                datafile = os.path.join(treant.abspath, self.handle,
+                                        self.datafile)
+                with open(datafile, 'rb') as f:
+                    assert f.read().startswith(
+                        datreant.data.pydata.compressions[compression])
+
+                # compression can also be set for the whole Tree
+                treant.data.set_defaults('python', compression=compression)
+                treant.data.add('other', datastruct)
+                np.testing.assert_equal(treant.data['other'], datastruct)
+                with open(os.path.join(treant.abspath, 'other',
+                                       self.datafile), 'rb') as f:
+                    assert f.read().startswith(
+                        datreant.data.pydata.compressions[compression])
+
             def test_overwrite_data(self, treant, datastruct):
                 treant.data[self.handle] = datastruct
 
@@ -146,6 +904,20 @@ class TestTreant:
                 treant.data[self.handle] = 23
                 assert treant.data[self.handle] == 23
 
+            def test_append_other_type(self, treant, datastruct):
+                treant.data.add(self.handle, datastruct)
+                assert treant.data.keys() == [self.handle]
+
+                # an array appended alongside is not what reads pick, so the
+                # manifest keeps recording the pickle
+                treant.data.append(self.handle, np.arange(3))
+                assert treant.data._read_manifest() == {
+                    self.handle: self.datafile}
+                assert treant.data.info(self.handle)['datatype'] == 'python'
+                np.testing.assert_equal(
+                    treant.data.retrieve_many([self.handle])[self.handle],
+                    treant.data.retrieve(self.handle))
+
         class Test_List(test_data.List, PythonMixin):
             pass
 
@@ -160,3 +932,6 @@ class TestTreant:
 
         class Test_Dict_Mix(test_data.Dict_Mix, PythonMixin):
             pass
+
+        class Test_Dict_Arrays(test_data.Dict_Arrays, PythonMixin):
+            pass